@@ -0,0 +1,99 @@
+"""Time the hough and geometric circle classifiers on the example and wiki images
+and report where they disagree. Run with `python -m benchmarks.circles` from the
+repo root."""
+import argparse
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+
+from shapes.parser import Parser
+
+ROOT = Path(__file__).absolute().parent.parent
+IMAGE_DIRS = ("examples", "wiki_assets")
+
+
+def get_contours(path):
+    masks = Parser(str(path)).get_masks()
+    contours, _ = cv2.findContours(masks.shape, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return contours, masks.shape
+
+
+def hough(contours, mask):
+    results = []
+    for i, cnt in enumerate(contours):
+        # get_shapes treats a failing check as not a circle, do the same here
+        try:
+            results.append(bool(Parser.check_is_circle(cnt, mask, i)))
+        except Exception:
+            results.append(False)
+    return results
+
+
+def geometric(contours, mask):
+    return [bool(Parser.check_is_circle_geometric(cnt)) for cnt in contours]
+
+
+def timed(classify, contours, mask):
+    begin = perf_counter()
+    results = classify(contours, mask)
+    return results, perf_counter() - begin
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "images", nargs="*", help="images to check, defaults to the example and wiki images"
+    )
+    args = arg_parser.parse_args()
+
+    images = [Path(i) for i in args.images]
+    if len(images) == 0:
+        for image_dir in IMAGE_DIRS:
+            images.extend(sorted(ROOT.joinpath(image_dir).glob("*.png")))
+
+    total_hough = 0
+    total_geometric = 0
+    total_contours = 0
+    total_agreed = 0
+    disagreements = []
+
+    print(f"|{'image':<24}|{'contours':>9}|{'hough (ms)':>11}|{'geometric (ms)':>15}|{'agree':>7}|")
+    for image in images:
+        contours, mask = get_contours(image)
+        by_hough, hough_time = timed(hough, contours, mask)
+        by_geometric, geometric_time = timed(geometric, contours, mask)
+
+        agreed = sum(a == b for a, b in zip(by_hough, by_geometric))
+        for i, (a, b) in enumerate(zip(by_hough, by_geometric)):
+            if a != b:
+                disagreements.append((image.name, i, a, b))
+
+        total_hough += hough_time
+        total_geometric += geometric_time
+        total_contours += len(contours)
+        total_agreed += agreed
+        print(
+            f"|{image.name:<24}|{len(contours):>9}|{hough_time * 1e3:>11.1f}|{geometric_time * 1e3:>15.1f}|{agreed / max(len(contours), 1):>7.1%}|"
+        )
+
+    print(
+        f"|{'total':<24}|{total_contours:>9}|{total_hough * 1e3:>11.1f}|{total_geometric * 1e3:>15.1f}|{total_agreed / max(total_contours, 1):>7.1%}|"
+    )
+    print(f"geometric is {total_hough / max(total_geometric, 1e-9):.1f}x faster")
+
+    if len(disagreements) > 0:
+        print()
+        print("disagreements (contour index in findContours order):")
+        for name, i, a, b in disagreements:
+            print(f"  {name} #{i}: hough says {a}, geometric says {b}")
+
+    for image_dir in IMAGE_DIRS:
+        debugging = ROOT.joinpath(image_dir, "debugging")
+        # Parser always makes a debugging dir next to the image, don't leave empty ones behind
+        if debugging.is_dir() and not any(debugging.iterdir()):
+            debugging.rmdir()
+
+
+if __name__ == "__main__":
+    main()
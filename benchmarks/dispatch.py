@@ -0,0 +1,176 @@
+"""Per-opcode latency of Interpreter.step with the old if/elif dispatch and the
+dispatch table. Run with `python -m benchmarks.dispatch` from the repo root.
+
+The old step is the one shapes/interpreter.py had at --before, taken out of git,
+so it's measured as it was and not as a copy of it"""
+import argparse
+import contextlib
+import io
+import subprocess
+import types
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from shapes.interpreter import Interpreter
+from shapes.shape import Shape, ShapeEnum
+
+# opcodes that need a terminal or a file aren't measured
+SKIPPED = (ShapeEnum.IN, ShapeEnum.READ)
+# the last commit before Interpreter.step went through the opcode table
+BEFORE = "37a841a^"
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_interpreter(revision):
+    """The Interpreter class of shapes/interpreter.py as it was at revision, or None
+    if git can't find it"""
+    try:
+        source = subprocess.run(
+            ["git", "show", f"{revision}:shapes/interpreter.py"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    module = types.ModuleType(f"interpreter_{revision}")
+    exec(compile(source, f"{revision}:shapes/interpreter.py", "exec"), module.__dict__)
+    return module.Interpreter
+
+
+class LegacyInterpreter(Interpreter):
+    """Dispatches the way Interpreter.step used to, one comparison at a time, but
+    runs today's op_ methods. Only used when the old step can't be loaded, so its
+    numbers are an approximation"""
+
+    def step(self):
+        self.previous = self.current
+        shape_type = self.current.get_shape_type()
+        if shape_type == ShapeEnum.START:
+            self.op_start()
+        elif shape_type == ShapeEnum.IN:
+            self.op_in()
+        elif shape_type == ShapeEnum.OUT:
+            self.op_out()
+        elif shape_type == ShapeEnum.OUT_NO_LF:
+            self.op_out_no_lf()
+        elif shape_type == ShapeEnum.READ:
+            self.op_read()
+        elif shape_type == ShapeEnum.CONTAINER:
+            self.op_container()
+        elif shape_type == ShapeEnum.STACK:
+            self.op_stack()
+        elif shape_type == ShapeEnum.JUNCTION:
+            self.op_junction()
+        elif shape_type == ShapeEnum.NUMBER:
+            self.op_number()
+        elif shape_type == ShapeEnum.POP:
+            self.op_pop()
+        elif shape_type == ShapeEnum.DUPE:
+            self.op_dupe()
+        elif shape_type == ShapeEnum.NUMBER_CHECK:
+            self.op_number_check()
+        elif shape_type == ShapeEnum.TO_STRING:
+            self.op_to_string()
+        elif shape_type == ShapeEnum.TO_CHAR:
+            self.op_to_char()
+        elif shape_type == ShapeEnum.CHR_TO_NUM:
+            self.op_chr_to_num()
+        elif shape_type == ShapeEnum.TO_NUMBER:
+            self.op_to_number()
+        elif shape_type == ShapeEnum.OPER:
+            self.op_oper()
+        elif shape_type == ShapeEnum.OR:
+            self.op_or()
+        elif shape_type == ShapeEnum.AND:
+            self.op_and()
+        elif shape_type == ShapeEnum.NOT:
+            self.op_not()
+        elif shape_type == ShapeEnum.EQUALS:
+            self.op_equals()
+        elif shape_type == ShapeEnum.LARGER:
+            self.op_larger()
+        elif shape_type == ShapeEnum.SMALLER:
+            self.op_smaller()
+        elif shape_type == ShapeEnum.LENGTH:
+            self.op_length()
+        elif shape_type == ShapeEnum.CONTROL:
+            self.op_control()
+        elif shape_type == ShapeEnum.END:
+            self.op_end()
+        elif shape_type == ShapeEnum.ANY:
+            self.op_any()
+        self.steps += 1
+
+
+def looping_program(shape_type):
+    """A start shape and a single shape of the given type whose paths lead back to itself"""
+    empty = np.zeros((0, 1, 2), np.int32)
+
+    start = Shape(empty, True, center=(0, 0))
+    start.freeze(ShapeEnum.START)
+    if shape_type == ShapeEnum.START:
+        start.connect_shape(0, start, (0, 0), (0, 0))
+        return [start], start
+
+    shape = Shape(empty, False, center=(0, 0))
+    if shape_type in (ShapeEnum.NUMBER, ShapeEnum.OPER):
+        hole = Shape(empty, False, center=(0, 0))
+        hole.outer = shape
+        shape.add_inside(hole)
+        hole.freeze(ShapeEnum.ANY)
+    shape.freeze(shape_type)
+    shape.connect_shape(0, shape, (0, 0), (10, 0))
+    shape.connect_shape(1, shape, (10, 0), (0, 0))
+    start.connect_shape(2, shape, (0, 0), (0, 0))
+
+    return [start, shape], shape
+
+
+def time_steps(interpreter_class, shape_type, steps):
+    shapes, shape = looping_program(shape_type)
+    interpreter = interpreter_class(shapes, time=0)
+    interpreter.p_point = (0, 0)
+    stack = interpreter.stack
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        begin = perf_counter()
+        for _ in range(steps):
+            stack[:] = [2, 3]
+            interpreter.current = shape
+            interpreter.step()
+        end = perf_counter()
+
+    return (end - begin) / steps
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("-n", "--steps", type=int, default=20000)
+    arg_parser.add_argument(
+        "--before", default=BEFORE, help="the git revision to take the old Interpreter.step from"
+    )
+    args = arg_parser.parse_args()
+
+    old_interpreter = load_interpreter(args.before)
+    if old_interpreter is None:
+        print(f"|couldn't load shapes/interpreter.py at {args.before}, the if/elif numbers are approximate|")
+        old_interpreter = LegacyInterpreter
+
+    print(f"|{'opcode':<14}|{'if/elif (ns)':>14}|{'table (ns)':>12}|{'speedup':>9}|")
+    for shape_type in ShapeEnum:
+        if shape_type in SKIPPED:
+            continue
+        # best of a few interleaved runs to keep noise out of the comparison
+        before = min(time_steps(old_interpreter, shape_type, args.steps) for _ in range(3))
+        after = min(time_steps(Interpreter, shape_type, args.steps) for _ in range(3))
+        print(
+            f"|{shape_type.name:<14}|{before * 1e9:>14.0f}|{after * 1e9:>12.0f}|{before / after:>8.2f}x|"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""Time every stage of the parser and how fast the engine runs programs, on the
+example images and on synthetic programs that grow one dimension at a time: shape
+count, path count, hole depth and resolution. Run with `python -m benchmarks.suite`
+from the repo root. The results are printed as json, give --baseline the json of
+an earlier run to flag what got slower since."""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+from math import ceil, sqrt
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from shapes.__main__ import add_parser_arguments, get_parser_options, get_parser_resources
+from shapes.batch import BatchTimeout, clear_timeout, set_timeout
+from shapes.engine import Engine
+from shapes.generator import compare_graph, generate
+from shapes.interpreter import Interpreter
+from shapes.parser import Parser
+from shapes.program import lower
+
+ROOT = Path(__file__).absolute().parent.parent
+IMAGE_DIRS = ("examples",)
+# bump this when the layout of the json or the synthetic programs change
+RESULTS_VERSION = 4
+
+# (series, what grows, sizes). everything that doesn't grow stays at SYNTHETIC_DEFAULTS
+SYNTHETIC_SERIES = (
+    ("shapes", "shapes", (16, 64, 256)),
+    ("paths", "paths", (0, 20, 40)),
+    ("holes", "hole_depth", (1, 3, 5)),
+    ("scale", "scale", (0.5, 1, 2)),
+)
+SYNTHETIC_DEFAULTS = {"shapes": 16, "paths": 0, "hole_depth": 1, "scale": 0.5}
+# the paths series needs enough rows for its extra paths to go between
+SYNTHETIC_SERIES_DEFAULTS = {"paths": {"shapes": 64}}
+# what a synthetic program goes through between its start and end, over and over
+SYNTHETIC_CYCLE = ("number", "junction", "pop")
+
+# a stage has to get at least this much slower to be a regression, in seconds. a few
+# ms come and go between runs of the same tree, whatever the percentage
+MIN_REGRESSION_DELTA = 0.01
+# a single parse is too noisy to compare, a stage is only compared when both runs
+# took the best of at least this many
+MIN_COMPARED_REPEAT = 3
+# and steps/s only when both ran the engine for at least this long, in seconds
+MIN_COMPARED_RUN_TIME = 0.25
+
+
+def describe_program(shapes, paths=0, hole_depth=1):
+    """A generator description of a program with the given number of shapes laid out
+    in a grid, from a start in the top left snaking down to an end, with paths extra
+    paths between rows. Between start and end it cycles through a number with
+    hole_depth nested holes, a junction and a pop, so it runs without any input"""
+    if shapes < 2:
+        raise ValueError("A program needs at least a start and an end")
+
+    columns = ceil(sqrt(shapes))
+    rows = ceil(shapes / columns)
+
+    # snaking keeps every shape next to the one after it
+    cells = []
+    for row in range(rows):
+        row_cells = [(c, row) for c in range(columns)]
+        cells.extend(row_cells if row % 2 == 0 else row_cells[::-1])
+    cells = cells[:shapes]
+    order = {c: i for i, c in enumerate(cells)}
+
+    links = [(i, i + 1) for i in range(shapes - 1)]
+    # start and end only ever get the one path
+    spare = [
+        (order[(c, row)], order[(c, row + 1)])
+        for c, row in cells
+        if (c, row + 1) in order
+        and abs(order[(c, row + 1)] - order[(c, row)]) > 1
+        and 0 < order[(c, row)]
+        and order[(c, row + 1)] < shapes - 1
+    ]
+    if paths > len(spare):
+        raise ValueError(f"{shapes} shapes only have room for {len(spare)} extra paths")
+    # spread out instead of all in the first rows
+    links.extend(spare[int(i)] for i in np.linspace(0, len(spare), paths, endpoint=False))
+
+    number = "5" + "".join(" (1" for _ in range(hole_depth)) + ")" * hole_depth
+    outlines = {"start": "1 (3)", "end": "1 (4)", "number": number, "junction": "4", "pop": "6*"}
+
+    lines = []
+    for i, (column, row) in enumerate(cells):
+        if i == 0:
+            kind = "start"
+        elif i == shapes - 1:
+            kind = "end"
+        else:
+            kind = SYNTHETIC_CYCLE[(i - 1) % len(SYNTHETIC_CYCLE)]
+        lines.append(f"s{i} = {outlines[kind]} @ {column} {row}")
+    lines.extend(f"s{a} - s{b}" for a, b in links)
+    return "\n".join(lines)
+
+
+def parse_stages(path, options):
+    """A parse of the image, as (shapes, parser, seconds every stage of it took)"""
+    parser = Parser(str(path), **options)
+    shapes = parser.parse_shapes()
+    return shapes, parser, {name: s["time"] for name, s in parser.timings.stages.items()}
+
+
+def time_parse(path, options, repeat):
+    """Best of repeat parses, stage by stage"""
+    best = None
+    for _ in range(repeat):
+        shapes, parser, stages = parse_stages(path, options)
+        if best is None:
+            best = stages
+        else:
+            best = {stage: min(best.get(stage, t), t) for stage, t in stages.items()}
+    return shapes, parser, best
+
+
+def time_run(shapes, home_dir, budget):
+    """Steps per second of the engine, running the program over and over with an
+    empty stdin until budget seconds are up. Programs that never end just get
+    stopped when time is up"""
+    result = {"steps": 0, "run_time": 0.0, "steps_per_second": None, "run_error": None}
+    stdin = sys.stdin
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            program = lower(shapes, Interpreter(shapes, home_dir=home_dir).current)
+        while result["run_time"] < budget:
+            sys.stdin = io.StringIO()
+            engine = Engine(program, home_dir=home_dir)
+            begin = perf_counter()
+            set_timeout(budget - result["run_time"])
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    engine.run()
+            finally:
+                clear_timeout()
+                result["run_time"] += perf_counter() - begin
+                result["steps"] += engine.steps
+    except BatchTimeout:
+        # time's up, wherever it happened to be
+        pass
+    except (Exception, SystemExit) as e:
+        result["run_error"] = f"{type(e).__name__}: {e}"
+    finally:
+        sys.stdin = stdin
+
+    # a program that stops early on an error says more about the error than the engine
+    if result["steps"] > 0 and result["run_error"] is None:
+        result["steps_per_second"] = result["steps"] / result["run_time"]
+    return result
+
+
+def benchmark(path, options, repeat, run_budget, graph=None):
+    """Parse stages and engine speed of an image. With the graph it was generated
+    with, also everything the parser got wrong about it"""
+    result = {"image": str(path)}
+    try:
+        shapes, parser, stages = time_parse(path, options, repeat)
+    except (Exception, SystemExit) as e:
+        result["parse_error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    height, width = parser.img.shape[:2]
+    result["size"] = [width, height]
+    result["shapes"] = sum(s.outer is None for s in shapes)
+    result["holes"] = sum(s.outer is not None for s in shapes)
+    result["connections"] = sum(len(s.connecteds) for s in shapes)
+    result["stages"] = stages
+    result["parse_time"] = sum(stages.values())
+    if graph is not None:
+        result["graph_errors"] = compare_graph(shapes, graph)
+    if run_budget > 0:
+        result.update(time_run(shapes, parser.home_dir, run_budget))
+    return result
+
+
+def get_synthetic_programs(out_dir, quick):
+    """(name, path, program, graph) of every synthetic program, drawn into out_dir"""
+    programs = []
+    for series, grows, sizes in SYNTHETIC_SERIES:
+        if quick:
+            sizes = sizes[:2]
+        for size in sizes:
+            program = {
+                **SYNTHETIC_DEFAULTS,
+                **SYNTHETIC_SERIES_DEFAULTS.get(series, {}),
+                grows: size,
+            }
+            name = f"synthetic/{series}-{size}"
+            path = Path(out_dir).joinpath(f"{series}-{size}.png")
+            description = describe_program(program["shapes"], program["paths"], program["hole_depth"])
+            graph = generate(description, path, program["scale"])
+            programs.append((name, path, program, graph))
+    return programs
+
+
+def compare(results, baseline, threshold, min_delta=MIN_REGRESSION_DELTA):
+    """Every stage that got more than threshold and min_delta seconds slower than in
+    the baseline, and the engine's speed if it got more than threshold worse, as
+    (benchmark, what, before, after). Stages are left out when either run parsed
+    fewer than MIN_COMPARED_REPEAT times, steps/s when either ran the engine for
+    less than MIN_COMPARED_RUN_TIME"""
+    compare_stages = min(results.get("repeat", 0), baseline.get("repeat", 0)) >= MIN_COMPARED_REPEAT
+    regressions = []
+    for name, after in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before is None or "stages" not in before or "stages" not in after:
+            continue
+
+        if compare_stages:
+            timings = [(stage, before["stages"].get(stage), t) for stage, t in after["stages"].items()]
+            timings.append(("parse_time", before["parse_time"], after["parse_time"]))
+            for what, old, new in timings:
+                if old is None or new - old < min_delta:
+                    continue
+                if new > old * (1 + threshold):
+                    regressions.append((name, what, old, new))
+
+        old, new = before.get("steps_per_second"), after.get("steps_per_second")
+        if old is None or new is None:
+            continue
+        if min(before["run_time"], after["run_time"]) < MIN_COMPARED_RUN_TIME:
+            continue
+        if old > new * (1 + threshold):
+            regressions.append((name, "steps_per_second", old, new))
+
+    return regressions
+
+
+def print_row(name, result):
+    if "parse_error" in result:
+        print(f"|{name:<22}| parse error: {result['parse_error']}", file=sys.stderr)
+        return
+    stages = result["stages"]
+    width, height = result["size"]
+    cells = [f"{stages.get(stage, 0) * 1e3:>11.1f}" for stage in ("masks", "classify", "connections")]
+    steps = result.get("steps_per_second")
+    print(
+        f"|{name:<22}|{f'{width}x{height}':>11}|{result['shapes']:>7}|"
+        + "|".join(cells)
+        + f"|{result['parse_time'] * 1e3:>11.1f}|{'-' if steps is None else f'{steps:,.0f}':>12}|",
+        file=sys.stderr,
+    )
+    for e in result.get("graph_errors", []):
+        print(f"|{name:<22}| {e}", file=sys.stderr)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument(
+        "images", nargs="*", help="images to benchmark, defaults to the example images"
+    )
+    arg_parser.add_argument(
+        "--no-synthetic", action="store_true", help="skip the synthetic programs"
+    )
+    arg_parser.add_argument(
+        "--quick", action="store_true", help="only the two smallest synthetic programs of every series"
+    )
+    arg_parser.add_argument(
+        "-n", "--repeat", type=int, default=3, help="parses per image, the fastest one counts"
+    )
+    arg_parser.add_argument(
+        "--run-time",
+        type=float,
+        default=0.5,
+        help="seconds to run every program for to measure the engine, 0 to only parse",
+    )
+    arg_parser.add_argument("-o", "--output", type=str, help="file to write the json to instead of printing it")
+    arg_parser.add_argument("--baseline", type=str, help="json of an earlier run to compare with")
+    arg_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="how much slower than the baseline counts as a regression, 0.25 is 25%%",
+    )
+    arg_parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=MIN_REGRESSION_DELTA * 1e3,
+        help="ms a stage has to get slower by before it counts as a regression, whatever the threshold",
+    )
+    add_parser_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    options = {**get_parser_options(args), **get_parser_resources(args)}
+
+    images = [Path(i) for i in args.images]
+    if len(images) == 0:
+        for image_dir in IMAGE_DIRS:
+            images.extend(sorted(ROOT.joinpath(image_dir).glob("*.png")))
+
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "options": options,
+        "repeat": args.repeat,
+        "run_time": args.run_time,
+        "benchmarks": {},
+    }
+
+    print(
+        f"|{'benchmark':<22}|{'size':>11}|{'shapes':>7}|{'masks (ms)':>11}|{'classify':>11}|{'connections':>11}|{'parse (ms)':>11}|{'steps/s':>12}|",
+        file=sys.stderr,
+    )
+    for image in images:
+        name = f"{image.parent.name}/{image.stem}"
+        results["benchmarks"][name] = benchmark(image, options, args.repeat, args.run_time)
+        print_row(name, results["benchmarks"][name])
+
+    if not args.no_synthetic:
+        with tempfile.TemporaryDirectory() as out_dir:
+            for name, path, program, graph in get_synthetic_programs(out_dir, args.quick):
+                result = benchmark(path, options, args.repeat, args.run_time, graph)
+                # the image is gone once the benchmark is over
+                result["image"] = None
+                result["program"] = program
+                results["benchmarks"][name] = result
+                print_row(name, result)
+
+    for image_dir in IMAGE_DIRS:
+        debugging = ROOT.joinpath(image_dir, "debugging")
+        # Parser always makes a debugging dir next to the image, don't leave empty ones behind
+        if debugging.is_dir() and not any(debugging.iterdir()):
+            debugging.rmdir()
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta / 1e3)
+        if baseline.get("version") != RESULTS_VERSION:
+            print("|the baseline was made by a different version of the suite|", file=sys.stderr)
+        if baseline.get("options") != options:
+            print("|the baseline was run with different parser options|", file=sys.stderr)
+        if min(args.repeat, baseline.get("repeat", 0)) < MIN_COMPARED_REPEAT:
+            print(
+                f"|parse stages need -n {MIN_COMPARED_REPEAT} or more in both runs to be compared|",
+                file=sys.stderr,
+            )
+        if min(args.run_time, baseline.get("run_time", 0)) < MIN_COMPARED_RUN_TIME:
+            print(
+                f"|steps/s needs --run-time {MIN_COMPARED_RUN_TIME} or more in both runs to be compared|",
+                file=sys.stderr,
+            )
+        for name, what, old, new in regressions:
+            if what == "steps_per_second":
+                print(f"|regression: {name} runs {old:,.0f} -> {new:,.0f} steps/s|", file=sys.stderr)
+            else:
+                print(f"|regression: {name} {what} {old * 1e3:.1f} -> {new * 1e3:.1f} ms|", file=sys.stderr)
+        print(f"|{len(regressions)} regressions against {args.baseline}|", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
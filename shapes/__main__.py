@@ -1,10 +1,22 @@
 import argparse
 from typing import List
 from shapes.interpreter import Interpreter
-from shapes.parser import Parser
+from shapes.engine import Engine
+from shapes.program import lower
 from shapes.shape import Shape
+from shapes.cache import ShapeCache
+from shapes.limits import Limits
+from shapes.files import DEFAULT_CHUNK_SIZE, FileReader, FilesError
+from shapes.sinks import DEFAULT_BUFFER_SIZE, SinkError, StreamSink
+from shapes.sources import StreamSource
+from shapes.trace import TraceError, TraceRecorder
+from pathlib import Path
 from time import time
 import cProfile
+import json
+import os
+import sys
+import tracemalloc
 
 
 def print_shapes_found(shapes:List[Shape]):
@@ -14,6 +26,267 @@ def print_shapes_found(shapes:List[Shape]):
     print("|shape type(number of points  circularness) : [(number of points  circularness) for each hole the shape has]|")
 
 
+def get_parser_options(args):
+    """Parser keyword arguments that change what gets parsed"""
+    return {"adjacency": args.adjacency, "classifier": args.classifier, "pyramid": args.pyramid}
+
+
+def get_parser_resources(args):
+    """Parser keyword arguments that only change how it uses the machine, so they stay out of the cache key"""
+    return {"workers": args.workers, "jobs": args.jobs, "memory_budget": args.memory_budget}
+
+
+def get_peak_memory():
+    """Peak memory in megabytes as (allocated by python and numpy since tracemalloc
+    started, resident set size of the whole process or None if the os can't tell)"""
+    traced = tracemalloc.get_traced_memory()[1] / 2**20
+    try:
+        import resource
+    except ImportError:
+        return traced, None
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return traced, rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def print_timings(timings, style):
+    if style == "json":
+        print(json.dumps(timings.as_dict()))
+    else:
+        print("|timings:|")
+        print(timings.format())
+
+
+def parse_program(path, debug, options, cache=None, use_cached=True, resources=None, timings=None):
+    # a cached program has no timings to show
+    if cache is not None and use_cached and timings is None:
+        shapes = cache.load(path, options)
+        if shapes is not None:
+            print(f"|cache hit! loaded {len(shapes)} shapes from {cache.cache_dir}|")
+            return shapes, Path(path).absolute().parent
+        print("|cache miss|")
+
+    # imported here so that cache hits don't have to load the parser's dependencies
+    from shapes.parser import Parser
+
+    resources = resources or {}
+    measure_memory = resources.get("memory_budget") is not None
+    if measure_memory or timings is not None:
+        tracemalloc.start()
+
+    print(f"|parsing {path}...|")
+    parser = Parser(path, debug, **options, **resources)
+    parse_start = time()
+    shapes = parser.parse_shapes()
+    parse_end = time()
+    print(f"|parsed! {round(parse_end-parse_start, 3)} seconds elapsed|")
+    if parser.pyramid_fallback is not None:
+        print(f"|pyramid level {parser.pyramid} gave up, {parser.pyramid_fallback}|")
+
+    if timings is not None:
+        print_timings(parser.timings, timings)
+
+    if measure_memory:
+        traced, rss = get_peak_memory()
+        # the timings reset the peak before every stage, they kept track of the highest one
+        traced = max(traced, parser.timings.traced_peak / 2**20)
+        print(
+            f"|peak memory: {traced:.1f}MB allocated of a {resources['memory_budget']}MB budget"
+            + ("|" if rss is None else f", {rss:.1f}MB resident|")
+        )
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+    if cache is not None:
+        cache.save(path, shapes, options)
+
+    return shapes, parser.home_dir
+
+
+def print_run_stats(runner):
+    # on stderr, so it never ends up in what the program printed
+    rate = runner.steps / runner.elapsed if runner.elapsed > 0 else 0
+    print(
+        f"|{runner.steps} steps in {round(runner.elapsed, 3)} seconds, {rate:,.0f} steps per second|",
+        file=sys.stderr,
+    )
+
+
+def report_hotspots(interpreter, path, heatmap=None):
+    print(interpreter.format_report())
+
+    if heatmap is None:
+        debugging = Path(interpreter.home_dir).joinpath("debugging")
+        debugging.mkdir(exist_ok=True)
+        heatmap = debugging.joinpath(Path(path).stem + "-heatmap.png")
+    if interpreter.save_heatmap(path, heatmap):
+        print(f"|heatmap drawn to {heatmap}|")
+    else:
+        print(f"|can't draw the heatmap to {heatmap}|")
+
+
+def add_parser_arguments(parser):
+    parser.add_argument(
+        "--adjacency",
+        choices=["label", "flood"],
+        default="label",
+        help="how paths are matched to the shapes they touch. label is faster, flood is the original way",
+    )
+    parser.add_argument(
+        "--classifier",
+        choices=["hough", "geometric"],
+        default="hough",
+        help="how circles are told apart from other shapes. geometric is faster, hough is the original way",
+    )
+    parser.add_argument(
+        "--pyramid",
+        type=int,
+        default=0,
+        help="find the shapes on the image shrunk 2^N times, then only look at each shape's own box at full size. for programs drawn much bigger than they need to be",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="processes to classify shapes with. 0 uses one per core",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="threads to find the connections between shapes with. 0 uses one per core",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="megabytes the parser may use. parses big images tile by tile to stay under it",
+    )
+
+
+def run_batch_command(args):
+    # imported here so the other commands don't pay for it
+    from shapes.batch import collect_programs, run_batch, summarize
+
+    programs = collect_programs(args.paths)
+    if len(programs) < 1:
+        print("|no programs found|", file=sys.stderr)
+        sys.exit(1)
+
+    processes = args.processes if args.processes > 0 else os.cpu_count() or 1
+    options = {**get_parser_options(args), **get_parser_resources(args)}
+
+    def on_result(result):
+        status = "ok" if result["error"] is None else f"{result['error']['stage']} error"
+        print(f"|{result['path']}: {status}|", file=sys.stderr)
+
+    print(f"|{'running' if args.run else 'parsing'} {len(programs)} programs...|", file=sys.stderr)
+    start = time()
+    results = run_batch(
+        programs, options, args.run, args.inputs, args.timeout, processes, on_result
+    )
+    summary = summarize(results, time() - start)
+    print(
+        f"|done! {summary['files'] - summary['failed']} of {summary['files']} ok, {round(summary['wall_time'], 3)} seconds elapsed|",
+        file=sys.stderr,
+    )
+
+    if args.summary is None:
+        print(json.dumps(summary, indent=2))
+    else:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if summary["failed"] > 0:
+        sys.exit(1)
+
+
+def generate_command(args):
+    from shapes.generator import GeneratorError, compare_graph, generate
+
+    description = Path(args.description)
+    output = Path(args.output) if args.output is not None else description.with_suffix(".png")
+    graph_path = Path(args.graph) if args.graph is not None else output.with_suffix(".json")
+
+    try:
+        with open(description, "r") as f:
+            graph = generate(f.read(), output, args.scale)
+    except (OSError, GeneratorError) as e:
+        print(f"|can't generate {description}: {e}|")
+        sys.exit(1)
+
+    with open(graph_path, "w") as f:
+        json.dump(graph, f, indent=2)
+    width, height = graph["size"]
+    print(
+        f"|drew {len(graph['shapes'])} shapes and {len(graph['paths'])} paths to {output} ({width}x{height}), graph in {graph_path}|"
+    )
+
+    if args.check:
+        from shapes.parser import Parser
+
+        shapes = Parser(str(output), **get_parser_options(args), **get_parser_resources(args)).parse_shapes()
+        errors = compare_graph(shapes, graph)
+        for e in errors:
+            print(f"|{e}|")
+        print(f"|parsed with {len(errors)} differences from the graph|")
+        if len(errors) > 0:
+            sys.exit(1)
+
+
+def trace_command(args):
+    from shapes.shape import ShapeEnum
+    from shapes.trace import filter_records, format_record, read_trace, summarize
+
+    try:
+        records = read_trace(args.trace)
+    except (OSError, TraceError) as e:
+        print(f"|can't read {args.trace}: {e}|")
+        sys.exit(1)
+
+    ops = None
+    if args.op is not None:
+        try:
+            ops = [ShapeEnum[op.upper()].value for op in args.op]
+        except KeyError as e:
+            print(f"|no such operation {e.args[0]}|")
+            sys.exit(1)
+    records = filter_records(records, args.shape, ops, args.first, args.last)
+
+    if args.summary:
+        print(summarize(records, args.rows))
+        return
+    shown = records if args.limit is None else records[: args.limit]
+    for record in shown:
+        print(format_record(record))
+    if len(shown) < len(records):
+        print(f"|{len(records) - len(shown)} more records|")
+
+
+def add_timing_arguments(parser):
+    parser.add_argument(
+        "--timings",
+        choices=["human", "json"],
+        nargs="?",
+        const="human",
+        help="show the time and memory every stage of the parse took, as a table or a line of json. skips reading the cache, and tracing the memory slows down the parse a bit",
+    )
+
+
+def add_cache_arguments(parser):
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="don't read or write the parsed program cache",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="delete every cached program before doing anything else",
+    )
+
+
 def main():
     # start parsers
     arg_parser = argparse.ArgumentParser(
@@ -30,6 +303,18 @@ def main():
     parse_parser = subparsers.add_parser(
         "parse", help="parse a shapes program in debug mode without interpreting it"
     )
+    batch_parser = subparsers.add_parser(
+        "batch", help="parse, and optionally run, many shapes programs at once and summarize them as json"
+    )
+    generate_parser = subparsers.add_parser(
+        "generate", help="draw a shapes program from a text description, with the graph the parser should find in it"
+    )
+    trace_parser = subparsers.add_parser(
+        "trace", help="decode, filter and summarize a trace written by interpret --trace"
+    )
+    compile_parser = subparsers.add_parser(
+        "compile", help="compile a shapes program into a python module that runs without shapes or opencv"
+    )
 
     # interpret command
     interpret_parser.add_argument(
@@ -50,8 +335,83 @@ def main():
         "-d",
         "--debug",
         action="store_true",
-        help="shows what the interpreter sees (also good for debugging)",
+        help="shows what the interpreter sees (also good for debugging). skips reading the cache",
+    )
+    interpret_parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["flat", "shapes"],
+        default="flat",
+        help="flat runs a precompiled version of the program and is much faster. shapes walks the parsed shapes and is always used when stepping or verbose",
+    )
+    interpret_parser.add_argument(
+        "--max-steps",
+        type=int,
+        help="stop the program after this many steps",
+    )
+    interpret_parser.add_argument(
+        "--max-time",
+        type=float,
+        help="stop the program after running this many seconds",
+    )
+    interpret_parser.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        help="file to read what IN shapes ask for from, one value per line, instead of stdin",
+    )
+    interpret_parser.add_argument(
+        "--read",
+        choices=["whole", "line", "chunk"],
+        default="whole",
+        help="what READ shapes get: the whole file, or the next line or chunk of it every time, which is 3 once it's over. line and chunk never load the whole file",
+    )
+    interpret_parser.add_argument(
+        "--read-chunk",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="bytes every READ gets with --read chunk",
+    )
+    interpret_parser.add_argument(
+        "--read-cache",
+        type=int,
+        default=64,
+        help="megabytes of files, as big as they are on disk, that --read whole keeps around for the next READ of them, the least recently read go first. 0 reads them again every time",
+    )
+    interpret_parser.add_argument(
+        "--flush",
+        choices=["line", "size", "exit"],
+        help="when the program's output gets written: every line, every --buffer-size characters or only at the end. it's always written before asking for input. defaults to line on a terminal and size elsewhere",
+    )
+    interpret_parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help="characters of output to hold on to with --flush size",
+    )
+    interpret_parser.add_argument(
+        "--hotspots",
+        action="store_true",
+        help="count how often every shape and path gets visited and time every operation, then rank them and draw a heatmap over the program. walks the parsed shapes",
+    )
+    interpret_parser.add_argument(
+        "--heatmap",
+        type=str,
+        help="where --hotspots draws the heatmap to, defaults to debugging/<program>-heatmap.png next to the program",
+    )
+    interpret_parser.add_argument(
+        "--trace",
+        type=str,
+        help="record every step to this file: the shape, its operation and the stack depth and top. read it with the trace command. only works with the flat engine",
+    )
+    interpret_parser.add_argument(
+        "--trace-ring",
+        type=int,
+        help="only keep the last this many steps of --trace, written when the program stops, so the trace never grows past them",
     )
+    add_parser_arguments(interpret_parser)
+    add_cache_arguments(interpret_parser)
+    add_timing_arguments(interpret_parser)
 
     # profile command
     profile_parser.add_argument(
@@ -62,6 +422,7 @@ def main():
     profile_parser.add_argument(
         "-d", "--debug", action="store_true", help="shows what the interpreter sees"
     )
+    add_parser_arguments(profile_parser)
 
     # parse command
     parse_parser.add_argument(
@@ -69,22 +430,150 @@ def main():
         type=str,
         help="path of file to parse. if the given path doesn't have a file format, it defaults to .png",
     )
+    add_parser_arguments(parse_parser)
+    add_cache_arguments(parse_parser)
+    add_timing_arguments(parse_parser)
+
+    # batch command
+    batch_parser.add_argument(
+        "paths",
+        type=str,
+        nargs="+",
+        help="programs to go through, or directories to take every .png from",
+    )
+    batch_parser.add_argument(
+        "-r",
+        "--run",
+        action="store_true",
+        help="run every program after parsing it, and hash what it prints",
+    )
+    batch_parser.add_argument(
+        "-i",
+        "--inputs",
+        type=str,
+        help="directory of stdin files for --run, named after the program with a .txt or .in format. programs without one get an empty stdin",
+    )
+    batch_parser.add_argument(
+        "--timeout",
+        type=float,
+        help="seconds every program may run for before it counts as an error",
+    )
+    batch_parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=1,
+        help="programs to work on at the same time. 0 uses one per core",
+    )
+    batch_parser.add_argument(
+        "-o",
+        "--summary",
+        type=str,
+        help="file to write the json summary to instead of printing it",
+    )
+    add_parser_arguments(batch_parser)
+
+    # generate command
+    generate_parser.add_argument(
+        "description",
+        type=str,
+        help="text file describing the shapes and paths of the program, the format is in shapes/generator.py",
+    )
+    generate_parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="image to draw the program to, defaults to the description with a .png format",
+    )
+    generate_parser.add_argument(
+        "-g",
+        "--graph",
+        type=str,
+        help="file to write the expected shapes and paths to as json, defaults to the image with a .json format",
+    )
+    generate_parser.add_argument(
+        "-s", "--scale", type=float, default=1, help="how big to draw everything"
+    )
+    generate_parser.add_argument(
+        "-c",
+        "--check",
+        action="store_true",
+        help="parse the program right away and list where it differs from the graph",
+    )
+    add_parser_arguments(generate_parser)
+
+    # trace command
+    trace_parser.add_argument("trace", type=str, help="trace file to read")
+    trace_parser.add_argument(
+        "-s", "--shape", type=int, nargs="+", help="only the steps at these shapes, numbered like --hotspots does"
+    )
+    trace_parser.add_argument(
+        "-o", "--op", type=str, nargs="+", help="only the steps at these operations, like number or control"
+    )
+    trace_parser.add_argument("--first", type=int, help="only from this step on")
+    trace_parser.add_argument("--last", type=int, help="only up to this step")
+    trace_parser.add_argument(
+        "-n", "--limit", type=int, help="print at most this many steps"
+    )
+    trace_parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="count the steps per operation and per shape instead of printing them",
+    )
+    trace_parser.add_argument(
+        "--rows", type=int, default=20, help="operations and shapes to list with --summary"
+    )
+
+    # compile command
+    compile_parser.add_argument(
+        "path",
+        type=str,
+        help="path of file to compile. if the given path doesn't have a file format, it defaults to .png",
+    )
+    compile_parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="module to write, defaults to the program with a .py format. READ shapes read files next to it",
+    )
+    add_parser_arguments(compile_parser)
+    add_cache_arguments(compile_parser)
 
     args = arg_parser.parse_args()
 
     if not args.command:
         arg_parser.error("No commands whatsoever given")
 
+    if args.command == "batch":
+        run_batch_command(args)
+        return
+    if args.command == "generate":
+        generate_command(args)
+        return
+    if args.command == "trace":
+        trace_command(args)
+        return
+
     path = args.path
     if args.path[-4:] != ".png":
         path = args.path + ".png"
 
     command = args.command
 
+    cache = None
+    if command in ("interpret", "parse", "compile"):
+        if args.clear_cache:
+            removed = ShapeCache().clear()
+            print(f"|cleared {removed} cached programs|")
+        if not args.no_cache:
+            cache = ShapeCache()
+
     if command == "profile":
+        from shapes.parser import Parser
+
         print("|profiling...|")
         cProfile.runctx(
-            "Parser(path, args.debug).parse_shapes()",
+            "Parser(path, args.debug, **get_parser_options(args), **get_parser_resources(args)).parse_shapes()",
             globals(),
             locals(),
             sort="tottime",
@@ -92,12 +581,43 @@ def main():
         print("|profiled!|")
 
     elif command == "interpret":
-        print(f"|parsing {path}...|")
-        parser = Parser(path, args.debug)
-        parse_start = time()
-        shapes = parser.parse_shapes()
-        parse_end = time()
-        print(f"|parsed! {round(parse_end-parse_start, 3)} seconds elapsed|")
+        try:
+            output = StreamSink(policy=args.flush, buffer_size=args.buffer_size)
+            files = FileReader(
+                Path(path).absolute().parent,
+                mode=args.read,
+                chunk_size=args.read_chunk,
+                cache_size=args.read_cache * 2**20,
+            )
+        except (SinkError, FilesError) as e:
+            arg_parser.error(str(e))
+        if args.trace_ring is not None and args.trace is None:
+            arg_parser.error("--trace-ring needs a --trace file")
+        trace = None
+        if args.trace is not None:
+            if args.engine != "flat" or args.verbose or args.hotspots or (args.time or 0) != 0:
+                arg_parser.error("--trace only works with the flat engine, without stepping, --verbose or --hotspots")
+            try:
+                trace = TraceRecorder(args.trace, args.trace_ring)
+            except (OSError, TraceError) as e:
+                arg_parser.error(f"Can't trace to {args.trace}: {e}")
+        source = None
+        if args.input is not None:
+            try:
+                # stays open until the program is done, which is when the process ends
+                source = StreamSource(open(args.input, "r"))
+            except OSError as e:
+                arg_parser.error(f"Can't read {args.input}: {e.strerror}")
+
+        shapes, home_dir = parse_program(
+            path,
+            args.debug,
+            get_parser_options(args),
+            cache,
+            not args.debug,
+            get_parser_resources(args),
+            args.timings,
+        )
         if args.debug:
             print_shapes_found(shapes)
         print("--------------------------------------")
@@ -105,16 +625,54 @@ def main():
         if args.time is None:
             t = 0
 
-        interpreter = Interpreter(shapes, args.verbose, t, home_dir=parser.home_dir)
-        interpreter.run()
+        if args.hotspots:
+            from shapes.hotspots import HotspotInterpreter
+
+            runner = HotspotInterpreter(
+                shapes, home_dir=home_dir, output=output, source=source, files=files
+            )
+        else:
+            runner = Interpreter(
+                shapes, args.verbose, t, home_dir=home_dir, output=output, source=source, files=files
+            )
+            if args.engine == "flat" and not args.verbose and t == 0:
+                runner = Engine(
+                    lower(shapes, runner.current),
+                    home_dir=home_dir,
+                    output=output,
+                    source=source,
+                    files=files,
+                    trace=trace,
+                )
+
+        runner.run(Limits(args.max_steps, args.max_time))
+        print_run_stats(runner)
+        if args.hotspots:
+            report_hotspots(runner, path, args.heatmap)
+
+    elif command == "compile":
+        from shapes.compiler import compile_program
+
+        shapes, _ = parse_program(
+            path, False, get_parser_options(args), cache, True, get_parser_resources(args)
+        )
+        output = Path(args.output) if args.output is not None else Path(path).with_suffix(".py")
+        program = lower(shapes, Interpreter(shapes).current)
+        with open(output, "w") as f:
+            f.write(compile_program(program, output.stem))
+        print(f"|compiled {len(shapes)} shapes to {output}|")
 
     elif command == "parse":
-        print(f"|parsing {path}...|")
-        parser = Parser(path, True)
-        parse_start = time()
-        shapes = parser.parse_shapes()
-        parse_end = time()
-        print(f"|parsed! {round(parse_end-parse_start, 3)} seconds elapsed|")
+        # always parse for real so the debugging images get written
+        shapes, _ = parse_program(
+            path,
+            True,
+            get_parser_options(args),
+            cache,
+            False,
+            get_parser_resources(args),
+            args.timings,
+        )
         print_shapes_found(shapes)
 
 
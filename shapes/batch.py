@@ -0,0 +1,174 @@
+import hashlib
+import io
+import os
+import signal
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from time import perf_counter
+
+# extensions tried, in order, for the file a program reads its input from
+INPUT_SUFFIXES = (".txt", ".in")
+
+
+class BatchTimeout(Exception):
+    pass
+
+
+def collect_programs(paths):
+    """Every program to go through, in the order given. Directories are searched
+    for .png files, anything else without a file format gets .png like the other commands"""
+    programs = []
+    for p in paths:
+        path = Path(p)
+        if path.is_dir():
+            programs.extend(sorted(path.glob("*.png")))
+        elif path.suffix != ".png":
+            programs.append(path.with_name(path.name + ".png"))
+        else:
+            programs.append(path)
+    return [str(p) for p in programs]
+
+
+def find_input(program, inputs_dir):
+    """The file whose contents are the program's stdin, named after the program, or None"""
+    if inputs_dir is None:
+        return None
+    stem = Path(program).stem
+    for suffix in INPUT_SUFFIXES:
+        candidate = Path(inputs_dir).joinpath(stem + suffix)
+        if candidate.is_file():
+            return str(candidate)
+    return None
+
+
+def _raise_timeout(signum, frame):
+    raise BatchTimeout("timed out")
+
+
+def set_timeout(seconds):
+    # only where there's SIGALRM, elsewhere a program that never ends holds up its worker
+    if seconds and hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+
+def clear_timeout():
+    if hasattr(signal, "SIGALRM"):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _error(stage, e):
+    return {"stage": stage, "type": type(e).__name__, "message": str(e)}
+
+
+def process_program(job):
+    """Parses, and if asked to runs, a single program. Runs in a worker process,
+    everything the parser and the program print ends up in the result instead"""
+    program, options, run, input_path, timeout = job
+    # imported here so that starting the pool doesn't have to wait for the parser's dependencies
+    from shapes.engine import Engine
+    from shapes.interpreter import Interpreter
+    from shapes.parser import Parser
+    from shapes.program import lower
+    from shapes.sinks import MemorySink
+    from shapes.sources import StreamSource
+
+    result = {
+        "path": program,
+        "input": input_path,
+        "shapes": None,
+        "parse_time": None,
+        "timings": None,
+        "steps": None,
+        "run_time": None,
+        "output_sha256": None,
+        "output_bytes": None,
+        "error": None,
+    }
+
+    log = io.StringIO()
+    try:
+        with redirect_stdout(log):
+            parser = Parser(program, **options)
+            parse_start = perf_counter()
+            shapes = parser.parse_shapes()
+            result["parse_time"] = perf_counter() - parse_start
+        result["timings"] = parser.timings.as_dict()
+        result["shapes"] = len(shapes)
+    except (Exception, SystemExit) as e:
+        result["error"] = _error("parse", e)
+        result["error"]["log"] = log.getvalue()
+        return result
+
+    if not run:
+        return result
+
+    output = MemorySink()
+    engine = None
+    try:
+        with open(input_path or os.devnull, "r") as f:
+            source = StreamSource(f)
+            interpreter = Interpreter(
+                shapes, home_dir=parser.home_dir, output=output, source=source
+            )
+            engine = Engine(
+                lower(shapes, interpreter.current),
+                home_dir=parser.home_dir,
+                output=output,
+                source=source,
+            )
+            run_start = perf_counter()
+            set_timeout(timeout)
+            try:
+                engine.run()
+            finally:
+                clear_timeout()
+                result["run_time"] = perf_counter() - run_start
+    except (Exception, SystemExit) as e:
+        result["error"] = _error("run", e)
+        if not isinstance(e, BatchTimeout):
+            result["error"]["traceback"] = traceback.format_exc()
+
+    if engine is not None:
+        result["steps"] = engine.steps
+    encoded = output.getvalue().encode()
+    result["output_sha256"] = hashlib.sha256(encoded).hexdigest()
+    result["output_bytes"] = len(encoded)
+    return result
+
+
+def run_batch(programs, options, run=False, inputs_dir=None, timeout=None, processes=1, on_result=None):
+    """process_program for every program, on a pool of processes when processes > 1.
+    Results come back in the order of programs"""
+    jobs = [
+        (p, options, run, find_input(p, inputs_dir) if run else None, timeout)
+        for p in programs
+    ]
+
+    results = []
+    if processes < 2 or len(jobs) < 2:
+        for job in jobs:
+            results.append(process_program(job))
+            if on_result is not None:
+                on_result(results[-1])
+        return results
+
+    with ProcessPoolExecutor(min(processes, len(jobs))) as executor:
+        for result in executor.map(process_program, jobs):
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    return results
+
+
+def summarize(results, wall_time):
+    parse_times = [r["parse_time"] for r in results if r["parse_time"] is not None]
+    return {
+        "files": len(results),
+        "failed": sum(r["error"] is not None for r in results),
+        "parse_time": sum(parse_times),
+        "wall_time": wall_time,
+        "results": results,
+    }
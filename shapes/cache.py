@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from shapes.shape import Shape, ShapeEnum
+
+# bump this whenever the parser starts producing different shapes for the same image
+PARSER_VERSION = "2"
+
+
+def default_cache_dir():
+    if os.environ.get("SHAPES_CACHE_DIR"):
+        return Path(os.environ["SHAPES_CACHE_DIR"])
+    if os.environ.get("XDG_CACHE_HOME"):
+        return Path(os.environ["XDG_CACHE_HOME"]).joinpath("shapes")
+    return Path.home().joinpath(".cache", "shapes")
+
+
+def _point(p):
+    return [int(p[0]), int(p[1])]
+
+
+def dump_shapes(shapes: List[Shape]):
+    index = {id(s): i for i, s in enumerate(shapes)}
+
+    dumped = []
+    for s in shapes:
+        dumped.append(
+            {
+                "type": s.get_shape_type().name,
+                "holes": s.get_hole_count(),
+                "circular": bool(s.circular),
+                "center": _point(s.center),
+                "contour": np.asarray(s.contour).tolist(),
+                "points": np.asarray(s.points).tolist(),
+                "outer": None if s.outer is None else index[id(s.outer)],
+                "insides": [index[id(i)] for i in s.insides],
+                "connecteds": [
+                    [
+                        int(k),
+                        _point(s.connecteds[k][0]),
+                        [[index[id(c[0])], _point(c[1])] for c in s.connecteds[k][1]],
+                    ]
+                    for k in s.connecteds.keys()
+                ],
+            }
+        )
+
+    return dumped
+
+
+def load_shapes(dumped) -> List[Shape]:
+    shapes = []
+    for d in dumped:
+        shape = Shape(
+            np.array(d["contour"], np.int32), d["circular"], center=tuple(d["center"])
+        )
+        shape.points = np.array(d["points"], np.int32)
+        shapes.append(shape)
+
+    for shape, d in zip(shapes, dumped):
+        if d["outer"] is not None:
+            shape.outer = shapes[d["outer"]]
+        for i in d["insides"]:
+            shape.add_inside(shapes[i])
+        for k, connecting_point, connected in d["connecteds"]:
+            for i, to_point in connected:
+                shape.connect_shape(
+                    k, shapes[i], tuple(connecting_point), tuple(to_point)
+                )
+
+    for shape, d in zip(shapes, dumped):
+        shape.freeze(ShapeEnum[d["type"]])
+
+    return shapes
+
+
+class ShapeCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, path, options=None):
+        digest = hashlib.sha256()
+        digest.update(f"shapes-parser-{PARSER_VERSION}\n".encode())
+        # parser options that change the result need their own entries
+        digest.update(json.dumps(options or {}, sort_keys=True).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return self.cache_dir.joinpath(f"{key}.json")
+
+    def load(self, path, options=None) -> Optional[List[Shape]]:
+        cache_path = self.get_path(self.get_key(path, options))
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if cached["version"] != PARSER_VERSION:
+                raise ValueError("stale cache entry")
+            shapes = load_shapes(cached["shapes"])
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return shapes
+
+    def save(self, path, shapes: List[Shape], options=None):
+        cache_path = self.get_path(self.get_key(path, options))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # write then rename so an interrupted run never leaves half a cache entry
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": PARSER_VERSION, "shapes": dump_shapes(shapes)}, f)
+        os.replace(tmp_path, cache_path)
+
+    def clear(self):
+        removed = 0
+        if self.cache_dir.is_dir():
+            for entry in self.cache_dir.glob("*.json"):
+                entry.unlink()
+                removed += 1
+        return removed
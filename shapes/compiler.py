@@ -0,0 +1,498 @@
+"""Compiles a lowered Program into a python module that runs on its own, with
+nothing but python, and prints what the Engine would.
+
+Every edge the instruction pointer can be at becomes straight-line code. Edges
+that can only be reached from the one before them get folded into it, so a
+function holds everything from one jump to the next, and returns the function to
+jump to. CONTROL shapes become a dict lookup on the popped value. Where the path
+into a CONTROL is known while compiling, the candidates that came in through that
+path are left out of the dict right away, everywhere else the dict holds every
+candidate and the path in gets checked while running, like the Engine does.
+Containers and stacks can change what a CONTROL matches, CONTROL shapes next to
+them are checked one candidate at a time.
+
+There are no step or time limits, and no tracing, that's what the Engine is for"""
+import math
+from collections import Counter
+
+from shapes.program import Program
+from shapes.shape import ShapeEnum
+
+START = ShapeEnum.START.value
+END = ShapeEnum.END.value
+CONTROL = ShapeEnum.CONTROL.value
+
+# kinds of candidates of a CONTROL next to containers or stacks
+VALUE_CANDIDATE = 0
+CONTAINER_CANDIDATE = 1
+STACK_CANDIDATE = 2
+
+INDENT = "    "
+
+# everything the compiled program needs besides its own code
+PRELUDE = '''import os
+import sys
+
+PROMPT = "<<< "
+NUM = (float, int)
+# writes held on to before they're joined and written out, unless it's a terminal
+BUFFER_PARTS = 4096
+HOME_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VALUE_CANDIDATE = 0
+CONTAINER_CANDIDATE = 1
+STACK_CANDIDATE = 2
+
+
+def parse_value(text):
+    if text.isascii() and text.isdigit():
+        return int(text)
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+def get_reader(stdin, interactive):
+    if interactive:
+        return lambda: parse_value(input())
+    readline = stdin.readline
+
+    def read():
+        line = readline()
+        if len(line) == 0:
+            raise EOFError("EOF when reading a line")
+        return parse_value(line[:-1] if line[-1] == "\\n" else line)
+
+    return read
+
+
+def get_file_reader(home_dir):
+    def read_file(path):
+        try:
+            with open(os.path.join(home_dir, path), "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return 0
+        except UnicodeDecodeError:
+            return 1
+        except Exception:
+            return 2
+
+    return read_file
+
+
+def dispatch(static, none, target, p_k):
+    """The CONTROL candidate for target that isn't the path in, else one for no value"""
+    if target is not None:
+        for block, k in static.get(target, ()):
+            if k != p_k:
+                return block
+    for block, k in none:
+        if k != p_k:
+            return block
+    return None
+
+
+def dispatch_ordered(ordered, values, target, p_k):
+    """dispatch for a CONTROL next to containers or stacks, which can change what it matches"""
+    for block, k, kind, value in ordered:
+        if kind != VALUE_CANDIDATE:
+            value = values[value]
+            if kind == STACK_CANDIDATE and value is not None:
+                value = value[-1]
+        if value == target and k != p_k:
+            return block
+    for block, k, kind, value in ordered:
+        if kind != VALUE_CANDIDATE:
+            value = values[value]
+            if kind == STACK_CANDIDATE and value is not None:
+                value = value[-1]
+        if value is None and k != p_k:
+            return block
+    return None
+'''
+
+RUN_HEAD = '''
+
+def run(stdin=None, stdout=None, home_dir=HOME_DIR):
+    """Runs the program, reading IN from stdin and READ files relative to home_dir"""
+    stdin = stdin if stdin is not None else sys.stdin
+    stdout = stdout if stdout is not None else sys.stdout
+    interactive = stdin.isatty()
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    values = [None] * {shape_count}
+    parts = []
+    write = stdout.write if stdout.isatty() else parts.append
+    read = get_reader(stdin, interactive)
+    read_file = get_file_reader(home_dir)
+    p_k = None
+
+    def flush():
+        if parts:
+            stdout.write("".join(parts))
+            parts.clear()
+        stdout.flush()
+
+    def dead_end():
+        write("\\n|finished due to dead-end|\\n")
+'''
+
+RUN_TAIL = '''
+    block = b0
+    try:
+        while block:
+            block = block()
+    except KeyboardInterrupt:
+        write("|aborted!|\\n")
+    finally:
+        flush()
+
+
+if __name__ == "__main__":
+    run()
+'''
+
+
+def literal(value):
+    """value as python source"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return f'float("{value}")'
+    return repr(value)
+
+
+def compare_lines(compare, push):
+    """Pops a and b, and pushes push when compare holds for them, or puts them back"""
+    return [
+        "if len(stack) > 1:",
+        f"{INDENT}a = pop()",
+        f"{INDENT}b = pop()",
+        f"{INDENT}if {compare}:",
+        f"{INDENT * 2}push({push})",
+        f"{INDENT}else:",
+        f"{INDENT * 2}push(b)",
+        f"{INDENT * 2}push(a)",
+    ]
+
+
+BOTH_NUM = "isinstance(a, NUM) and isinstance(b, NUM)"
+COMPARABLE = "isinstance(a, NUM) == isinstance(b, NUM)"
+
+
+def oper_lines(holes):
+    if holes == 1:
+        return compare_lines(COMPARABLE, "a + b")
+    if holes == 2:
+        return compare_lines(BOTH_NUM, "a - b")
+    if holes == 3:
+        return compare_lines(BOTH_NUM, "a * b")
+    if holes == 4:
+        return compare_lines(BOTH_NUM, 'a / b if b != 0 else "NaN"')
+    if holes == 5:
+        return compare_lines(BOTH_NUM, "a % b")
+    if holes == 6:
+        return [
+            "if len(stack) > 1:",
+            f"{INDENT}a = pop()",
+            f"{INDENT}b = pop()",
+            f"{INDENT}push(str(a) + str(b))",
+        ]
+    # anything else swaps the top two
+    return [
+        "if len(stack) > 1:",
+        f"{INDENT}a = pop()",
+        f"{INDENT}b = pop()",
+        f"{INDENT}push(a)",
+        f"{INDENT}push(b)",
+    ]
+
+
+def op_lines(program: Program, s):
+    """The code for the operation of shape s, everything but where it goes next"""
+    op = ShapeEnum(program.ops[s])
+    operand = program.operands[s]
+
+    if op == ShapeEnum.NUMBER:
+        return [f"push({operand})"]
+    if op == ShapeEnum.OPER:
+        return oper_lines(operand)
+    if op == ShapeEnum.DUPE:
+        return ["if stack:", f"{INDENT}push(stack[-1])"]
+    if op == ShapeEnum.POP:
+        return ["if stack:", f"{INDENT}pop()"]
+    if op == ShapeEnum.LENGTH:
+        return ["push(len(stack))"]
+    if op == ShapeEnum.CONTAINER:
+        return [
+            f"if values[{s}] is not None:",
+            f"{INDENT}push(values[{s}])",
+            f"{INDENT}values[{s}] = None",
+            "else:",
+            f"{INDENT}values[{s}] = pop()",
+        ]
+    if op == ShapeEnum.STACK:
+        return [
+            "if len(stack) > 1:",
+            f"{INDENT}top = pop()",
+            f"{INDENT}bottom = pop()",
+            f"{INDENT}if top == 1:",
+            f"{INDENT * 2}if values[{s}] is None:",
+            f"{INDENT * 3}values[{s}] = [bottom]",
+            f"{INDENT * 2}else:",
+            f"{INDENT * 3}values[{s}].append(bottom)",
+            f"{INDENT}elif top == 2:",
+            f"{INDENT * 2}push(bottom)",
+            f"{INDENT * 2}push(len(values[{s}]))",
+            f"{INDENT}elif top == 0:",
+            f"{INDENT * 2}if len(values[{s}]) > 0:",
+            f"{INDENT * 3}push(bottom)",
+            f"{INDENT * 3}push(values[{s}].pop())",
+            f"{INDENT * 2}else:",
+            f"{INDENT * 3}push(bottom)",
+            f"{INDENT}else:",
+            f"{INDENT * 2}push(bottom)",
+            f"{INDENT * 2}push(top)",
+        ]
+    if op == ShapeEnum.EQUALS:
+        return compare_lines(COMPARABLE, "int(a == b)")
+    if op == ShapeEnum.LARGER:
+        return compare_lines(COMPARABLE, "int(a > b)")
+    if op == ShapeEnum.SMALLER:
+        return compare_lines(COMPARABLE, "int(a < b)")
+    if op == ShapeEnum.AND:
+        return compare_lines(COMPARABLE, "a and b")
+    if op == ShapeEnum.OR:
+        return compare_lines(COMPARABLE, "a or b")
+    if op == ShapeEnum.NOT:
+        return ["if stack:", f"{INDENT}push(int(not pop()))"]
+    if op == ShapeEnum.OUT:
+        return [
+            "if stack:",
+            f'{INDENT}write(f"{{pop()}}\\n")',
+            "else:",
+            f'{INDENT}write("\\n")',
+            "if len(parts) >= BUFFER_PARTS:",
+            f"{INDENT}flush()",
+        ]
+    if op == ShapeEnum.OUT_NO_LF:
+        return [
+            "if stack:",
+            f'{INDENT}write(f"{{pop()}}")',
+            f"{INDENT}if len(parts) >= BUFFER_PARTS:",
+            f"{INDENT * 2}flush()",
+        ]
+    if op == ShapeEnum.TO_CHAR:
+        return [
+            "if stack:",
+            f"{INDENT}val = pop()",
+            f"{INDENT}if isinstance(val, NUM):",
+            f"{INDENT * 2}push(chr(int(val)))",
+            f"{INDENT}elif isinstance(val, str):",
+            f"{INDENT * 2}stack.extend(val[::-1])",
+        ]
+    if op == ShapeEnum.CHR_TO_NUM:
+        return [
+            "if stack:",
+            f"{INDENT}val = pop()",
+            f"{INDENT}if isinstance(val, str):",
+            f"{INDENT * 2}if len(val) == 1:",
+            f"{INDENT * 3}push(ord(val))",
+            f"{INDENT}else:",
+            f"{INDENT * 2}push(val)",
+        ]
+    if op == ShapeEnum.TO_NUMBER:
+        return [
+            "if stack:",
+            f"{INDENT}val = pop()",
+            f"{INDENT}try:",
+            f"{INDENT * 2}push(int(val))",
+            f"{INDENT}except ValueError:",
+            f"{INDENT * 2}try:",
+            f"{INDENT * 3}push(float(val))",
+            f"{INDENT * 2}except ValueError:",
+            f"{INDENT * 3}push(val)",
+        ]
+    if op == ShapeEnum.TO_STRING:
+        return ["if stack:", f"{INDENT}push(str(pop()))"]
+    if op == ShapeEnum.NUMBER_CHECK:
+        return ["if stack:", f"{INDENT}push(int(isinstance(pop(), NUM)))"]
+    if op == ShapeEnum.IN:
+        return ["if interactive:", f"{INDENT}write(PROMPT)", f"{INDENT}flush()", "push(read())"]
+    if op == ShapeEnum.READ:
+        return ["if stack:", f"{INDENT}push(read_file(str(pop())))"]
+    # junctions and the like only lead on
+    return []
+
+
+class Compiler:
+    """Works out which edges start a function, and writes them and the CONTROL
+    tables out. An edge starts one when it's the first, when it's where a CONTROL
+    or the start jumps to, or when more than one edge leads to it.
+
+    CONTROL shapes get two: b<edge> for coming in down a path, whose k is known,
+    and j<edge> for being jumped to by another CONTROL or the start, which don't
+    change the path in. Only that needs p_k kept while running"""
+
+    def __init__(self, program: Program):
+        self.program = program
+        edges = range(len(program.edge_shape))
+        self.ops = [program.ops[s] for s in program.edge_shape]
+
+        # how many edges lead to every edge down a path
+        self.led = Counter(
+            program.next_edge[e]
+            for e in edges
+            if self.ops[e] not in (START, CONTROL, END) and program.next_edge[e] != -1
+        )
+        self.heads = {0} | {e for e in edges if self.led[e] > 1}
+
+        self.jumped_to = set()
+        jumps = [program.next_edge[0]] if program.next_edge[0] != -1 else []
+        for static, none, ordered in program.controls.values():
+            if ordered is not None:
+                jumps.extend(e for e, _, _, _ in ordered)
+            else:
+                jumps.extend(e for candidates in static.values() for e, _ in candidates)
+                jumps.extend(e for e, _ in none)
+        for e in jumps:
+            if self.ops[e] == CONTROL:
+                self.jumped_to.add(e)
+            else:
+                self.heads.add(e)
+        self.dynamic = {s for s, (_, _, ordered) in program.controls.items() if ordered is not None}
+        # p_k only matters to a CONTROL that doesn't know its path in
+        self.keep_p_k = len(self.jumped_to) > 0 or len(self.dynamic) > 0
+
+    def target(self, e):
+        """The function a jump to edge e goes to"""
+        return f"j{e}" if self.ops[e] == CONTROL else f"b{e}"
+
+    def control_lines(self, e):
+        """Picks where a CONTROL coming in down the path of edge e goes"""
+        s = self.program.edge_shape[e]
+        k = literal(self.program.edge_k[e])
+        lines = [f"p_k = {k}"] if self.keep_p_k else []
+        if s in self.dynamic:
+            return lines + [
+                f"return dispatch_ordered(o{s}, values, pop() if stack else None, {k}) or dead_end"
+            ]
+        return lines + [f"return t{e}.get(pop() if stack else None, d{e})"]
+
+    def block(self, head):
+        """b<head>: the code of every edge from head up to the next jump"""
+        program = self.program
+        body = []
+        e = head
+        while True:
+            s = program.edge_shape[e]
+            body.append(f"# shape {s}: {ShapeEnum(program.ops[s]).name}")
+            if self.ops[e] == CONTROL:
+                body.extend(self.control_lines(e))
+                break
+            if self.ops[e] == START:
+                # the start doesn't change the path in, like a CONTROL
+                next_e = program.next_edge[e]
+                body.append("return dead_end" if next_e == -1 else f"return {self.target(next_e)}")
+                break
+            if self.ops[e] == END:
+                body.append('write("\\n--------------|finished|--------------\\n")')
+                body.append("return None")
+                break
+
+            body.extend(op_lines(program, s))
+            next_e = program.next_edge[e]
+            if next_e == -1:
+                body.append('write("|finished due to dead-end|\\n")')
+                body.append("return None")
+                break
+            if next_e in self.heads:
+                body.append(f"return b{next_e}")
+                break
+            e = next_e
+
+        head_lines = [f"def b{head}():"]
+        if self.ops[e] == CONTROL and self.keep_p_k:
+            head_lines.append(f"{INDENT}nonlocal p_k")
+        return head_lines + [INDENT + line for line in body]
+
+    def jumped_block(self, e):
+        """j<e>: a CONTROL that has to check the path in while running"""
+        s = self.program.edge_shape[e]
+        if s in self.dynamic:
+            dispatch = f"dispatch_ordered(o{s}, values, pop() if stack else None, p_k)"
+        else:
+            dispatch = f"dispatch(s{s}, n{s}, pop() if stack else None, p_k)"
+        return [f"def j{e}():", f"{INDENT}return {dispatch} or dead_end"]
+
+    def tables(self):
+        """The candidates of every CONTROL, made once the functions they point at exist"""
+        program = self.program
+        lines = []
+        for s, (static, none, ordered) in sorted(program.controls.items()):
+            if ordered is not None:
+                candidates = []
+                for e, k, target_type, value in ordered:
+                    if target_type is None:
+                        kind, value = VALUE_CANDIDATE, literal(value)
+                    else:
+                        kind = STACK_CANDIDATE if target_type == ShapeEnum.STACK else CONTAINER_CANDIDATE
+                    candidates.append(f"({self.target(e)}, {literal(k)}, {kind}, {value})")
+                lines.append(f"o{s} = ({', '.join(candidates)},)")
+                continue
+
+            # with every candidate, for when the path in is only known while running
+            if any(program.edge_shape[e] == s for e in self.jumped_to):
+                entries = []
+                for value, candidates in static.items():
+                    pairs = "".join(f"({self.target(e)}, {literal(k)}), " for e, k in candidates)
+                    entries.append(f"{literal(value)}: ({pairs})")
+                lines.append(f"s{s} = {{{', '.join(entries)}}}")
+                pairs = "".join(f"({self.target(e)}, {literal(k)}), " for e, k in none)
+                lines.append(f"n{s} = ({pairs})")
+
+            # one dict for every path in known while compiling
+            for e in range(len(program.edge_shape)):
+                if program.edge_shape[e] != s or self.led[e] == 0:
+                    continue
+                p_k = program.edge_k[e]
+                default = next((self.target(c) for c, k in none if k != p_k), "dead_end")
+                entries = []
+                for value, candidates in static.items():
+                    target = next((self.target(c) for c, k in candidates if k != p_k), None)
+                    if target is not None:
+                        entries.append(f"{literal(value)}: {target}")
+                lines.append(f"t{e} = {{{', '.join(entries)}}}")
+                lines.append(f"d{e} = {default}")
+        return lines
+
+    def compile(self, name="program"):
+        """The source of the module"""
+        program = self.program
+        # following the edges from every head finds every edge a block gets written for
+        functions = []
+        for head in sorted(self.heads):
+            functions.append(self.block(head))
+        for e in sorted(self.jumped_to):
+            functions.append(self.jumped_block(e))
+
+        lines = [
+            f'"""{name}, compiled by shapes. Runs on its own: python {name}.py"""',
+            PRELUDE,
+            RUN_HEAD.format(shape_count=len(program.ops)),
+        ]
+        for function in functions:
+            lines.extend(INDENT + line for line in function)
+            lines.append("")
+        lines.extend(INDENT + line for line in self.tables())
+        lines.append(RUN_TAIL)
+        return "\n".join(lines)
+
+
+def compile_program(program: Program, name="program"):
+    """program as the source of a python module that runs it, see the top of this file"""
+    return Compiler(program).compile(name)
@@ -0,0 +1,328 @@
+from time import perf_counter
+
+from shapes.files import FileReader
+from shapes.limits import Limits
+from shapes.program import Program
+from shapes.shape import ShapeEnum
+from shapes.sinks import StreamSink
+from shapes.sources import PROMPT, default_source
+
+START = ShapeEnum.START.value
+END = ShapeEnum.END.value
+JUNCTION = ShapeEnum.JUNCTION.value
+NUMBER = ShapeEnum.NUMBER.value
+POP = ShapeEnum.POP.value
+DUPE = ShapeEnum.DUPE.value
+CONTAINER = ShapeEnum.CONTAINER.value
+CONTROL = ShapeEnum.CONTROL.value
+NUMBER_CHECK = ShapeEnum.NUMBER_CHECK.value
+LENGTH = ShapeEnum.LENGTH.value
+OPER = ShapeEnum.OPER.value
+STACK = ShapeEnum.STACK.value
+TO_NUMBER = ShapeEnum.TO_NUMBER.value
+TO_STRING = ShapeEnum.TO_STRING.value
+TO_CHAR = ShapeEnum.TO_CHAR.value
+CHR_TO_NUM = ShapeEnum.CHR_TO_NUM.value
+AND = ShapeEnum.AND.value
+OR = ShapeEnum.OR.value
+NOT = ShapeEnum.NOT.value
+EQUALS = ShapeEnum.EQUALS.value
+LARGER = ShapeEnum.LARGER.value
+SMALLER = ShapeEnum.SMALLER.value
+IN = ShapeEnum.IN.value
+READ = ShapeEnum.READ.value
+OUT = ShapeEnum.OUT.value
+OUT_NO_LF = ShapeEnum.OUT_NO_LF.value
+
+_STACK_TYPE = ShapeEnum.STACK
+
+
+def _is_num(val):
+    return isinstance(val, (float, int))
+
+
+def _comparable(a, b):
+    return _is_num(a) == _is_num(b)
+
+
+class Engine:
+    """Runs a lowered Program. Behaves like Interpreter, minus the stepping and
+    verbose output, without ever looking at a Shape while running. Everything it
+    prints goes to output, a sink from shapes.sinks, IN reads from source, one of
+    shapes.sources, and READ from files, a shapes.files.FileReader. Given a
+    shapes.trace.TraceRecorder, every step gets recorded in it"""
+
+    def __init__(
+        self, program: Program, home_dir=None, output=None, source=None, files=None, trace=None
+    ):
+        self.program = program
+        self.home_dir = home_dir
+        self.files = files if files is not None else FileReader(home_dir)
+        self.output = output if output is not None else StreamSink()
+        self.source = source if source is not None else default_source()
+        self.trace = trace
+        self.stack = []
+        self.values = [None] * len(program.ops)
+        self.steps = 0
+        # seconds the last run took
+        self.elapsed = 0.0
+
+    def read(self, path):
+        return self.files.read(path)
+
+    def control(self, s, target, p_k):
+        static, none, ordered = self.program.controls[s]
+
+        if ordered is None:
+            for e, k in static.get(target, ()) if target is not None else none:
+                if k != p_k:
+                    return e
+            for e, k in none:
+                if k != p_k:
+                    return e
+            return -1
+
+        values = self.values
+        for e, k, target_type, value in ordered:
+            if target_type is not None:
+                value = values[value]
+                if target_type == _STACK_TYPE and value is not None:
+                    value = value[-1]
+            if value == target and k != p_k:
+                return e
+        for e, k, target_type, value in ordered:
+            if target_type is not None:
+                value = values[value]
+                if target_type == _STACK_TYPE and value is not None:
+                    value = value[-1]
+            if value is None and k != p_k:
+                return e
+        return -1
+
+    def run(self, limits=None):
+        """limits is a shapes.limits.Limits, the program runs until it ends without one"""
+        program = self.program
+        ops = program.ops
+        operands = program.operands
+        edge_shape = program.edge_shape
+        edge_k = program.edge_k
+        next_edge = program.next_edge
+        values = self.values
+        stack = self.stack
+        push = stack.append
+        pop = stack.pop
+        output = self.output
+        write = output.write
+        read = self.source.read
+        interactive = self.source.interactive
+        read_file = self.files.read
+        trace = self.trace
+        record = trace.record if trace is not None else None
+
+        e = 0
+        p_k = None
+        steps = 0
+        limits = limits if limits is not None else Limits()
+        checkpoint = limits.start(steps)
+        if trace is not None:
+            checkpoint = trace.checkpoint(steps, checkpoint)
+        begin = perf_counter()
+
+        try:
+            while True:
+                s = edge_shape[e]
+                op = ops[s]
+                steps += 1
+                if steps == checkpoint:
+                    checkpoint = limits.check(steps)
+                    if checkpoint is None:
+                        steps -= 1
+                        write(f"\n|{limits.exceeded}|\n")
+                        break
+                    if trace is not None:
+                        trace.drain()
+                        checkpoint = trace.checkpoint(steps, checkpoint)
+                if record is not None:
+                    record((steps, s, op, len(stack), stack[-1] if stack else None))
+
+                if op == NUMBER:
+                    push(operands[s])
+                elif op == JUNCTION:
+                    pass
+                elif op == CONTROL:
+                    target = None
+                    if len(stack) > 0:
+                        target = pop()
+                    e = self.control(s, target, p_k)
+                    if e == -1:
+                        write("\n|finished due to dead-end|\n")
+                        break
+                    continue
+                elif op == OPER:
+                    if len(stack) > 1:
+                        a = pop()
+                        b = pop()
+                        both_is_num = _is_num(a) and _is_num(b)
+                        l = operands[s]
+                        if l == 1:
+                            if both_is_num or not (_is_num(a) or _is_num(b)):
+                                push(a + b)
+                            else:
+                                push(b)
+                                push(a)
+                        elif l == 2:
+                            if both_is_num:
+                                push(a - b)
+                            else:
+                                push(b)
+                                push(a)
+                        elif l == 3:
+                            if both_is_num:
+                                push(a * b)
+                            else:
+                                push(b)
+                                push(a)
+                        elif l == 4:
+                            if both_is_num:
+                                if b != 0:
+                                    push(a / b)
+                                else:
+                                    push("NaN")
+                            else:
+                                push(b)
+                                push(a)
+                        elif l == 5:
+                            if both_is_num:
+                                push(a % b)
+                            else:
+                                push(b)
+                                push(a)
+                        elif l == 6:
+                            push(str(a) + str(b))
+                        else:
+                            push(a)
+                            push(b)
+                elif op == DUPE:
+                    if len(stack) > 0:
+                        push(stack[-1])
+                elif op == POP:
+                    if len(stack) > 0:
+                        pop()
+                elif op == LENGTH:
+                    push(len(stack))
+                elif op == CONTAINER:
+                    if values[s] is not None:
+                        push(values[s])
+                        values[s] = None
+                    else:
+                        values[s] = pop()
+                elif op == STACK:
+                    if len(stack) > 1:
+                        top = pop()
+                        bottom = pop()
+                        if top == 1:
+                            if values[s] is None:
+                                values[s] = [bottom]
+                            else:
+                                values[s].append(bottom)
+                        elif top == 2:
+                            push(bottom)
+                            push(len(values[s]))
+                        elif top == 0:
+                            if len(values[s]) > 0:
+                                push(bottom)
+                                push(values[s].pop())
+                            else:
+                                push(bottom)
+                        else:
+                            push(bottom)
+                            push(top)
+                elif op == EQUALS or op == LARGER or op == SMALLER or op == AND or op == OR:
+                    if len(stack) > 1:
+                        a = pop()
+                        b = pop()
+                        if _comparable(a, b):
+                            if op == EQUALS:
+                                push(int(a == b))
+                            elif op == LARGER:
+                                push(int(a > b))
+                            elif op == SMALLER:
+                                push(int(a < b))
+                            elif op == AND:
+                                push(a and b)
+                            else:
+                                push(a or b)
+                        else:
+                            push(b)
+                            push(a)
+                elif op == NOT:
+                    if len(stack) > 0:
+                        push(int(not pop()))
+                elif op == OUT:
+                    if len(stack) > 0:
+                        write(f"{pop()}\n")
+                    else:
+                        write("\n")
+                elif op == OUT_NO_LF:
+                    if len(stack) > 0:
+                        write(f"{pop()}")
+                elif op == TO_CHAR:
+                    if len(stack) > 0:
+                        val = pop()
+                        if isinstance(val, (float, int)):
+                            push(chr(int(val)))
+                        elif isinstance(val, str):
+                            stack.extend([i for i in val[::-1]])
+                elif op == CHR_TO_NUM:
+                    if len(stack) > 0:
+                        val = pop()
+                        if isinstance(val, str):
+                            if len(val) == 1:
+                                push(ord(val))
+                        else:
+                            push(val)
+                elif op == TO_NUMBER:
+                    if len(stack) > 0:
+                        val = pop()
+                        try:
+                            push(int(val))
+                        except ValueError:
+                            try:
+                                push(float(val))
+                            except ValueError:
+                                push(val)
+                elif op == TO_STRING:
+                    if len(stack) > 0:
+                        push(str(pop()))
+                elif op == NUMBER_CHECK:
+                    if len(stack) > 0:
+                        push(int(_is_num(pop())))
+                elif op == IN:
+                    if interactive:
+                        write(PROMPT)
+                        output.flush()
+                    push(read())
+                elif op == READ:
+                    if len(stack) > 0:
+                        push(read_file(str(pop())))
+                elif op == START:
+                    e = next_edge[e]
+                    continue
+                elif op == END:
+                    write("\n--------------|finished|--------------\n")
+                    break
+
+                e = next_edge[e]
+                if e == -1:
+                    write("|finished due to dead-end|\n")
+                    break
+                p_k = edge_k[e]
+        except KeyboardInterrupt:
+            write("|aborted!|\n")
+        finally:
+            self.steps = steps
+            self.elapsed = perf_counter() - begin
+            output.flush()
+            self.files.close()
+            if trace is not None:
+                trace.close()
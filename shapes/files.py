@@ -0,0 +1,153 @@
+"""How READ shapes read files. A READ pops a path, relative to the program's
+directory, and pushes what it read, or 0 if the file isn't there, 1 if it isn't
+text, 2 for anything else that went wrong and 3 once a line or chunk READ is
+past the end of the file.
+
+whole: the whole file at once, the way READ always worked. Files read before
+       come out of a cache, as long as they haven't changed since
+line:  the next line of the file every time, newline included
+chunk: the next chunk_size bytes or so, cut where a character ends
+
+line and chunk memory map the file and only decode what they hand out, so a
+file is never all in memory. Past the end of it, every READ of it gives 3.
+Unlike whole, they don't translate line endings"""
+import codecs
+import locale
+import mmap
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+READ_MODES = ("whole", "line", "chunk")
+# in bytes. a character cut in two at the end of a chunk comes out at the start
+# of the next one, so chunks can decode to a few bytes more or less than this
+DEFAULT_CHUNK_SIZE = 1 << 16
+# in bytes of the files on disk
+DEFAULT_CACHE_SIZE = 64 << 20
+
+READ_NOT_FOUND = 0
+READ_NOT_TEXT = 1
+READ_FAILED = 2
+# what a stream gives once it's done, so a program can tell it from a missing file
+READ_END = 3
+
+
+class FilesError(Exception):
+    pass
+
+
+class FileStream:
+    """A memory mapped file, handed out a line or a chunk at a time"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # empty files can't be mapped, they're over before they start
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+        self.decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))()
+
+    def next(self, read):
+        """The next piece of the file read(mm) gives, or None past the end of it"""
+        while self.mm is not None:
+            data = read(self.mm)
+            text = self.decoder.decode(data, final=len(data) == 0)
+            if len(data) == 0:
+                self.close()
+            if len(text) > 0:
+                return text
+        return None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+
+class FileReader:
+    """What a running program reads files with. cache_size is in bytes of the
+    files on disk, the files used longest ago get dropped first when it's full.
+    0 turns it off"""
+
+    def __init__(
+        self,
+        home_dir=None,
+        mode="whole",
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        cache_size=DEFAULT_CACHE_SIZE,
+    ):
+        if mode not in READ_MODES:
+            raise FilesError(f"Unknown read mode {mode}")
+        if chunk_size < 1:
+            raise FilesError("Chunks have to be at least a byte")
+        self.home_dir = home_dir
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        # path -> (mtime, size, text), the most recently used last. cached adds up the sizes
+        self.cache = OrderedDict()
+        self.cached = 0
+        self.streams = {}
+        # the exception behind the last READ_FAILED
+        self.error = None
+
+        if mode == "line":
+            self.read_piece = lambda mm: mm.readline()
+        else:
+            self.read_piece = lambda mm: mm.read(chunk_size)
+
+    def get_path(self, path):
+        if self.home_dir is None:
+            return path
+        return str(Path(self.home_dir).joinpath(path))
+
+    def read(self, path):
+        try:
+            if self.mode == "whole":
+                return self.read_whole(self.get_path(path))
+            return self.read_next(self.get_path(path))
+        except FileNotFoundError:
+            return READ_NOT_FOUND
+        except UnicodeDecodeError:
+            return READ_NOT_TEXT
+        except Exception as e:
+            self.error = e
+            return READ_FAILED
+
+    def read_whole(self, path):
+        if self.cache_size <= 0:
+            with open(path, "r") as f:
+                return f.read()
+
+        stat = os.stat(path)
+        entry = self.cache.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.cache.move_to_end(path)
+            return entry[2]
+
+        with open(path, "r") as f:
+            text = f.read()
+        self.uncache(path)
+        if stat.st_size <= self.cache_size:
+            self.cache[path] = (stat.st_mtime_ns, stat.st_size, text)
+            self.cached += stat.st_size
+            while self.cached > self.cache_size:
+                self.uncache(next(iter(self.cache)))
+        return text
+
+    def uncache(self, path):
+        entry = self.cache.pop(path, None)
+        if entry is not None:
+            self.cached -= entry[1]
+
+    def read_next(self, path):
+        stream = self.streams.get(path)
+        if stream is None:
+            stream = self.streams[path] = FileStream(path)
+        text = stream.next(self.read_piece)
+        return READ_END if text is None else text
+
+    def close(self):
+        """Lets go of every file, streams start over from the beginning after this"""
+        for stream in self.streams.values():
+            stream.close()
+        self.streams.clear()
@@ -0,0 +1,490 @@
+"""Draws shapes programs from a short text description, together with the graph the
+parser should find in them. A description has one statement per line:
+
+    # a hash starts a comment
+    start = 1 (3)
+    three = 5 (4 4 4) @ 1 0
+    print = 6
+    end = 1 (4)
+    start - three - print - end
+
+`name = outline` is a shape. An outline is its number of sides, 1 for a circle and
+with a * after it if it's concave, followed by what's inside it in parentheses:
+the holes of a shape, the shapes inside a hole and so on, as in Shape.type_map.
+`@ column row` puts the shape in that cell of the grid, the others fill the free
+cells in order, snaking back and forth so that every shape is next to the one
+before it. `a - b - c` draws a path from a to b and another from b to c."""
+import re
+from collections import Counter
+from math import ceil, sqrt
+
+import cv2
+import numpy as np
+
+from shapes.shape import Shape
+
+BACKGROUND_COLOR = (255, 255, 255)
+SHAPE_COLOR = (0, 0, 0)
+PATH_COLOR = (200, 80, 0)
+
+# in pixels at scale 1
+CELL_SIZE = 400
+SHAPE_RADIUS = 150
+PATH_THICKNESS = 12
+# between a shape and what's inside it, and between a path and the shapes it passes by
+GAP = 8
+# below this the parser stops getting the sides right, whatever the scale
+MIN_RADIUS = 16
+# where the extra corner of a dented shape goes, as a part of the distance to the side it dents
+DENT_DEPTH = 0.5
+# how deep and how wide the notch of a notched square is, as a part of half its side
+NOTCH_DEPTH = 0.6
+NOTCH_WIDTH = 0.3
+# corners of the polygon a circle is classified as
+CIRCLE_POINTS = 8
+
+TOKEN = re.compile(r"\d+\*?|[()]|\S+")
+NAME = re.compile(r"[A-Za-z_]\w*$")
+
+
+class GeneratorError(Exception):
+    pass
+
+
+class Outline:
+    """A shape or a hole: how many sides it has, 1 for a circle, whether it's
+    concave and the outlines inside it"""
+
+    def __init__(self, sides, concave=False, insides=None):
+        if sides == 2 or sides < 1:
+            raise GeneratorError(f"Can't draw a shape with {sides} sides")
+        if concave and sides < 4:
+            raise GeneratorError(f"Can't draw a concave shape with {sides} sides")
+        self.sides = sides
+        self.concave = concave
+        self.insides = insides or []
+
+    def __str__(self):
+        outline = f"{self.sides}{'*' if self.concave else ''}"
+        if len(self.insides) > 0:
+            outline += f" ({' '.join(str(i) for i in self.insides)})"
+        return outline
+
+
+def parse_outline(text):
+    tokens = TOKEN.findall(text)
+    if len(tokens) == 0:
+        raise GeneratorError("Empty outline")
+    outline, end = _parse_outline(tokens, 0, text)
+    if end != len(tokens):
+        raise GeneratorError(f"Unexpected {tokens[end]} in {text}")
+    return outline
+
+
+def _parse_outline(tokens, i, text):
+    token = tokens[i]
+    if not token.rstrip("*").isdigit():
+        raise GeneratorError(f"Expected a number of sides in {text}, got {token}")
+    outline = Outline(int(token.rstrip("*")), token.endswith("*"))
+    i += 1
+
+    if i < len(tokens) and tokens[i] == "(":
+        i += 1
+        while i < len(tokens) and tokens[i] != ")":
+            inside, i = _parse_outline(tokens, i, text)
+            outline.insides.append(inside)
+        if i == len(tokens):
+            raise GeneratorError(f"Missing ) in {text}")
+        i += 1
+
+    return outline, i
+
+
+class Description:
+    """The shapes of a program by name, as (outline, (column, row) or None), and
+    its paths as pairs of names"""
+
+    def __init__(self):
+        self.shapes = {}
+        self.paths = []
+
+
+def parse_description(text):
+    description = Description()
+
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.split("#")[0].strip()
+        if line == "":
+            continue
+        try:
+            if "=" in line:
+                name, outline = (part.strip() for part in line.split("=", 1))
+                if not NAME.match(name):
+                    raise GeneratorError(f"{name} isn't a name")
+                if name in description.shapes:
+                    raise GeneratorError(f"There's already a shape called {name}")
+                position = None
+                if "@" in line:
+                    outline, position = outline.split("@", 1)
+                    try:
+                        column, row = (int(p) for p in position.split())
+                    except ValueError:
+                        raise GeneratorError(f"Expected @ column row, got @{position}")
+                    if column < 0 or row < 0:
+                        raise GeneratorError("Columns and rows start at 0")
+                    position = (column, row)
+                description.shapes[name] = (parse_outline(outline), position)
+            elif "-" in line:
+                names = [name.strip() for name in line.split("-")]
+                description.paths.extend(zip(names, names[1:]))
+            else:
+                raise GeneratorError(f"Expected a shape or paths, got {line}")
+        except GeneratorError as e:
+            raise GeneratorError(f"Line {line_number}: {e}")
+
+    seen = set()
+    for a, b in description.paths:
+        for name in (a, b):
+            if name not in description.shapes:
+                raise GeneratorError(f"There's no shape called {name}")
+        if a == b:
+            raise GeneratorError(f"A path can't go from {a} to itself")
+        if frozenset((a, b)) in seen:
+            raise GeneratorError(f"There's already a path between {a} and {b}")
+        seen.add(frozenset((a, b)))
+
+    if len(description.shapes) < 1:
+        raise GeneratorError("No shapes in the description")
+    return description
+
+
+def layout(description):
+    """(column, row) of every shape, the given ones first"""
+    positions = {}
+    for name, (_, position) in description.shapes.items():
+        if position is not None:
+            if position in positions.values():
+                raise GeneratorError(f"{name} is in a cell that's already taken")
+            positions[name] = position
+
+    placed = set(positions.values())
+    columns = max(
+        [ceil(sqrt(len(description.shapes)))] + [c + 1 for c, _ in placed]
+    )
+    free = []
+    row = 0
+    while len(free) < len(description.shapes) - len(positions):
+        cells = [(c, row) for c in range(columns)]
+        free.extend(c for c in (cells if row % 2 == 0 else cells[::-1]) if c not in placed)
+        row += 1
+
+    free = iter(free)
+    for name, (_, position) in description.shapes.items():
+        if position is None:
+            positions[name] = next(free)
+    return positions
+
+
+def regular_polygon(sides, radius, center, rotation=-np.pi / 2):
+    angles = rotation + np.arange(sides) * 2 * np.pi / sides
+    return np.stack(
+        [center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)], axis=1
+    )
+
+
+def dented_polygon(sides, radius, center, angle):
+    """A regular polygon with a side less, and an extra corner pushed in from the
+    middle of the side that faces angle"""
+    base = regular_polygon(sides - 1, radius, center, angle - np.pi / (sides - 1))
+    depth = radius * np.cos(np.pi / (sides - 1)) * DENT_DEPTH
+    corner = np.array(center) + depth * np.array([np.cos(angle), np.sin(angle)])
+    return np.vstack([base[:1], corner[None], base[1:]])
+
+
+def notched_square(sides, radius, center, angle):
+    """A square with a notch in the side that faces angle. Dented polygons with
+    that many sides are round enough for check_is_circle to take them for circles"""
+    h = radius / np.sqrt(2)
+    d, w = h * NOTCH_DEPTH, h * NOTCH_WIDTH
+    notches = {
+        5: [(h - d, 0)],
+        6: [(h, w), (w, w), (w, h)],
+        7: [(h, -w), (h - d, 0), (h, w)],
+        8: [(h, -w), (h - d, -w), (h - d, w), (h, w)],
+    }
+    points = [(-h, -h), (h, -h)] + notches[sides] + ([] if sides == 6 else [(h, h)]) + [(-h, h)]
+    # the notch of 6 sides is in a corner, turn the corner to face angle instead
+    rotation = angle - np.pi / 4 if sides == 6 else angle
+    cos, sin = np.cos(rotation), np.sin(rotation)
+    points = np.array(points, np.float64) @ np.array([[cos, sin], [-sin, cos]])
+    return points + np.array(center, np.float64)
+
+
+def get_points(outline, radius, center, angle):
+    """Corners of an outline, concave ones have their dent or notch facing angle"""
+    if outline.sides == 1:
+        return regular_polygon(CIRCLE_POINTS, radius, center)
+    if outline.concave and 5 <= outline.sides <= 8:
+        return notched_square(outline.sides, radius, center, angle)
+    if outline.concave:
+        return dented_polygon(outline.sides, radius, center, angle)
+    return regular_polygon(outline.sides, radius, center)
+
+
+def segment_distance(p, a, b):
+    """Distance of point p from the segment a b"""
+    p, a, b = (np.asarray(v, np.float64) for v in (p, a, b))
+    ab = b - a
+    t = np.clip(np.dot(p - a, ab) / max(np.dot(ab, ab), 1e-12), 0, 1)
+    return float(np.hypot(*(p - a - t * ab)))
+
+
+def inscribed(points, center):
+    """Radius of the biggest circle around center that stays inside the polygon"""
+    return min(segment_distance(center, a, b) for a, b in zip(points, np.roll(points, -1, axis=0)))
+
+
+def get_inside_slots(outline, radius, center, points, angle, count):
+    """(center, radius) of count outlines inside an outline, in a ring"""
+    if outline.sides == 1:
+        middle = np.array(center, np.float64)
+        room = radius - GAP
+    else:
+        middle = np.array(center, np.float64)
+        if outline.concave:
+            # away from the dent or notch, where there's more room
+            if 5 <= outline.sides <= 8:
+                depth = radius / np.sqrt(2) * NOTCH_DEPTH
+            else:
+                depth = radius * np.cos(np.pi / (outline.sides - 1)) * (1 - DENT_DEPTH)
+            middle -= depth / 2 * np.array([np.cos(angle), np.sin(angle)])
+        room = inscribed(points, middle) - GAP
+
+    if count == 0:
+        return []
+    if count == 1:
+        return [(middle, room)]
+
+    sin = np.sin(np.pi / count)
+    inside_radius = room * sin / (1 + sin)
+    return [
+        (middle + (room - inside_radius) * np.array([np.cos(a), np.sin(a)]), inside_radius - GAP / 2)
+        for a in -np.pi / 2 + np.arange(count) * 2 * np.pi / count
+    ]
+
+
+def draw_outline(img, outline, radius, center, angle, depth, name):
+    """Draws an outline and everything inside it, and returns it as the Shape the
+    parser should make of it"""
+    if radius < MIN_RADIUS:
+        raise GeneratorError(f"{name} doesn't have enough room for what's inside it, use a bigger scale")
+
+    points = get_points(outline, radius, center, angle)
+    color = SHAPE_COLOR if depth % 2 == 0 else BACKGROUND_COLOR
+    if outline.sides == 1:
+        cv2.circle(img, tuple(int(round(c)) for c in center), int(round(radius)), color, -1)
+    else:
+        cv2.fillPoly(img, [points.round().astype(np.int32)], color)
+
+    contour = points.round().astype(np.int32).reshape(-1, 1, 2)
+    shape = Shape(contour, outline.sides == 1, center=tuple(int(round(c)) for c in center))
+    shape.points = contour
+
+    slots = get_inside_slots(outline, radius, center, points, angle, len(outline.insides))
+    for inside, (inside_center, inside_radius) in zip(outline.insides, slots):
+        child = draw_outline(
+            img, inside, inside_radius, inside_center, get_dent_angle(inside, []), depth + 1, name
+        )
+        child.outer = shape
+        child.is_hole = True
+        shape.add_inside(child)
+
+    return shape
+
+
+def get_dent_angle(outline, angles):
+    """Where the dent or notch of a concave outline goes: the middle of the widest
+    gap between the paths leaving it"""
+    angle = 0
+    if len(angles) > 0:
+        angles = sorted(a % (2 * np.pi) for a in angles)
+        gaps = [(b - a) % (2 * np.pi) or 2 * np.pi for a, b in zip(angles, angles[1:] + angles[:1])]
+        widest = int(np.argmax(gaps))
+        angle = angles[widest] + gaps[widest] / 2
+
+    if outline.concave and 5 <= outline.sides <= 8:
+        # check_is_circle finds circles in some turns of a notched square, so the
+        # square stays level and the notch goes on the side or corner nearest angle
+        offset = np.pi / 4 if outline.sides == 6 else 0
+        angle = np.round((angle - offset) / (np.pi / 2)) * np.pi / 2 + offset
+    return angle
+
+
+def ray_distance(points, center, direction):
+    """How far from center a ray going in direction leaves the polygon for the first time"""
+    nearest = np.inf
+    center = np.asarray(center, np.float64)
+    for a, b in zip(points, np.roll(points, -1, axis=0)):
+        edge = b - a
+        denominator = direction[0] * edge[1] - direction[1] * edge[0]
+        if abs(denominator) < 1e-12:
+            continue
+        offset = a - center
+        t = (offset[0] * edge[1] - offset[1] * edge[0]) / denominator
+        u = (offset[0] * direction[1] - offset[1] * direction[0]) / denominator
+        if t > 0 and 0 <= u <= 1:
+            nearest = min(nearest, t)
+    return nearest
+
+
+def segments_cross(a, b, c, d):
+    def side(p, q, r):
+        return np.sign((q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0]))
+
+    return side(a, b, c) != side(a, b, d) and side(c, d, a) != side(c, d, b)
+
+
+def check_paths(description, centers, radius, thickness):
+    """Makes sure no path runs into a shape it doesn't connect, another path, or
+    leaves a shape too close to another path of that shape"""
+    for i, (a, b) in enumerate(description.paths):
+        for name, center in centers.items():
+            if name in (a, b):
+                continue
+            if segment_distance(center, centers[a], centers[b]) < radius + thickness / 2 + GAP:
+                raise GeneratorError(f"The path between {a} and {b} runs into {name}")
+
+        for c, d in description.paths[i + 1 :]:
+            shared = {a, b} & {c, d}
+            if len(shared) == 0:
+                if segments_cross(centers[a], centers[b], centers[c], centers[d]):
+                    raise GeneratorError(f"The paths {a} - {b} and {c} - {d} cross")
+                continue
+            # close enough where they leave the shape they share, and they become one path
+            (shared,) = shared
+            u = np.subtract(centers[({a, b} - {shared}).pop()], centers[shared])
+            v = np.subtract(centers[({c, d} - {shared}).pop()], centers[shared])
+            between = np.arccos(np.clip(np.dot(u, v) / np.hypot(*u) / np.hypot(*v), -1, 1))
+            if 2 * radius * np.sin(between / 2) < thickness + GAP:
+                raise GeneratorError(f"The paths {a} - {b} and {c} - {d} leave {shared} too close together")
+
+
+def render(description, scale=1):
+    """The image of a description and the graph the parser should find in it:
+    {"size": [width, height], "shapes": [{"name", "type", "holes", "center", "outline"}],
+    "paths": [[name, name]]}"""
+    cell = CELL_SIZE * scale
+    radius = SHAPE_RADIUS * scale
+    thickness = max(int(round(PATH_THICKNESS * scale)), 1)
+
+    positions = layout(description)
+    centers = {
+        name: (int(round((column + 0.5) * cell)), int(round((row + 0.5) * cell)))
+        for name, (column, row) in positions.items()
+    }
+    check_paths(description, centers, radius, thickness)
+
+    columns = max(c for c, _ in positions.values()) + 1
+    rows = max(r for _, r in positions.values()) + 1
+    width, height = int(round(columns * cell)), int(round(rows * cell))
+    img = np.full((height, width, 3), BACKGROUND_COLOR, np.uint8)
+    # get_mask_colors reads the colors off the left and right edges, clear of any shape
+    img[0 : int(cell // 4), 0] = SHAPE_COLOR
+    img[0 : int(cell // 4), width - 1] = PATH_COLOR
+
+    directions = {name: [] for name in description.shapes}
+    for a, b in description.paths:
+        dx, dy = np.subtract(centers[b], centers[a])
+        directions[a].append(np.arctan2(dy, dx))
+        directions[b].append(np.arctan2(-dy, -dx))
+    angles = {
+        name: get_dent_angle(outline, directions[name])
+        for name, (outline, _) in description.shapes.items()
+    }
+    points = {
+        name: get_points(outline, radius, centers[name], angles[name])
+        for name, (outline, _) in description.shapes.items()
+    }
+
+    # paths go under the shapes, so they end right at the outline of both
+    for a, b in description.paths:
+        ends = []
+        for start, end in ((a, b), (b, a)):
+            direction = np.subtract(centers[end], centers[start]).astype(np.float64)
+            direction /= np.hypot(*direction)
+            inside = ray_distance(points[start], centers[start], direction)
+            ends.append(np.asarray(centers[start]) + direction * max(inside - thickness, inside / 2))
+        cv2.line(img, *(tuple(int(round(c)) for c in e) for e in ends), PATH_COLOR, thickness)
+
+    shapes = []
+    for name, (outline, _) in description.shapes.items():
+        shape = draw_outline(img, outline, radius, centers[name], angles[name], 0, name)
+        shapes.append(
+            {
+                "name": name,
+                "type": shape.get_shape_type().name,
+                "holes": shape.get_hole_count(),
+                "center": list(centers[name]),
+                "outline": str(outline),
+            }
+        )
+
+    graph = {
+        "size": [width, height],
+        "shapes": shapes,
+        "paths": [[a, b] for a, b in description.paths],
+    }
+    return img, graph
+
+
+def generate(text, path, scale=1):
+    """Draws a description to path and returns its graph"""
+    img, graph = render(parse_description(text), scale)
+    if not cv2.imwrite(str(path), img):
+        raise GeneratorError(f"Couldn't write {path}")
+    return graph
+
+
+def compare_graph(shapes, graph):
+    """Everything the parsed shapes have that the graph doesn't and the other way
+    around, as messages. Empty when the parser found exactly what was drawn"""
+    errors = []
+    outers = [s for s in shapes if s.outer is None]
+
+    names = {}
+    for expected in graph["shapes"]:
+        center = tuple(float(c) for c in expected["center"])
+        found = [s for s in outers if cv2.pointPolygonTest(s.contour, center, False) >= 0]
+        if len(found) == 0:
+            errors.append(f"{expected['name']} wasn't found")
+            continue
+        shape = found[0]
+        names[id(shape)] = expected["name"]
+        if shape.get_shape_type().name != expected["type"]:
+            errors.append(
+                f"{expected['name']} is a {shape.get_shape_type().name} instead of a {expected['type']}"
+            )
+        elif shape.get_hole_count() != expected["holes"]:
+            errors.append(
+                f"{expected['name']} has {shape.get_hole_count()} holes instead of {expected['holes']}"
+            )
+
+    for s in outers:
+        if id(s) not in names:
+            errors.append(f"Found a {s.get_shape_type().name} at {tuple(s.center)} that wasn't drawn")
+
+    # every shape a path touches lists the others under the same key
+    touching = {}
+    for s in outers:
+        for k, (_, connected) in s.connecteds.items():
+            touching.setdefault(k, set()).add(names.get(id(s), "?"))
+            touching[k].update(names.get(id(c[0]), "?") for c in connected)
+
+    found = Counter(frozenset(t) for t in touching.values())
+    expected = Counter(frozenset(p) for p in graph["paths"])
+    for path in expected - found:
+        errors.append(f"The path {' - '.join(sorted(path))} wasn't found")
+    for path in found - expected:
+        errors.append(f"Found a path between {', '.join(sorted(path))} that wasn't drawn")
+
+    return errors
@@ -0,0 +1,202 @@
+"""Where a running program spends its steps: visits per shape and per path, time
+per operation, and a heatmap of all of it drawn over the program"""
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from shapes.interpreter import Interpreter
+from shapes.limits import Limits
+
+# rows of every table in the report
+TABLE_ROWS = 20
+# how much of the heatmap shows over the program
+HEATMAP_ALPHA = 0.6
+# shapes that get their visit count written on them
+HEATMAP_LABELS = 10
+
+
+def _point(p):
+    return tuple(int(c) for c in np.asarray(p).ravel()[:2])
+
+
+class HotspotInterpreter(Interpreter):
+    """Interpreter that keeps track of where it's been. Runs the program like the
+    shapes engine does, without waiting between steps, and times every operation.
+    The time of IN includes waiting for the input"""
+
+    def __init__(self, shapes, home_dir=None, output=None, source=None, files=None):
+        super().__init__(
+            shapes, False, 0, home_dir=home_dir, output=output, source=source, files=files
+        )
+        self.index = {id(s): i for i, s in enumerate(shapes)}
+        self.shape_visits = [0] * len(shapes)
+        self.shape_time = [0.0] * len(shapes)
+        # path contour index -> times the program went down it
+        self.path_visits = {}
+        self.op_steps = {}
+        self.op_time = {}
+        # (from, to, point) -> the path between them. the interpreter doesn't always
+        # update p_k, so the path is looked up from where it ended up instead
+        self.path_lookup = {}
+
+    def get_path(self, from_shape, to_shape, to_point):
+        key = (id(from_shape), id(to_shape), _point(to_point))
+        if key not in self.path_lookup:
+            self.path_lookup[key] = None
+            for c in from_shape.get_all_connections():
+                if c[0] is to_shape and _point(c[1]) == key[2]:
+                    self.path_lookup[key] = c[2]
+                    break
+        return self.path_lookup[key]
+
+    def step(self):
+        self.previous = self.current
+        shape_type = self.current.get_shape_type()
+        begin = perf_counter()
+        self.operations[shape_type]()
+        elapsed = perf_counter() - begin
+
+        i = self.index[id(self.previous)]
+        self.shape_visits[i] += 1
+        self.shape_time[i] += elapsed
+        self.op_steps[shape_type] = self.op_steps.get(shape_type, 0) + 1
+        self.op_time[shape_type] = self.op_time.get(shape_type, 0.0) + elapsed
+
+        if self.is_running:
+            k = self.get_path(self.previous, self.current, self.p_point)
+            if k is not None:
+                self.path_visits[k] = self.path_visits.get(k, 0) + 1
+        self.steps += 1
+
+    def run(self, limits=None):
+        self.is_running = True
+        limits = limits if limits is not None else Limits()
+        checkpoint = limits.start(self.steps)
+        begin = perf_counter()
+        try:
+            while self.is_running:
+                if self.steps + 1 == checkpoint:
+                    checkpoint = limits.check(self.steps + 1)
+                    if checkpoint is None:
+                        self.output.write(f"\n|{limits.exceeded}|\n")
+                        break
+                self.step()
+        except KeyboardInterrupt:
+            self.output.write("|aborted!|\n")
+        finally:
+            self.elapsed = perf_counter() - begin
+            self.output.flush()
+            self.files.close()
+
+    def get_path_ends(self):
+        """path contour index -> indices of the shapes it connects"""
+        ends = {}
+        for i, s in enumerate(self.shapes):
+            for k in s.connecteds.keys():
+                ends.setdefault(k, set()).add(i)
+                for c in s.connecteds[k][1]:
+                    ends[k].add(self.index[id(c[0])])
+        return ends
+
+    def describe_shape(self, i):
+        s = self.shapes[i]
+        return f"{s.get_shape_type().name} #{i} at {_point(s.center)}"
+
+    def format_report(self, rows=TABLE_ROWS):
+        """The hottest shapes, paths and operations as |lines|"""
+        steps = max(self.steps, 1)
+        lines = [f"|{self.steps} steps in {self.elapsed:.3f} seconds|", "|hottest shapes:|"]
+
+        ranked = sorted(
+            (i for i in range(len(self.shapes)) if self.shape_visits[i] > 0),
+            key=lambda i: (-self.shape_visits[i], i),
+        )
+        for rank, i in enumerate(ranked[:rows]):
+            lines.append(
+                f"|{rank + 1:>4}. {self.describe_shape(i):<36} {self.shape_visits[i]:>10} visits"
+                f" {100 * self.shape_visits[i] / steps:6.2f}% {self.shape_time[i] * 1e3:10.3f}ms|"
+            )
+
+        never = [
+            i
+            for i, s in enumerate(self.shapes)
+            if s.outer is None and self.shape_visits[i] == 0
+        ]
+        if len(never) > 0:
+            lines.append(f"|never visited: {', '.join(self.describe_shape(i) for i in never)}|")
+
+        lines.append("|hottest paths:|")
+        ends = self.get_path_ends()
+        ranked = sorted(self.path_visits.keys(), key=lambda k: (-self.path_visits[k], k))
+        for rank, k in enumerate(ranked[:rows]):
+            between = " - ".join(f"#{i}" for i in sorted(ends.get(k, ())))
+            lines.append(
+                f"|{rank + 1:>4}. path {k:<5} {between:<30} {self.path_visits[k]:>10} visits|"
+            )
+
+        lines.append("|time per operation:|")
+        ranked = sorted(self.op_time.keys(), key=lambda op: -self.op_time[op])
+        for op in ranked[:rows]:
+            lines.append(
+                f"|{op.name:>13} {self.op_steps[op]:>10} steps {self.op_time[op] * 1e3:10.3f}ms"
+                f" {self.op_time[op] / self.op_steps[op] * 1e6:8.2f}us per step|"
+            )
+        return "\n".join(lines)
+
+    def draw_heatmap(self, img):
+        """The program with every shape and path it went through colored by how
+        often it did, on a log scale. Shapes it never got to are outlined in gray"""
+        heat = np.zeros(img.shape[:2], np.float32)
+        drawn = np.zeros(img.shape[:2], np.uint8)
+        thickness = max(2, min(img.shape[:2]) // 200)
+
+        for i, s in enumerate(self.shapes):
+            if s.outer is not None:
+                continue
+            if self.shape_visits[i] == 0:
+                cv2.drawContours(img, [s.contour], -1, (128, 128, 128), thickness)
+                continue
+            value = float(np.log1p(self.shape_visits[i]))
+            cv2.drawContours(heat, [s.contour], -1, value, cv2.FILLED)
+            cv2.drawContours(drawn, [s.contour], -1, 255, cv2.FILLED)
+
+        # paths are drawn as lines from where they leave a shape to where they end up,
+        # the shapes only know those ends
+        for s in self.shapes:
+            for k in s.connecteds.keys():
+                if k not in self.path_visits:
+                    continue
+                value = float(np.log1p(self.path_visits[k]))
+                for c in s.connecteds[k][1]:
+                    start, end = _point(s.connecteds[k][0]), _point(c[1])
+                    cv2.line(heat, start, end, value, thickness)
+                    cv2.line(drawn, start, end, 255, thickness)
+
+        if heat.max() > 0:
+            levels = (heat / heat.max() * 255).astype(np.uint8)
+            colored = cv2.applyColorMap(levels, cv2.COLORMAP_JET)
+            blended = cv2.addWeighted(colored, HEATMAP_ALPHA, img, 1 - HEATMAP_ALPHA, 0)
+            img[drawn > 0] = blended[drawn > 0]
+
+        ranked = sorted(range(len(self.shapes)), key=lambda i: -self.shape_visits[i])
+        scale = max(0.5, min(img.shape[:2]) / 1000)
+        for i in ranked[:HEATMAP_LABELS]:
+            if self.shape_visits[i] == 0:
+                break
+            cv2.putText(
+                img,
+                str(self.shape_visits[i]),
+                _point(self.shapes[i].center),
+                cv2.FONT_HERSHEY_PLAIN,
+                2 * scale,
+                (255, 255, 255),
+                max(1, int(2 * scale)),
+            )
+        return img
+
+    def save_heatmap(self, image_path, out_path):
+        img = cv2.imread(str(image_path))
+        if img is None:
+            return False
+        return cv2.imwrite(str(out_path), self.draw_heatmap(img))
@@ -1,8 +1,11 @@
 from shapes.shape import Shape, ShapeEnum
 from typing import List, Union
-from time import sleep
+from time import perf_counter, sleep
 from shapes.utils import distance
-from pathlib import Path
+from shapes.files import READ_FAILED, FileReader
+from shapes.limits import Limits
+from shapes.sinks import StreamSink
+from shapes.sources import PROMPT, default_source
 
 
 class InterpreterError(Exception):
@@ -10,7 +13,16 @@ class InterpreterError(Exception):
 
 
 class Interpreter:
-    def __init__(self, shapes: List[Shape], verbose=False, time=0.3, home_dir=None):
+    def __init__(
+        self,
+        shapes: List[Shape],
+        verbose=False,
+        time=0.3,
+        home_dir=None,
+        output=None,
+        source=None,
+        files=None,
+    ):
         self.shapes = shapes
         self.stack = []
         self.current: Union(Shape, None) = None
@@ -19,9 +31,46 @@ class Interpreter:
         self.verbose = verbose
         self.time = time
         self.home_dir = home_dir
+        # what the program prints goes through here, see shapes.sinks
+        self.output = output if output is not None else StreamSink()
+        # and what IN reads comes from here, see shapes.sources
+        self.source = source if source is not None else default_source()
+        # and READ's files from here, see shapes.files
+        self.files = files if files is not None else FileReader(home_dir)
         self.steps=0
+        # seconds the last run took
+        self.elapsed = 0.0
         self.current = self.get_start()
         self.is_running = False
+        self.operations = {
+            ShapeEnum.START: self.op_start,
+            ShapeEnum.IN: self.op_in,
+            ShapeEnum.OUT: self.op_out,
+            ShapeEnum.OUT_NO_LF: self.op_out_no_lf,
+            ShapeEnum.READ: self.op_read,
+            ShapeEnum.CONTAINER: self.op_container,
+            ShapeEnum.STACK: self.op_stack,
+            ShapeEnum.JUNCTION: self.op_junction,
+            ShapeEnum.NUMBER: self.op_number,
+            ShapeEnum.POP: self.op_pop,
+            ShapeEnum.DUPE: self.op_dupe,
+            ShapeEnum.NUMBER_CHECK: self.op_number_check,
+            ShapeEnum.TO_STRING: self.op_to_string,
+            ShapeEnum.TO_CHAR: self.op_to_char,
+            ShapeEnum.CHR_TO_NUM: self.op_chr_to_num,
+            ShapeEnum.TO_NUMBER: self.op_to_number,
+            ShapeEnum.OPER: self.op_oper,
+            ShapeEnum.OR: self.op_or,
+            ShapeEnum.AND: self.op_and,
+            ShapeEnum.NOT: self.op_not,
+            ShapeEnum.EQUALS: self.op_equals,
+            ShapeEnum.LARGER: self.op_larger,
+            ShapeEnum.SMALLER: self.op_smaller,
+            ShapeEnum.LENGTH: self.op_length,
+            ShapeEnum.CONTROL: self.op_control,
+            ShapeEnum.END: self.op_end,
+            ShapeEnum.ANY: self.op_any,
+        }
 
     def get_start(self) -> Shape:
         starts = []
@@ -43,8 +92,9 @@ class Interpreter:
     def default_next(self):
         next_s = self.current.get_default_next(self.p_point)
         if next_s is None:
-            print("|finished due to dead-end|")
+            self.output.write("|finished due to dead-end|\n")
             self.is_running=False
+            return
         self.current = next_s[0]
         self.p_point = next_s[1]
         self.p_k = next_s[2]
@@ -61,353 +111,372 @@ class Interpreter:
     def push_back(self, x, y):
         self.stack.append(y)
         self.stack.append(x)
-    
-    def step(self):
-        if self.verbose:
-            print(f"|{self.steps}, current: {self.current.get_shape_type().name}|")
-            print(f"|number of points of current: {len(self.current.points)}|")
-        self.previous = self.current
-        shape_type = self.current.get_shape_type()
-        if shape_type == ShapeEnum.START:
-            # print(self.current.connecteds)
-            self.p_point = self.current.connecteds[
-                list(self.current.connecteds.keys())[0]
-            ][1][0][1]
-            self.current = self.current.connecteds[
-                list(self.current.connecteds.keys())[0]
-            ][1][0][0]
-
-        elif shape_type == ShapeEnum.IN:
-            inp = input("<<< ")
-            try:
-                self.stack.append(int(inp))
-            except ValueError:
-                try:
-                    self.stack.append(float(inp))
-                except ValueError:
-                    self.stack.append(inp)
 
-            self.default_next()
+    def op_start(self):
+        # print(self.current.connecteds)
+        self.p_point = self.current.connecteds[
+            list(self.current.connecteds.keys())[0]
+        ][1][0][1]
+        self.current = self.current.connecteds[
+            list(self.current.connecteds.keys())[0]
+        ][1][0][0]
 
-        elif shape_type == ShapeEnum.OUT:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
+    def op_in(self):
+        if self.source.interactive:
+            self.output.write(PROMPT)
+            self.output.flush()
+        self.stack.append(self.source.read())
 
-                print(val)
-            else:
-                print()
-            self.default_next()
-
-        elif shape_type == ShapeEnum.OUT_NO_LF:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
-
-                print(val, end="")
-
-            self.default_next()
-
-        elif shape_type == ShapeEnum.READ:
-            if len(self.stack) > 0:
-                    path = str(self.stack.pop())
-
-                    try:
-                        if self.home_dir is None:
-                            with open(path, "r") as f:
-                                self.stack.append(f.read())
-                        else:
-                            with open(
-                                Path(self.home_dir).joinpath(path), "r"
-                            ) as f:
-                                self.stack.append(f.read())
-                    except FileNotFoundError:
-                        self.stack.append(0)
-                    except UnicodeDecodeError:
-                        self.stack.append(1)
-                    except Exception as e:
-                        if self.verbose:
-                            print(
-                                f"|encountered unhadled exception while reading file: {e}|"
-                            )
-
-                        self.stack.append(2)
-
-            self.default_next()
-
-        elif shape_type == ShapeEnum.CONTAINER:
-            if self.current.value is not None:
-                self.stack.append(self.current.value)
-                self.current.value = None
-            else:
-                self.current.value = self.stack.pop()
-            self.default_next()
+        self.default_next()
 
-        elif shape_type == ShapeEnum.STACK:
-            if self.verbose:
-                print(f"|current local stack: {self.current.value}|")
-            if len(self.stack) > 1:
-                top = self.stack.pop()
-                bottom = self.stack.pop()
-
-                if top == 1:
-                    if self.current.value is None:
-                        self.current.value = [bottom]
-                    else:
-                        self.current.value.append(bottom)
-                elif top == 2:
+    def op_out(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
+
+            self.output.write(f"{val}\n")
+        else:
+            self.output.write("\n")
+        self.default_next()
+
+    def op_out_no_lf(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
+
+            self.output.write(f"{val}")
+
+        self.default_next()
+
+    def op_read(self):
+        if len(self.stack) > 0:
+            path = str(self.stack.pop())
+
+            value = self.files.read(path)
+            if value == READ_FAILED and self.verbose:
+                print(
+                    f"|encountered unhadled exception while reading file: {self.files.error}|"
+                )
+
+            self.stack.append(value)
+
+        self.default_next()
+
+    def op_container(self):
+        if self.current.value is not None:
+            self.stack.append(self.current.value)
+            self.current.value = None
+        else:
+            self.current.value = self.stack.pop()
+        self.default_next()
+
+    def op_stack(self):
+        if self.verbose:
+            print(f"|current local stack: {self.current.value}|")
+        if len(self.stack) > 1:
+            top = self.stack.pop()
+            bottom = self.stack.pop()
+
+            if top == 1:
+                if self.current.value is None:
+                    self.current.value = [bottom]
+                else:
+                    self.current.value.append(bottom)
+            elif top == 2:
+                self.stack.append(bottom)
+                self.stack.append(len(self.current.value))
+            elif top == 0:
+                if len(self.current.value) > 0:
                     self.stack.append(bottom)
-                    self.stack.append(len(self.current.value))
-                elif top == 0:
-                    if len(self.current.value) > 0:
-                        self.stack.append(bottom)
 
-                        self.stack.append(self.current.value.pop())
-                    else:
-                        self.stack.append(bottom)
+                    self.stack.append(self.current.value.pop())
                 else:
                     self.stack.append(bottom)
-                    self.stack.append(top)
-            self.default_next()
+            else:
+                self.stack.append(bottom)
+                self.stack.append(top)
+        self.default_next()
 
-        elif shape_type == ShapeEnum.JUNCTION:
-            self.default_next()
+    def op_junction(self):
+        self.default_next()
 
-        elif shape_type == ShapeEnum.NUMBER:
-            if self.verbose:
-                print(f"|number shape value: {self.current.get_value()}|")
-            self.stack.append(self.current.get_value())
-            self.default_next()
-
-        elif shape_type == ShapeEnum.POP:
-            if len(self.stack) > 0:
-                self.stack.pop()
-            self.default_next()
-
-        elif shape_type == ShapeEnum.DUPE:
-            if len(self.stack) > 0:
-                self.stack.append(self.stack[-1])
-            self.default_next()
-
-        elif shape_type == ShapeEnum.NUMBER_CHECK:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
-                self.stack.append(int(self.check_number(val)))
-            self.default_next()
-
-        elif shape_type == ShapeEnum.TO_STRING:
-            if len(self.stack) > 0:
-                self.stack.append(str(self.stack.pop()))
-            self.default_next()
-
-        elif shape_type == ShapeEnum.TO_CHAR:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
-                if isinstance(val, (float, int)):
-                    self.stack.append(chr(int(val)))
-                elif isinstance(val, str):
-                    self.stack.extend([i for i in val[::-1]])
-            self.default_next()
-
-        elif shape_type == ShapeEnum.CHR_TO_NUM:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
-                if isinstance(val, str):
-                    if len(val) == 1:
-                        self.stack.append(ord(val))
-                else:
-                    self.stack.append(val)
+    def op_number(self):
+        if self.verbose:
+            print(f"|number shape value: {self.current.get_value()}|")
+        self.stack.append(self.current.get_value())
+        self.default_next()
+
+    def op_pop(self):
+        if len(self.stack) > 0:
+            self.stack.pop()
+        self.default_next()
+
+    def op_dupe(self):
+        if len(self.stack) > 0:
+            self.stack.append(self.stack[-1])
+        self.default_next()
+
+    def op_number_check(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
+            self.stack.append(int(self.check_number(val)))
+        self.default_next()
+
+    def op_to_string(self):
+        if len(self.stack) > 0:
+            self.stack.append(str(self.stack.pop()))
+        self.default_next()
+
+    def op_to_char(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
+            if isinstance(val, (float, int)):
+                self.stack.append(chr(int(val)))
+            elif isinstance(val, str):
+                self.stack.extend([i for i in val[::-1]])
+        self.default_next()
+
+    def op_chr_to_num(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
+            if isinstance(val, str):
+                if len(val) == 1:
+                    self.stack.append(ord(val))
+            else:
+                self.stack.append(val)
 
-            self.default_next()
+        self.default_next()
 
-        elif shape_type == ShapeEnum.TO_NUMBER:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
+    def op_to_number(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
 
+            try:
+                self.stack.append(int(val))
+            except ValueError:
                 try:
-                    self.stack.append(int(val))
+                    self.stack.append(float(val))
                 except ValueError:
-                    try:
-                        self.stack.append(float(val))
-                    except ValueError:
-                        self.stack.append(val)
+                    self.stack.append(val)
 
-            self.default_next()
+        self.default_next()
 
-        elif shape_type == ShapeEnum.OPER:
-            if len(self.stack) > 1:
-                a = self.stack.pop()
-                b = self.stack.pop()
+    def op_oper(self):
+        if len(self.stack) > 1:
+            a = self.stack.pop()
+            b = self.stack.pop()
 
-                both_is_num = self.both_is_num(a, b)
-                neither_is_num = self.neither_is_num(a, b)
+            both_is_num = self.both_is_num(a, b)
+            neither_is_num = self.neither_is_num(a, b)
 
-                def _push_back():
-                    self.stack.append(b)
-                    self.stack.append(a)
+            def _push_back():
+                self.stack.append(b)
+                self.stack.append(a)
 
-                l = len(self.current.get_holes())
+            l = self.current.get_hole_count()
 
-                if self.verbose:
-                    print(f"|operation shape code: {l}|")
+            if self.verbose:
+                print(f"|operation shape code: {l}|")
 
-                if l == 1:
-                    if both_is_num:
-                        self.stack.append(a + b)
-                    elif neither_is_num:
-                        self.stack.append(a + b)
-                    else:
-                        _push_back()
-                elif l == 2:
-                    if both_is_num:
-                        self.stack.append(a - b)
-                    else:
-                        _push_back()
-                elif l == 3:
-                    if both_is_num:
-                        self.stack.append(a * b)
-                    else:
-                        _push_back()
-                elif l == 4:
-                    if both_is_num:
-                        if b != 0:
-                            self.stack.append(a / b)
-                        else:
-                            self.stack.append("NaN")
-                    else:
-                        _push_back()
-                elif l == 5:
-                    if both_is_num:
-                        self.stack.append(a % b)
-                    else:
-                        _push_back()
-                elif l == 6:
-                    self.stack.append(str(a) + str(b))
+            if l == 1:
+                if both_is_num:
+                    self.stack.append(a + b)
+                elif neither_is_num:
+                    self.stack.append(a + b)
                 else:
-                    self.stack.append(a)
-                    self.stack.append(b)
-            self.default_next()
-
-        elif shape_type == ShapeEnum.OR:
-            if len(self.stack) > 1:
-                a = self.stack.pop()
-                b = self.stack.pop()
-                if self.both_is_num(a, b) or self.neither_is_num(a, b):
-                    self.stack.append(a or b)
+                    _push_back()
+            elif l == 2:
+                if both_is_num:
+                    self.stack.append(a - b)
                 else:
-                    self.push_back(a, b)
-
-            self.default_next()
-
-        elif shape_type == ShapeEnum.AND:
-            if len(self.stack) > 1:
-                a = self.stack.pop()
-                b = self.stack.pop()
-                if self.both_is_num(a, b) or self.neither_is_num(a, b):
-                    self.stack.append(a and b)
+                    _push_back()
+            elif l == 3:
+                if both_is_num:
+                    self.stack.append(a * b)
                 else:
-                    self.push_back(a, b)
-
-            self.default_next()
+                    _push_back()
+            elif l == 4:
+                if both_is_num:
+                    if b != 0:
+                        self.stack.append(a / b)
+                    else:
+                        self.stack.append("NaN")
+                else:
+                    _push_back()
+            elif l == 5:
+                if both_is_num:
+                    self.stack.append(a % b)
+                else:
+                    _push_back()
+            elif l == 6:
+                self.stack.append(str(a) + str(b))
+            else:
+                self.stack.append(a)
+                self.stack.append(b)
+        self.default_next()
+
+    def op_or(self):
+        if len(self.stack) > 1:
+            a = self.stack.pop()
+            b = self.stack.pop()
+            if self.both_is_num(a, b) or self.neither_is_num(a, b):
+                self.stack.append(a or b)
+            else:
+                self.push_back(a, b)
 
-        elif shape_type == ShapeEnum.NOT:
-            if len(self.stack) > 0:
-                val = self.stack.pop()
-                self.stack.append(int(not val))
+        self.default_next()
 
-            self.default_next()
+    def op_and(self):
+        if len(self.stack) > 1:
+            a = self.stack.pop()
+            b = self.stack.pop()
+            if self.both_is_num(a, b) or self.neither_is_num(a, b):
+                self.stack.append(a and b)
+            else:
+                self.push_back(a, b)
 
-        elif shape_type == ShapeEnum.EQUALS:
-            if len(self.stack) > 1:
-                a = self.stack.pop()
-                b = self.stack.pop()
-                if self.both_is_num(a, b) or self.neither_is_num(a, b):
-                    self.stack.append(int(a == b))
-                else:
-                    self.push_back(a, b)
+        self.default_next()
 
-            self.default_next()
+    def op_not(self):
+        if len(self.stack) > 0:
+            val = self.stack.pop()
+            self.stack.append(int(not val))
 
-        elif shape_type == ShapeEnum.LARGER:
-            if len(self.stack) > 1:
-                a = self.stack.pop()
-                b = self.stack.pop()
-                if self.both_is_num(a, b) or self.neither_is_num(a, b):
-                    self.stack.append(int(a > b))
-                else:
-                    self.push_back(a, b)
+        self.default_next()
 
-            self.default_next()
+    def op_equals(self):
+        if len(self.stack) > 1:
+            a = self.stack.pop()
+            b = self.stack.pop()
+            if self.both_is_num(a, b) or self.neither_is_num(a, b):
+                self.stack.append(int(a == b))
+            else:
+                self.push_back(a, b)
 
-        elif shape_type == ShapeEnum.SMALLER:
-            if len(self.stack) > 1:
-                a = self.stack.pop()
-                b = self.stack.pop()
-                if self.both_is_num(a, b) or self.neither_is_num(a, b):
-                    self.stack.append(int(a < b))
-                else:
-                    self.push_back(a, b)
+        self.default_next()
 
-            self.default_next()
+    def op_larger(self):
+        if len(self.stack) > 1:
+            a = self.stack.pop()
+            b = self.stack.pop()
+            if self.both_is_num(a, b) or self.neither_is_num(a, b):
+                self.stack.append(int(a > b))
+            else:
+                self.push_back(a, b)
 
-        elif shape_type == ShapeEnum.LENGTH:
-            self.stack.append(len(self.stack))
-            self.default_next()
+        self.default_next()
 
-        elif shape_type == ShapeEnum.CONTROL:
-            target = None
-            if len(self.stack) > 0:
-                target = self.stack.pop()
-            matches = []
+    def op_smaller(self):
+        if len(self.stack) > 1:
+            a = self.stack.pop()
+            b = self.stack.pop()
+            if self.both_is_num(a, b) or self.neither_is_num(a, b):
+                self.stack.append(int(a < b))
+            else:
+                self.push_back(a, b)
+
+        self.default_next()
+
+    def op_length(self):
+        self.stack.append(len(self.stack))
+        self.default_next()
+
+    def op_control(self):
+        target = None
+        if len(self.stack) > 0:
+            target = self.stack.pop()
+        matches = []
+        for c in self.current.get_all_connections():
+            if c[0].get_value() == target and c[2] != self.p_k:
+                matches.append(c)
+        if len(matches) < 1:
             for c in self.current.get_all_connections():
-                if c[0].get_value() == target and c[2] != self.p_k:
+                if c[0].get_value() is None and c[2] != self.p_k:
                     matches.append(c)
-            if len(matches) < 1:
-                for c in self.current.get_all_connections():
-                    if c[0].get_value() is None and c[2] != self.p_k:
-                        matches.append(c)
-
-            min_dist = None
-            nearest = None
-            for m in matches:
-                dist = distance(self.current.center, m[1])
-                if min_dist is None or dist < min_dist:
-                    min_dist = dist
-                    nearest = m
-
-            if nearest is None:
-                print()
-                print("|finished due to dead-end|")
-                self.is_running=False
+
+        min_dist = None
+        nearest = None
+        for m in matches:
+            dist = distance(self.current.center, m[1])
+            if min_dist is None or dist < min_dist:
+                min_dist = dist
+                nearest = m
+
+        if nearest is None:
+            self.output.write("\n|finished due to dead-end|\n")
+            self.is_running=False
+        else:
             self.current = nearest[0]
             self.p_point = nearest[1]
-        elif shape_type == ShapeEnum.END:
-            print()
-            print("--------------|finished|--------------")
-            self.is_running=False
 
-        elif shape_type == ShapeEnum.ANY:
-            self.default_next()
+    def op_end(self):
+        self.output.write("\n--------------|finished|--------------\n")
+        self.is_running=False
+
+    def op_any(self):
+        self.default_next()
+
+    def step(self):
+        if self.verbose:
+            print(f"|{self.steps}, current: {self.current.get_shape_type().name}|")
+            print(f"|number of points of current: {len(self.current.points)}|")
+        self.previous = self.current
+        shape_type = self.current.get_shape_type()
+        self.operations[shape_type]()
         if self.verbose:
+            # so the program's output and what's printed about it come out in order
+            self.output.flush()
             print(f"|global stack: {self.stack}|")
             if self.is_running:
                 print("--------------------------------------")
         self.steps += 1
 
-    def run(self):
+    def run(self, limits=None):
+        """limits is a shapes.limits.Limits, the program runs until it ends without one.
+        Without waiting between steps or verbose output it runs on run_fast"""
         self.is_running=True
+        limits = limits if limits is not None else Limits()
+        checkpoint = limits.start(self.steps)
+        begin = perf_counter()
         try:
-            if self.time >= 0:
-                while True:
-                    self.step()
-                    if not self.is_running:
+            if self.time == 0 and not self.verbose:
+                self.run_fast(limits, checkpoint)
+                return
+
+            while True:
+                if self.steps + 1 == checkpoint:
+                    checkpoint = limits.check(self.steps + 1)
+                    if checkpoint is None:
+                        self.output.write(f"\n|{limits.exceeded}|\n")
                         break
-                    
+                self.step()
+                if not self.is_running:
+                    break
+
+                if self.time >= 0:
                     sleep(self.time)
-            else:
-                while True:
-                    self.step()
-                    if not self.is_running:
-                        break
+                else:
+                    self.output.flush()
                     input("|press enter|")
                     print("\r", end='\r')
         except KeyboardInterrupt:
-            print("|aborted!|")
+            self.output.write("|aborted!|\n")
+        finally:
+            self.elapsed = perf_counter() - begin
+            self.output.flush()
+            self.files.close()
+
+    def run_fast(self, limits, checkpoint):
+        """The operations one after the other, none of what step does around them"""
+        operations = self.operations
+        steps = self.steps
+        try:
+            while self.is_running:
+                steps += 1
+                if steps == checkpoint:
+                    checkpoint = limits.check(steps)
+                    if checkpoint is None:
+                        steps -= 1
+                        self.output.write(f"\n|{limits.exceeded}|\n")
+                        break
+                operations[self.current.get_shape_type()]()
+        finally:
+            self.steps = steps
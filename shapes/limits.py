@@ -0,0 +1,44 @@
+"""How long a program may run for, in steps and in seconds"""
+from time import perf_counter
+
+# steps between looks at the clock
+TIME_CHECK_STEPS = 4096
+
+
+class Limits:
+    """Checked so that a run loop only has to compare its step count to a
+    checkpoint every step, and call check when it gets there. With no limits
+    the checkpoint is never reached"""
+
+    def __init__(self, max_steps=None, max_time=None):
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.deadline = None
+        # why the run was stopped, None while it's within its limits
+        self.exceeded = None
+
+    def start(self, steps=0):
+        """The first checkpoint, for a run that's already taken steps"""
+        self.exceeded = None
+        if self.max_time is not None:
+            self.deadline = perf_counter() + self.max_time
+        return self.next_checkpoint(steps)
+
+    def next_checkpoint(self, steps):
+        checkpoints = []
+        if self.max_steps is not None:
+            # steps gets counted before the step is taken
+            checkpoints.append(self.max_steps + 1)
+        if self.deadline is not None:
+            checkpoints.append(steps + TIME_CHECK_STEPS)
+        return min(checkpoints) if len(checkpoints) > 0 else -1
+
+    def check(self, steps):
+        """The next checkpoint, or None if the run has to stop before this step"""
+        if self.max_steps is not None and steps > self.max_steps:
+            self.exceeded = f"stopped at the limit of {self.max_steps} steps"
+            return None
+        if self.deadline is not None and perf_counter() >= self.deadline:
+            self.exceeded = f"stopped at the limit of {self.max_time} seconds"
+            return None
+        return self.next_checkpoint(steps)
@@ -0,0 +1,97 @@
+import numpy as np
+
+# pixels looked at per step when counting colors, small enough to stop early on big images
+COUNT_CHUNK = 1 << 18
+
+
+def pack(pixels):
+    """BGR pixels (..., 3) as one uint32 per pixel, 0x00RRGGBB"""
+    pixels = np.asarray(pixels, np.uint8)
+    # shifted in place, a lot quicker on whole images than copying into a padded array
+    packed = pixels[..., 2].astype(np.uint32)
+    packed <<= 8
+    packed |= pixels[..., 1]
+    packed <<= 8
+    packed |= pixels[..., 0]
+    return packed
+
+
+def unpack(packed):
+    """The reverse of pack, uint32 (...) to BGR uint8 (..., 3)"""
+    packed = np.asarray(packed, np.uint32)
+    return np.stack(
+        [packed & 0xFF, (packed >> 8) & 0xFF, (packed >> 16) & 0xFF], axis=-1
+    ).astype(np.uint8)
+
+
+def count_colors(img, limit=None):
+    """Number of different colors in img, or limit if there are at least that many.
+    Stops reading the image as soon as the limit is reached"""
+    pixels = np.asarray(img).reshape(-1, 3)
+    if len(pixels) == 0:
+        return 0
+
+    if limit is not None and limit <= 2:
+        # is anything different from the first pixel? no need to sort for that
+        first = pixels[0]
+        for start in range(0, len(pixels), COUNT_CHUNK):
+            if (pixels[start : start + COUNT_CHUNK] != first).any():
+                return min(2, limit)
+        return min(1, limit)
+
+    seen = np.empty(0, np.uint32)
+    for start in range(0, len(pixels), COUNT_CHUNK):
+        seen = np.union1d(seen, pack(pixels[start : start + COUNT_CHUNK]))
+        if limit is not None and len(seen) >= limit:
+            return limit
+    return len(seen)
+
+
+def edge_palette(pixels):
+    """Colors of a strip of pixels in the order they show up, with repeats next to
+    each other merged: a a b b a gives [a, b, a]. The order matters, neighbouring
+    colors become the ranges of Parser.get_color_ranges_mask"""
+    packed = pack(np.asarray(pixels).reshape(-1, 3))
+    if len(packed) == 0:
+        return []
+
+    starts = np.empty(len(packed), bool)
+    starts[0] = True
+    np.not_equal(packed[1:], packed[:-1], out=starts[1:])
+
+    return list(unpack(packed[starts]))
+
+
+def color_ranges(colors):
+    """The (lower, upper) BGR boxes Parser.get_color_ranges_mask ORs together: every
+    color, and the box between each pair of neighbouring colors if one of them is
+    below the other in all three channels"""
+    colors = [np.asarray(c, np.uint8) for c in colors]
+    if len(colors) == 0:
+        return []
+
+    ranges = [(colors[0], colors[0])]
+    for a, b in zip(colors, colors[1:]):
+        ranges.extend([(a, b), (b, a), (a, a), (b, b)])
+
+    return [(lower, upper) for lower, upper in ranges if (lower <= upper).all()]
+
+
+def ranges_lut(groups):
+    """A lookup table from packed color to the OR of the flags of every group whose
+    ranges contain it. groups is a list of (flag, colors)"""
+    lut = np.zeros(1 << 24, np.uint8)
+    # indexed [r, g, b], the same as a packed color
+    cube = lut.reshape(256, 256, 256)
+
+    for flag, colors in groups:
+        for lower, upper in color_ranges(colors):
+            (b0, g0, r0), (b1, g1, r1) = lower.astype(int), upper.astype(int)
+            cube[r0 : r1 + 1, g0 : g1 + 1, b0 : b1 + 1] |= flag
+
+    return lut
+
+
+def label_image(img, lut):
+    """Looks every pixel of img up in lut, a single pass over the image"""
+    return lut[pack(img)]
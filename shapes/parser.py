@@ -1,31 +1,131 @@
 import cv2
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 from dotmap import DotMap
 import imutils
 from scipy.spatial import KDTree
 
+from shapes import palette, tiled
 from shapes.shape import Shape
+from shapes.timings import Timings
+
+# how far (in pixels) the morphology in get_path_connections can reach
+CONNECTION_ROI_REACH = 24
+# how much room to leave around a path's roi, twice the reach so that it rarely has to grow
+CONNECTION_ROI_MARGIN = 2 * CONNECTION_ROI_REACH
 
 
 class ParserError(Exception):
     pass
 
 
+class PyramidFallback(Exception):
+    """The coarse level of a pyramid parse can't be trusted, parse at full resolution instead"""
+
+
+# classification below this many contours isn't worth starting worker processes for
+PARALLEL_MIN_CONTOURS = 64
+
+# set in every classification worker by init_classify_worker, so the mask is only sent once
+_worker_mask = None
+_worker_classifier = None
+
+
+def init_classify_worker(mask, classifier):
+    global _worker_mask, _worker_classifier
+    _worker_mask = mask
+    _worker_classifier = classifier
+
+
+def classify_in_worker(job):
+    i, cnt = job
+    return Parser.classify_contour(cnt, _worker_mask, i, _worker_classifier)
+
+
+ADJACENCY_ENGINES = ("label", "flood")
+# paths up to 3 pixels away from a shape touch it, about as far as the flood engine bridges
+LABEL_TOUCH_KERNEL = 7
+
+# color group flags of the label image get_masks builds
+BG_LABEL = 1
+SHAPE_LABEL = 2
+PATH_LABEL = 4
+
+CIRCLE_CLASSIFIERS = ("hough", "geometric")
+# thresholds of the geometric classifier, calibrated against the hough one on the bundled images.
+# a drawn circle scores about 0.9 circularity, 0.99 solidity and 0.005 ellipse residual
+CIRCLE_MIN_CIRCULARITY = 0.75
+CIRCLE_MIN_SOLIDITY = 0.95
+CIRCLE_MAX_ELLIPSE_RESIDUAL = 0.021
+
+# pyramid mode. coarse pixels the image needs to be at least, both ways
+PYRAMID_MIN_SIZE = 32
+# and every shape, a smaller one might not be the same shape at full resolution
+PYRAMID_MIN_SHAPE_SIZE = 4
+# full resolution pixels around a shape's box that get looked at with it: as far as a
+# path can be and still touch it, the dilation in get_connecting_points, and a few
+# more so the dilations at the edges of the box don't reach the shape
+PYRAMID_ROI_MARGIN = LABEL_TOUCH_KERNEL // 2 + 10 + 4
+
+
 class Parser:
-    def __init__(self, path, debug=False):
+    def __init__(
+        self,
+        path,
+        debug=False,
+        adjacency="label",
+        classifier="hough",
+        workers=1,
+        jobs=1,
+        memory_budget=None,
+        pyramid=0,
+    ):
+        if adjacency not in ADJACENCY_ENGINES:
+            raise ParserError(f"Unknown adjacency engine {adjacency}")
+        if classifier not in CIRCLE_CLASSIFIERS:
+            raise ParserError(f"Unknown circle classifier {classifier}")
+        if pyramid < 0:
+            raise ParserError("Pyramid levels start at 0")
+        if pyramid > 0 and adjacency != "label":
+            raise ParserError("Pyramid levels only work with the label adjacency engine")
+        if pyramid > 0 and memory_budget is not None:
+            raise ParserError("Pyramid levels and a memory budget don't mix")
         if not Path(path).is_file():
             raise ParserError("Huh? Can't find that file anywhere")
-        self.img = cv2.imread(path)
+        # filled in stage by stage as the image gets parsed
+        self.timings = Timings()
+        with self.timings.stage("load"):
+            self.img = cv2.imread(path)
         if self.img is None:
             raise ParserError("That's not an image (I think)")
-        self.debug_out = self.img.copy()
-        if len(self.get_image_colors(self.img)) < 2:
+        with self.timings.stage("palette"):
+            colors = palette.count_colors(self.img, limit=2)
+        if colors < 2:
             raise ParserError("Wtf are you trying to do?")
-        self.imgray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+        # only drawn on in debug mode, no need to keep another copy of the image around otherwise
+        self.debug_out = self.img.copy() if debug else None
+
+        # in megabytes. without a budget everything is done on the whole image at once
+        self.tile_size = None
+        if memory_budget is not None:
+            try:
+                self.tile_size = tiled.get_tile_size(memory_budget * 2**20, self.img.shape)
+            except tiled.TileError as e:
+                raise ParserError(str(e))
 
         self.home_dir = Path(path).absolute().parent
         self.debug = debug
+        self.adjacency = adjacency
+        self.classifier = classifier
+        # 0 means one worker per core
+        self.workers = workers if workers > 0 else os.cpu_count() or 1
+        self.jobs = jobs if jobs > 0 else os.cpu_count() or 1
+        # parse on the image shrunk by 2^pyramid first. set to why it didn't work out if it had to give up
+        self.pyramid = pyramid
+        self.pyramid_fallback = None
 
         if not Path(self.get_path("debugging")).is_dir():
             Path(self.get_path("debugging")).mkdir()
@@ -34,24 +134,13 @@ class Parser:
         return str(Path(self.home_dir).joinpath(path).absolute())
 
     def get_image_colors(self, img):
-        color_index = np.unique(img, axis=0, return_inverse=True)
-
-        ordered_color_index = []
-
-        for i in color_index[1]:
-            if len(ordered_color_index) > 0:
-                if i != ordered_color_index[-1]:
-                    ordered_color_index.append(i)
-            else:
-                ordered_color_index.append(i)
-
-        return [color_index[0][i] for i in ordered_color_index]
+        return palette.edge_palette(img)
 
     def debug_save_image(self, src, name):
         cv2.imwrite(self.get_path("debugging/" + name), src)
 
     def get_color_ranges_mask(self, colors, img):
-        c_range_sum = np.zeros(self.imgray.shape, np.uint8)
+        c_range_sum = np.zeros(self.img.shape[:2], np.uint8)
         c_range = cv2.inRange(img, colors[0], colors[0])
         c_range_sum = cv2.bitwise_or(c_range_sum, c_range)
         for i in range(len(colors) - 1):
@@ -66,8 +155,17 @@ class Parser:
 
         return c_range_sum
 
+    def get_color_labels(self, groups):
+        """Flags of the color groups every pixel belongs to, like ORing together
+        get_color_ranges_mask(colors, self.img) for each group but in one pass"""
+        return palette.label_image(self.img, palette.ranges_lut(groups))
+
+    @staticmethod
+    def label_mask(labels, label):
+        return cv2.compare(labels & label, 0, cv2.CMP_NE)
+
     def get_color_ranges_mask2(self, colors, img):
-        c_range_sum = np.zeros(self.imgray.shape, np.uint8)
+        c_range_sum = np.zeros(self.img.shape[:2], np.uint8)
         for i in range(len(colors)):
             c_range = cv2.inRange(img, colors[i], colors[i])
             c_range_sum = cv2.bitwise_or(c_range_sum, c_range)
@@ -85,7 +183,8 @@ class Parser:
 
         return img_copy
 
-    def get_masks(self):
+    def get_mask_colors(self):
+        """The background, shape and path colors, read off the bottom, left and right edges"""
         (img_height, img_width, _) = self.img.shape
 
         bottom_edge = self.img[img_height - 1, 0 : img_width - 1]
@@ -94,10 +193,6 @@ class Parser:
 
         if len(bg_colors) == 1:
             bg_colors.append(bg_colors[0])
-        bg_range_sum = self.get_color_ranges_mask(bg_colors, self.img)
-
-        bg_mask = cv2.bitwise_not(bg_range_sum)
-        bg_mask = Parser.clean(bg_mask, iters=2)
 
         left_edge = self.img[0 : img_height - 1, 0]
         right_edge = self.img[0 : img_height - 1, img_width - 1]
@@ -126,14 +221,19 @@ class Parser:
             print(f"|shape colors: {shape_colors}|")
             print(f"|path colors: {path_colors}|")
 
-        shape_mask = self.get_color_ranges_mask(shape_colors, self.img)
-        path_mask = self.get_color_ranges_mask(path_colors, self.img)
+        return bg_colors, shape_colors, path_colors
 
-        shape_mask_cleaned = self.clean_contours_touching_edges(shape_mask)
-        shape_mask_cleaned = Parser.clean_holes(shape_mask_cleaned)
+    @staticmethod
+    def get_bg_mask(labels):
+        bg_mask = cv2.bitwise_not(Parser.label_mask(labels, BG_LABEL))
+        return Parser.clean(bg_mask, iters=2)
 
-        path_mask_cleaned = self.clean_contours_touching_edges(path_mask)
-        path_mask_cleaned = Parser.clean_holes(path_mask_cleaned)
+    @staticmethod
+    def clean_masks(shape_mask, path_mask):
+        """Closes the gaps in the shape and path masks once the contours touching the
+        edges are gone, and takes the shapes out of the paths"""
+        shape_mask_cleaned = Parser.clean_holes(shape_mask)
+        path_mask_cleaned = Parser.clean_holes(path_mask)
 
         path_mask_cleaned_sub = path_mask_cleaned - shape_mask_cleaned
         path_mask_cleaned_sub = cv2.inRange(path_mask_cleaned_sub, 255, 255)
@@ -144,14 +244,81 @@ class Parser:
         path_mask_cleaned_sub = Parser.clean(path_mask_cleaned_sub)
         path_mask_cleaned_sub = Parser.clean_holes(path_mask_cleaned_sub)
 
+        return shape_mask_cleaned, path_mask_cleaned_sub
+
+    def get_masks(self, colors=None):
+        if self.tile_size is not None:
+            return self.get_masks_tiled(colors)
+
+        bg_colors, shape_colors, path_colors = colors or self.get_mask_colors()
+
+        labels = self.get_color_labels(
+            [(BG_LABEL, bg_colors), (SHAPE_LABEL, shape_colors), (PATH_LABEL, path_colors)]
+        )
+
+        bg_mask = Parser.get_bg_mask(labels)
+
+        shape_mask = Parser.label_mask(labels, SHAPE_LABEL)
+        path_mask = Parser.label_mask(labels, PATH_LABEL)
+
+        shape_mask_cleaned, path_mask_cleaned_sub = Parser.clean_masks(
+            self.clean_contours_touching_edges(shape_mask),
+            self.clean_contours_touching_edges(path_mask),
+        )
+
+        return self.get_mask_map(shape_mask_cleaned, path_mask_cleaned_sub, bg_mask)
+
+    def get_masks_tiled(self, colors=None):
+        """get_masks, one overlapping tile at a time. Only the finished masks and the
+        raw shape and path masks are ever full size"""
+        bg_colors, shape_colors, path_colors = colors or self.get_mask_colors()
+        lut = palette.ranges_lut(
+            [(BG_LABEL, bg_colors), (SHAPE_LABEL, shape_colors), (PATH_LABEL, path_colors)]
+        )
+
+        img_shape = self.img.shape[:2]
+        bg_mask = np.empty(img_shape, np.uint8)
+        shape_mask = np.empty(img_shape, np.uint8)
+        path_mask = np.empty(img_shape, np.uint8)
+
+        for core, padded in tiled.get_tiles(img_shape, self.tile_size, tiled.TILE_OVERLAP):
+            x0, y0, x1, y1 = core
+            px0, py0, px1, py1 = padded
+            labels = palette.label_image(self.img[py0:py1, px0:px1], lut)
+            bg_mask[y0:y1, x0:x1] = tiled.crop_core(Parser.get_bg_mask(labels), core, padded)
+            labels = tiled.crop_core(labels, core, padded)
+            shape_mask[y0:y1, x0:x1] = Parser.label_mask(labels, SHAPE_LABEL)
+            path_mask[y0:y1, x0:x1] = Parser.label_mask(labels, PATH_LABEL)
+        del labels
+        del lut
+
+        # the only step that needs to see whole shapes, it goes component by component
+        tiled.clear_edge_components(shape_mask, self.tile_size)
+        tiled.clear_edge_components(path_mask, self.tile_size)
+
+        shape_mask_cleaned = np.empty(img_shape, np.uint8)
+        path_mask_cleaned_sub = np.empty(img_shape, np.uint8)
+
+        for core, padded in tiled.get_tiles(img_shape, self.tile_size, tiled.TILE_OVERLAP):
+            x0, y0, x1, y1 = core
+            px0, py0, px1, py1 = padded
+            shape_tile, path_tile = Parser.clean_masks(
+                shape_mask[py0:py1, px0:px1], path_mask[py0:py1, px0:px1]
+            )
+            shape_mask_cleaned[y0:y1, x0:x1] = tiled.crop_core(shape_tile, core, padded)
+            path_mask_cleaned_sub[y0:y1, x0:x1] = tiled.crop_core(path_tile, core, padded)
+
+        return self.get_mask_map(shape_mask_cleaned, path_mask_cleaned_sub, bg_mask)
+
+    def get_mask_map(self, shape_mask, path_mask, bg_mask):
         if self.debug:
-            self.debug_save_image(shape_mask_cleaned, "shape.png")
-            self.debug_save_image(path_mask_cleaned_sub, "path.png")
+            self.debug_save_image(shape_mask, "shape.png")
+            self.debug_save_image(path_mask, "path.png")
             self.debug_save_image(bg_mask, "back.png")
 
         masks = {
-            "shape": shape_mask_cleaned,
-            "path": path_mask_cleaned_sub,
+            "shape": shape_mask,
+            "path": path_mask,
             "bg": bg_mask,
         }
         mask_map = DotMap(masks)
@@ -190,15 +357,13 @@ class Parser:
     def crop_contour(cnt, img):
         _, _, width, height = cv2.boundingRect(cnt)
 
-        cnt_list = []
-
-        for p in cnt:
-            cnt_list.append([p[0][0], p[0][1]])
-
-        cnt_list = np.array(cnt_list)
+        cnt_list = cnt.reshape(-1, 2)
 
         cnt_list = cnt_list - cnt_list.min(axis=0)
-        mask = np.zeros(img.shape, np.uint8)
+        # only as big as the contour, a full image per contour adds up on big images
+        mask = np.zeros(
+            (min(height, img.shape[0]), min(width, img.shape[1])) + img.shape[2:], np.uint8
+        )
         cv2.drawContours(mask, [cnt_list], -1, (255, 255, 255), -1, cv2.LINE_AA)
 
         return mask[0:height, 1:width]
@@ -251,6 +416,93 @@ class Parser:
 
         return (circles2 is not None or circles is not None) and roughness < 2
 
+    @staticmethod
+    def get_ellipse_residual(cnt):
+        """Mean relative distance of the contour's outline from its fitted ellipse"""
+        (cx, cy), (major, minor), angle = cv2.fitEllipse(cnt)
+        if major == 0 or minor == 0:
+            return np.inf
+
+        # CHAIN_APPROX_SIMPLE leaves only the corners of straight edges, and the corners of
+        # a polygon can all sit on an ellipse, so sample the edges in between too
+        start = cnt.reshape(-1, 2).astype(np.float64)
+        end = np.roll(start, -1, axis=0)
+        steps = np.maximum(np.ceil(np.hypot(*(end - start).T)).astype(int), 1)
+        segment = np.repeat(np.arange(len(start)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+        outline = start[segment] + (end - start)[segment] * t[:, None] - (cx, cy)
+
+        theta = np.deg2rad(angle)
+        cos, sin = np.cos(theta), np.sin(theta)
+        x = outline[:, 0] * cos + outline[:, 1] * sin
+        y = outline[:, 1] * cos - outline[:, 0] * sin
+        r = np.sqrt((x / (major / 2)) ** 2 + (y / (minor / 2)) ** 2)
+
+        return float(np.mean(np.abs(r - 1)))
+
+    @staticmethod
+    def check_is_circle_geometric(cnt):
+        # fitEllipse needs at least 5 points
+        if len(cnt) < 5:
+            return False
+
+        area = cv2.contourArea(cnt)
+        perimeter = cv2.arcLength(cnt, True)
+        if area == 0 or perimeter == 0:
+            return False
+
+        circularity = 4 * np.pi * area / perimeter**2
+        if circularity < CIRCLE_MIN_CIRCULARITY:
+            return False
+
+        solidity = area / cv2.contourArea(cv2.convexHull(cnt))
+        if solidity < CIRCLE_MIN_SOLIDITY:
+            return False
+
+        return Parser.get_ellipse_residual(cnt) < CIRCLE_MAX_ELLIPSE_RESIDUAL
+
+    @staticmethod
+    def classify_contour(cnt, mask, i, classifier):
+        """Everything get_shapes needs to know about a single contour:
+        (is_circle, approx, center, error)"""
+        peri = cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, 0.023 * peri, True)
+
+        is_circle = False
+        error = None
+
+        try:
+            if classifier == "geometric":
+                is_circle = Parser.check_is_circle_geometric(cnt)
+            else:
+                is_circle = Parser.check_is_circle(cnt, mask, i)
+        except Exception as e:
+            # exceptions don't always survive the trip back from a worker, their message does
+            error = str(e)
+
+        return bool(is_circle), approx, Parser.contour_center(approx), error
+
+    def classify_contours(self, contours, mask):
+        if self.workers < 2 or len(contours) < PARALLEL_MIN_CONTOURS:
+            return [
+                Parser.classify_contour(cnt, mask, i, self.classifier)
+                for i, cnt in enumerate(contours)
+            ]
+
+        with ProcessPoolExecutor(
+            self.workers,
+            initializer=init_classify_worker,
+            initargs=(mask, self.classifier),
+        ) as executor:
+            # map keeps the order of the contours, whichever worker finishes first
+            return list(
+                executor.map(
+                    classify_in_worker,
+                    enumerate(contours),
+                    chunksize=max(len(contours) // (self.workers * 4), 1),
+                )
+            )
+
     @staticmethod
     def dilate(img, kernel_size=2, iterations=1):
         kernel = np.ones((kernel_size, kernel_size), np.uint8)
@@ -264,29 +516,23 @@ class Parser:
     def get_shapes(self, contours, hierarchy, mask):
         shapes = []
 
-        for i, cnt in enumerate(contours):
-            peri = cv2.arcLength(cnt, True)
-            approx = cv2.approxPolyDP(cnt, 0.023 * peri, True)
+        classified = self.classify_contours(contours, mask)
 
+        for cnt, (is_circle, approx, center, error) in zip(contours, classified):
             shape = None
 
-            is_circle = False
-
-            try:
-                is_circle = Parser.check_is_circle(cnt, mask, i)
-            except Exception as e:
-                if self.debug:
-                    print(f"|exception {e} while parsing|")
+            if error is not None and self.debug:
+                print(f"|exception {error} while parsing|")
 
             if is_circle:
-                shape = Shape(cnt, True, center=Parser.contour_center(approx))
+                shape = Shape(cnt, True, center=center)
                 shape.points = approx
                 if self.debug:
                     cv2.drawContours(
                         self.debug_out, [cnt], -1, (0, 0, 255), thickness=5
                     )
             else:
-                shape = Shape(cnt, False, center=Parser.contour_center(approx))
+                shape = Shape(cnt, False, center=center)
                 shape.points = approx
 
             shapes.append(shape)
@@ -307,26 +553,184 @@ class Parser:
                 no_holes[i] = shape
         return no_holes
 
-    def get_connections(self, path_contours, shapes, masks):
-        def flatten_circ(circ):
-            return (circ[0][0], circ[0][1], circ[1])
+    @staticmethod
+    def get_roi(rect, img_shape, margin):
+        x, y, w, h = rect
+        return (
+            max(x - margin, 0),
+            max(y - margin, 0),
+            min(x + w + margin, img_shape[1]),
+            min(y + h + margin, img_shape[0]),
+        )
+
+    @staticmethod
+    def rects_overlap(a, b):
+        return (
+            a[0] < b[0] + b[2]
+            and b[0] < a[0] + a[2]
+            and a[1] < b[1] + b[3]
+            and b[1] < a[1] + a[3]
+        )
+
+    @staticmethod
+    def rects_union(a, b):
+        x0 = min(a[0], b[0])
+        y0 = min(a[1], b[1])
+        x1 = max(a[0] + a[2], b[0] + b[2])
+        y1 = max(a[1] + a[3], b[1] + b[3])
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    @staticmethod
+    def mask_contour_roi(cnt, roi):
+        x0, y0, x1, y1 = roi
+        mask = np.zeros((y1 - y0, x1 - x0), np.uint8)
+        cv2.drawContours(mask, [cnt], -1, 255, -1, offset=(-x0, -y0))
+        return mask
+
+    @staticmethod
+    def is_inside_roi(rect, roi, img_shape, margin):
+        """Whether rect stays at least margin away from every side of roi
+        that isn't also a side of the image"""
+        x0, y0, x1, y1 = roi
+        x, y, w, h = rect
+        return not (
+            (x0 > 0 and x - x0 < margin)
+            or (y0 > 0 and y - y0 < margin)
+            or (x1 < img_shape[1] and x1 - (x + w) < margin)
+            or (y1 < img_shape[0] and y1 - (y + h) < margin)
+        )
+
+    def get_path_connections(self, cnt, roi, masks, invariants):
+        """Finds the contours of the shapes connected to a path, only looking
+        inside roi. Returns them in image coordinates along with the bounding
+        rect of the flooded area, so the caller can tell if roi was big enough"""
+        shape_mask_erode, real_back, shapes_no_holes = invariants
+        x0, y0, x1, y1 = roi
+
+        shape_mask = masks.shape[y0:y1, x0:x1]
+        path_mask = masks.path[y0:y1, x0:x1]
+
+        path_cnt_mask = Parser.mask_contour_roi(cnt, roi)
+        path_cnt_dilate = Parser.dilate(path_cnt_mask, 2)
+        path_cnt_dilate_big = Parser.dilate(path_cnt_mask, 6)
+
+        fused = cv2.bitwise_or(path_cnt_dilate, shape_mask)
+        clean_fused = Parser.clean_holes(fused)
+
+        all_except = cv2.bitwise_xor(path_mask, path_cnt_mask)
+
+        intersection = cv2.bitwise_and(
+            path_cnt_dilate_big, shape_mask_erode[y0:y1, x0:x1]
+        )
+        intersect_ind = np.where(intersection == 255)
+        intersect_coords = list(zip(intersect_ind[1], intersect_ind[0]))
+
+        flooded = clean_fused.copy()
+        flooded_rect = None
+        for int_i in range(len(intersect_coords))[:1]:
+            x, y, w, h = cv2.floodFill(flooded, None, intersect_coords[int_i], 100)[3]
+            flooded_rect = (x + x0, y + y0, w, h)
+
+        flooded_ranged = cv2.inRange(flooded, 100, 100)
+        flooded_sub = flooded_ranged - real_back[y0:y1, x0:x1]
+        flooded_final = flooded_sub - all_except
+        flooded_clean = Parser.clean(flooded_final)
+        flooded_clean = Parser.dilate(flooded_clean)
+        flooded_clean = Parser.clean_holes(flooded_clean, 16, 2)
+        flooded_clean = cv2.bitwise_and(flooded_clean, shapes_no_holes[y0:y1, x0:x1])
+
+        connected_shapes = flooded_clean - path_cnt_dilate
+        connected_shapes_f = connected_shapes.copy()
+        cv2.floodFill(connected_shapes_f, None, (0, 0), 100, 10, 10)
+        connected_shapes_r = cv2.inRange(connected_shapes_f, 100, 100)
+        connected_shapes_clean = cv2.bitwise_not(connected_shapes_r)
+        connected_shapes_clean = Parser.clean_holes(connected_shapes_clean)
+
+        connected_shapes_contours, _ = cv2.findContours(
+            connected_shapes_clean,
+            cv2.RETR_TREE,
+            cv2.CHAIN_APPROX_SIMPLE,
+            offset=(x0, y0),
+        )
+
+        return connected_shapes_contours, flooded_rect
+
+    def get_path_shapes(
+        self,
+        cnt,
+        shape_rects,
+        shape_tree,
+        shape_circles_list,
+        shape_circles_dict,
+        masks,
+        invariants,
+    ):
+        """Indices of the shapes a single path touches, in the order they were found"""
+        img_shape = masks.path.shape
+
+        # everything a path can reach is the path itself and the shapes touching
+        # it, so start with those and grow the roi if the flood gets near its edge
+        path_rect = cv2.boundingRect(cnt)
+        near_path = Parser.get_roi(path_rect, img_shape, 8)
+        near_path = (
+            near_path[0],
+            near_path[1],
+            near_path[2] - near_path[0],
+            near_path[3] - near_path[1],
+        )
+        for shape_rect in shape_rects:
+            if Parser.rects_overlap(near_path, shape_rect):
+                path_rect = Parser.rects_union(path_rect, shape_rect)
+
+        roi = Parser.get_roi(path_rect, img_shape, CONNECTION_ROI_MARGIN)
+        while True:
+            connected_shapes_contours, flooded_rect = self.get_path_connections(
+                cnt, roi, masks, invariants
+            )
+            if flooded_rect is None or Parser.is_inside_roi(
+                flooded_rect, roi, img_shape, CONNECTION_ROI_REACH
+            ):
+                break
+            roi_rect = (roi[0], roi[1], roi[2] - roi[0], roi[3] - roi[1])
+            roi = Parser.get_roi(
+                Parser.rects_union(roi_rect, flooded_rect),
+                img_shape,
+                CONNECTION_ROI_MARGIN,
+            )
+
+        path_shapes = []
+        for connected_cnt in connected_shapes_contours:
+            (x, y), radius = cv2.minEnclosingCircle(connected_cnt)
+            q_circ = shape_circles_list[shape_tree.query((x, y, radius))[1]]
+            path_shapes.append(shape_circles_dict[q_circ])
+
+        return path_shapes
+
+    def map_jobs(self, fn, items):
+        """map() that runs on a thread pool when jobs > 1. The work handed to it is
+        mostly OpenCV and numpy calls, which let go of the GIL"""
+        if self.jobs < 2 or len(items) < 2:
+            return list(map(fn, items))
+
+        with ThreadPoolExecutor(self.jobs) as executor:
+            return list(executor.map(fn, items))
 
+    def get_connections(self, path_contours, shapes, masks):
         connections = {}
 
         shape_circles_dict = {}
         shape_circles_list = []
+        shape_rects = []
 
         for (ind, s) in shapes.items():
             (x, y), radius = cv2.minEnclosingCircle(s.contour)
             shape_circles_dict[(x, y, radius)] = ind
             shape_circles_list.append((x, y, radius))
+            shape_rects.append(cv2.boundingRect(s.contour))
 
         shape_tree = KDTree(shape_circles_list)
 
         real_back = cv2.bitwise_not(cv2.bitwise_or(masks.shape, masks.path))
-        back_only_flood = real_back.copy()
-
-        cv2.floodFill(back_only_flood, None, (0, 0), 0)[1]
 
         real_back_shape = cv2.bitwise_not(
             masks.shape,
@@ -336,54 +740,24 @@ class Parser:
         shapes_no_holes = cv2.bitwise_xor(back_only_flood_shape, real_back_shape)
         shapes_no_holes = cv2.bitwise_not(shapes_no_holes)
 
-        for i, cnt in enumerate(path_contours):
-            path_cnt_mask = Parser.mask_contour(cnt, masks.path)
-            path_cnt_dilate = Parser.dilate(path_cnt_mask, 2)
-            path_cnt_dilate_big = Parser.dilate(path_cnt_mask, 6)
-            shape_mask_erode = Parser.erode(masks.shape, 2)
-
-            fused = cv2.bitwise_or(path_cnt_dilate, masks.shape)
-            clean_fused = Parser.clean_holes(fused)
-
-            all_except = cv2.bitwise_xor(masks.path, path_cnt_mask)
-
-            intersection = cv2.bitwise_and(path_cnt_dilate_big, shape_mask_erode)
-            intersect_ind = np.where(intersection == 255)
-            intersect_coords = list(zip(intersect_ind[1], intersect_ind[0]))
-
-            flooded = clean_fused.copy()
-            for int_i in range(len(intersect_coords))[:1]:
-                cv2.floodFill(flooded, None, intersect_coords[int_i], 100)
-
-            flooded_ranged = cv2.inRange(flooded, 100, 100)
-            flooded_sub = flooded_ranged - real_back
-            flooded_final = flooded_sub - all_except
-            flooded_clean = Parser.clean(flooded_final)
-            flooded_clean = Parser.dilate(flooded_clean)
-            flooded_clean = Parser.clean_holes(flooded_clean, 16, 2)
-            flooded_clean = cv2.bitwise_and(flooded_clean, shapes_no_holes)
-
-            connected_shapes = flooded_clean - path_cnt_dilate
-            connected_shapes_f = connected_shapes.copy()
-            cv2.floodFill(connected_shapes_f, None, (0, 0), 100, 10, 10)
-            connected_shapes_r = cv2.inRange(connected_shapes_f, 100, 100)
-            connected_shapes_clean = cv2.bitwise_not(connected_shapes_r)
-            connected_shapes_clean = Parser.clean_holes(connected_shapes_clean)
-
-            # debuggeryyyy
-            # self.debug_save_image(connected_shapes_clean, f"{i}-conn.png")
-            # self.debug_save_image(clean_fused, f"{i}-fused.png")
-
-            connected_shapes_contours, _ = cv2.findContours(
-                connected_shapes_clean, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
-            )
+        shape_mask_erode = Parser.erode(masks.shape, 2)
 
-            for k, connected_cnt in enumerate(connected_shapes_contours):
-                c_circ = flatten_circ(cv2.minEnclosingCircle(connected_cnt))
+        invariants = (shape_mask_erode, real_back, shapes_no_holes)
 
-                q_circ = shape_circles_list[shape_tree.query(c_circ)[1]]
-                q_shape = shape_circles_dict[q_circ]
+        def find_path_shapes(cnt):
+            return self.get_path_shapes(
+                cnt,
+                shape_rects,
+                shape_tree,
+                shape_circles_list,
+                shape_circles_dict,
+                masks,
+                invariants,
+            )
 
+        # merged in path order, so the result doesn't depend on which job finishes first
+        for i, path_shapes in enumerate(self.map_jobs(find_path_shapes, path_contours)):
+            for q_shape in path_shapes:
                 if i not in connections.keys():
                     connections[i] = [q_shape]
                 else:
@@ -392,6 +766,155 @@ class Parser:
 
         return connections
 
+    def get_connections_labeled(self, path_contours, path_hierarchy, shape_labels, masks):
+        """Same as get_connections, but labels every path once and finds every
+        touching path and shape in one go instead of flooding each path.
+
+        Only the outer contour of a path gets connections, its holes don't"""
+        connections = {}
+        if len(path_contours) < 1:
+            return connections
+
+        path_count, path_labels = cv2.connectedComponents(masks.path, connectivity=8)
+
+        label_to_k = np.full(path_count, -1, np.int64)
+        for k, cnt in enumerate(path_contours):
+            if path_hierarchy[0][k][3] == -1:
+                x, y = cnt[0][0]
+                label_to_k[path_labels[y, x]] = k
+
+        # a pixel near two paths only gets one of them from each dilation,
+        # so take both the largest and the smallest neighbouring label
+        path_labels_f = path_labels.astype(np.float32)
+        near_max = Parser.dilate(path_labels_f, LABEL_TOUCH_KERNEL)
+        path_labels_f[path_labels == 0] = path_count
+        near_min = Parser.erode(path_labels_f, LABEL_TOUCH_KERNEL)
+        near_min[near_min == path_count] = 0
+
+        touching = shape_labels * (masks.shape == 255)
+
+        pairs = []
+        for near in (near_max, near_min):
+            both = (near > 0) & (touching > 0)
+            pairs.append(
+                near[both].astype(np.int64) * (shape_labels.max() + 1) + touching[both]
+            )
+        pairs = np.unique(np.concatenate(pairs))
+
+        for pair in pairs:
+            path_label, shape_label = divmod(int(pair), int(shape_labels.max()) + 1)
+            k = int(label_to_k[path_label])
+            if k == -1:
+                continue
+            if k not in connections.keys():
+                connections[k] = [shape_label - 1]
+            else:
+                connections[k].append(shape_label - 1)
+                connections[k] = list(set(connections[k]))
+
+        # same order the flood engine finds them in
+        return {k: connections[k] for k in sorted(connections.keys())}
+
+    def get_connections_by_path(self, path_contours, path_hierarchy, shape_labels, masks):
+        """get_connections_labeled for one path at a time, so nothing has to be labelled
+        at full size. Where three or more paths come within reach of the same shape
+        pixel, get_connections_labeled only sees the two with the smallest and
+        largest labels there and this sees them all"""
+        img_shape = masks.path.shape
+        outer_paths = [
+            k for k in range(len(path_contours)) if path_hierarchy[0][k][3] == -1
+        ]
+
+        def find_path_shapes(k):
+            cnt = path_contours[k]
+            roi = Parser.get_roi(cv2.boundingRect(cnt), img_shape, LABEL_TOUCH_KERNEL)
+            x0, y0, x1, y1 = roi
+            x, y = cnt[0][0]
+
+            near = Parser.dilate(
+                tiled.isolate_component(masks.path, (x, y), roi), LABEL_TOUCH_KERNEL
+            )
+            touching = shape_labels[y0:y1, x0:x1][
+                (near > 0) & (masks.shape[y0:y1, x0:x1] == 255)
+            ]
+            return np.unique(touching[touching > 0]) - 1
+
+        connections = {}
+        for k, path_shapes in zip(outer_paths, self.map_jobs(find_path_shapes, outer_paths)):
+            for si in path_shapes:
+                if k not in connections.keys():
+                    connections[k] = [int(si)]
+                else:
+                    connections[k].append(int(si))
+                    connections[k] = list(set(connections[k]))
+
+        return connections
+
+    @staticmethod
+    def get_shape_labels(shapes, img_shape):
+        """An image where every shape without an outer is filled with its index + 1"""
+        labels = np.zeros(img_shape, np.int32)
+        for i, s in enumerate(shapes):
+            if s.outer is None:
+                cv2.drawContours(labels, [s.contour], -1, i + 1, -1)
+        return labels
+
+    @staticmethod
+    def get_connecting_points(path_cnt, shape_indices, shape_labels):
+        """Where each of the given shapes touches the path, or None if it doesn't"""
+        roi = Parser.get_roi(cv2.boundingRect(path_cnt), shape_labels.shape, 8)
+        x0, y0, x1, y1 = roi
+        dilated_path = Parser.dilate(Parser.mask_contour_roi(path_cnt, roi), kernel_size=10)
+        labels = shape_labels[y0:y1, x0:x1]
+
+        connecting_points = {}
+        for si in shape_indices:
+            shape_and_con = np.where(labels == si + 1, dilated_path, 0).astype(np.uint8)
+            s_and_c_contours, _ = cv2.findContours(
+                shape_and_con, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0)
+            )
+            if len(s_and_c_contours) > 0:
+                connecting_points[si] = Parser.contour_center(s_and_c_contours[0])
+            else:
+                connecting_points[si] = None
+
+        return connecting_points
+
+    def debug_connection_error(self, k, si, sj, path_contours, shapes, masks):
+        print(
+            "|whoops! a shape connection error has occured. report this on https://github.com/photon-niko/shapes/issues|"
+        )
+        dilated_path = Parser.dilate(
+            Parser.mask_contour(path_contours[k], masks.path),
+            kernel_size=10,
+        )
+        shape_and_con = cv2.bitwise_and(
+            Parser.mask_contour(shapes[si].contour, masks.shape),
+            dilated_path,
+        )
+        shape_and_con_to = cv2.bitwise_and(
+            Parser.mask_contour(shapes[sj].contour, masks.shape),
+            dilated_path,
+        )
+        everything = Parser.mask_contour(shapes[si].contour, masks.shape)
+        everything = cv2.bitwise_or(
+            everything,
+            Parser.mask_contour(shapes[sj].contour, masks.shape),
+        )
+        everything = cv2.bitwise_or(everything, dilated_path)
+        self.debug_save_image(shape_and_con, f"problem-{k}.png")
+        self.debug_save_image(shape_and_con_to, "problem2.png")
+        self.debug_save_image(dilated_path, "problem_path.png")
+        self.debug_save_image(everything, "problem_all.png")
+        self.debug_save_image(
+            Parser.mask_contour(shapes[si].contour, masks.shape),
+            "problem_shape.png",
+        )
+        self.debug_save_image(
+            Parser.mask_contour(shapes[sj].contour, masks.shape),
+            "problem_shape2.png",
+        )
+
     @staticmethod
     def contour_avg(cnt):
         M = cv2.moments(cnt)
@@ -410,143 +933,401 @@ class Parser:
         cy = int(cy / len(cnt))
         return (cx, cy)
 
-    def parse_shapes(self):
-        masks = self.get_masks()
+    def find_contours(self, mask):
+        if self.tile_size is not None:
+            return tiled.find_contours(mask, self.tile_size)
+        return cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+    def link_shapes(self, shapes, connections, all_connecting_points, on_missing_point):
+        """Connects every pair of shapes a path touches, through the points they touch it at"""
+        for k, connecting_points in zip(connections.keys(), all_connecting_points):
+            for i, si in enumerate(connections[k]):
+                for j, sj in enumerate(connections[k]):
+                    if si != sj:
+                        connecting_point = connecting_points[si]
+                        connecting_point_to = connecting_points[sj]
+                        if connecting_point is None or connecting_point_to is None:
+                            on_missing_point(k, si, sj)
+
+                        shapes[si].connect_shape(
+                            k, shapes[sj], connecting_point, connecting_point_to
+                        )
+                        if self.debug:
+                            cv2.circle(
+                                self.debug_out, connecting_point_to, 20, (0, 0, 255)
+                            )
+
+    @staticmethod
+    def get_clean_shift():
+        """How far clean_masks moves the shapes right and down. Opening and closing with
+        a 2x2 kernel isn't symmetric, at a coarse pyramid level that's coarse pixels"""
+        mask = np.zeros((64, 64), np.uint8)
+        mask[16:48, 16:48] = 255
+        shape_mask, _ = Parser.clean_masks(mask, np.zeros_like(mask))
+        x, y, _, _ = cv2.boundingRect(shape_mask)
+        return np.array([x - 16, y - 16])
+
+    @staticmethod
+    def get_descendants(hierarchy, i):
+        """Indices of every contour inside contour i, in the order findContours found them"""
+        parents = hierarchy[0][:, 3]
+        inside = {i}
+        for j in range(len(parents)):
+            # a contour's parent always comes before it
+            if parents[j] in inside:
+                inside.add(j)
+        return sorted(inside - {i})
+
+    @staticmethod
+    def get_path_labels_roi(path_contours, path_hierarchy, path_rects, roi):
+        """The index + 1 of the path every path pixel in roi is part of, the same
+        number get_connections_labeled gives it. Paths inside the holes of another
+        path are left at 0, it doesn't connect those either"""
+        x0, y0, x1, y1 = roi
+        labels = np.zeros((y1 - y0, x1 - x0), np.int32)
+        if path_hierarchy is None:
+            return labels
+        parents = path_hierarchy[0][:, 3]
+        depths = []
+        for k, parent in enumerate(parents):
+            # a contour's parent always comes before it, and everything inside it after
+            depths.append(0 if parent == -1 else depths[parent] + 1)
+            x, y, w, h = path_rects[k]
+            if x >= x1 or y >= y1 or x + w <= x0 or y + h <= y0:
+                continue
+            if depths[k] % 2 == 0:
+                label = k + 1 if depths[k] == 0 else 0
+                cv2.drawContours(labels, path_contours, k, label, -1, offset=(-x0, -y0))
+            else:
+                # a hole's contour runs along the pixels of the path around it
+                label = parent + 1 if depths[parent] == 0 else 0
+                cv2.drawContours(labels, path_contours, k, 0, -1, offset=(-x0, -y0))
+                cv2.drawContours(labels, path_contours, k, label, 1, offset=(-x0, -y0))
+        return labels
+
+    def refine_shape(self, roi, box, shape_mask, path_labels, tolerance):
+        """The shape that's at box (x0, y0, x1, y1) at the coarse level, looked at in full
+        resolution inside roi. Its contour followed by everything inside it, the parent
+        of each as an index into those (-1 for the shape itself), the shape filled in
+        and the paths touching it.
+
+        shape_mask and path_labels are the full resolution shape mask and
+        get_path_labels_roi, both of roi"""
+        x0, y0, _, _ = roi
+        contours, hierarchy = cv2.findContours(
+            shape_mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0)
+        )
+        where = f"the shape at {box[0]}, {box[1]}"
+        if len(contours) == 0:
+            raise PyramidFallback(f"{where} isn't there at full resolution")
+
+        outer = [i for i in range(len(contours)) if hierarchy[0][i][3] == -1]
+        corners = np.array(
+            [(x, y, x + w, y + h) for x, y, w, h in (cv2.boundingRect(contours[i]) for i in outer)]
+        )
+        matched = np.flatnonzero(np.abs(corners - box).max(axis=1) <= tolerance)
+        if len(matched) != 1:
+            raise PyramidFallback(f"{where} is {len(matched)} shapes at full resolution")
+
+        m = outer[matched[0]]
+        inside = Parser.get_descendants(hierarchy, m)
+        local = {j: n for n, j in enumerate(inside, 1)}
+        parents = [-1] + [local.get(hierarchy[0][j][3], 0) for j in inside]
+
+        fill = Parser.mask_contour_roi(contours[m], roi)
+        # paths close enough to touch the shape, the same way get_connections_labeled decides it
+        reach = Parser.dilate(cv2.bitwise_and(shape_mask, fill), LABEL_TOUCH_KERNEL) > 0
+        paths = [int(k) - 1 for k in np.unique(path_labels[reach]) if k > 0]
+
+        return [contours[m]] + [contours[j] for j in inside], parents, fill, paths
+
+    def parse_shapes_pyramid(self):
+        """parse_shapes with the shapes found on every 2^pyramid-th pixel. The masks are
+        made at full resolution, but each shape is only looked at inside its own box,
+        which is where its contours, holes, classification and the paths touching it
+        come from. The paths are numbered the way parse_shapes numbers them, and never
+        followed outside the boxes of the shapes they touch.
+
+        Nothing is classified from the coarse level alone: holes decide most opcodes and
+        small ones close up when the image shrinks, and HoughCircles doesn't find the
+        same circles at another size"""
+        scale = 2**self.pyramid
+        height = self.img.shape[0] // scale * scale
+        width = self.img.shape[1] // scale * scale
+        if height < scale * PYRAMID_MIN_SIZE or width < scale * PYRAMID_MIN_SIZE:
+            raise PyramidFallback(f"the image is too small for pyramid level {self.pyramid}")
+
+        with self.timings.stage("palette"):
+            colors = self.get_mask_colors()
+
+        coarse = copy.copy(self)
+        coarse.img = np.ascontiguousarray(self.img[:height:scale, :width:scale])
+        coarse.debug = False
+
+        with self.timings.stage("masks"):
+            coarse_masks = coarse.get_masks(colors)
+            masks = self.get_masks(colors)
 
         if self.debug:
             self.debug_save_image(masks.shape, "shape.png")
             self.debug_save_image(masks.path, "path.png")
             self.debug_save_image(masks.bg, "back.png")
 
-        shape_contours, shape_hierarchy = cv2.findContours(
-            masks.shape, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
-        )
+        with self.timings.stage("contours"):
+            coarse_shape_contours, coarse_shape_hierarchy = cv2.findContours(
+                coarse_masks.shape, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
+            )
+            full_outer, _ = cv2.findContours(masks.shape, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            path_contours, path_hierarchy = self.find_contours(masks.path)
 
-        path_contours, _ = cv2.findContours(
-            masks.path, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
-        )
+        if len(full_outer) < 1:
+            raise ParserError("No shapes found")
 
-        shapes = self.get_shapes(shape_contours, shape_hierarchy, masks.shape)
+        outer = [
+            i for i in range(len(coarse_shape_contours)) if coarse_shape_hierarchy[0][i][3] == -1
+        ]
+        rects = np.array([cv2.boundingRect(coarse_shape_contours[i]) for i in outer])
+        if len(outer) == 0 or rects[:, 2:].min() < PYRAMID_MIN_SHAPE_SIZE:
+            raise PyramidFallback(f"some shapes are too small for pyramid level {self.pyramid}")
+        # a shape too small to survive shrinking the image has no box to be looked at in.
+        # every box has to match a different shape below, so the same number of them means
+        # no shape is left out
+        if len(outer) != len(full_outer):
+            raise PyramidFallback(
+                f"{len(outer)} shapes at the coarse level, {len(full_outer)} at full resolution"
+            )
 
-        if len(shapes) < 1:
-            raise ParserError("No shapes found")
+        # clean_masks moves everything by the same number of pixels at either level
+        shift = Parser.get_clean_shift()
+        rects[:, 2:] += rects[:, :2]
+        boxes = ((rects.reshape(-1, 2) - shift) * scale + shift).reshape(-1, 4)
+        tolerance = 2 * scale + int(shift.max())
+        rois = [
+            Parser.get_roi((x0, y0, x1 - x0, y1 - y0), self.img.shape, PYRAMID_ROI_MARGIN + tolerance)
+            for x0, y0, x1, y1 in boxes
+        ]
+        path_rects = [cv2.boundingRect(cnt) for cnt in path_contours]
+
+        def refine(n):
+            x0, y0, x1, y1 = rois[n]
+            return self.refine_shape(
+                rois[n],
+                boxes[n],
+                masks.shape[y0:y1, x0:x1],
+                Parser.get_path_labels_roi(path_contours, path_hierarchy, path_rects, rois[n]),
+                tolerance,
+            )
 
-        connections = self.get_connections(
-            path_contours, self.get_no_hole_shapes(shapes), masks
-        )
+        with self.timings.stage("refine"):
+            refined = self.map_jobs(refine, list(range(len(outer))))
+
+        # findContours puts the outermost contours in reverse raster order of their
+        # topmost-leftmost pixel, two shapes close enough can come out swapped at the
+        # coarse level
+        def topmost(n):
+            return min((int(y), int(x)) for x, y in refined[n][0][0].reshape(-1, 2))
+
+        contours = []
+        parents = []
+        shape_indices = [0] * len(refined)
+        for n in sorted(range(len(refined)), key=topmost, reverse=True):
+            shape_contours, shape_parents, _, _ = refined[n]
+            shape_indices[n] = len(contours)
+            parents.extend(p if p == -1 else len(contours) + p for p in shape_parents)
+            contours.extend(shape_contours)
+        if len(set(cv2.boundingRect(contours[si]) for si in shape_indices)) != len(shape_indices):
+            raise PyramidFallback("two coarse shapes are the same one at full resolution")
+        hierarchy = np.full((1, len(contours), 4), -1, np.int32)
+        hierarchy[0][:, 3] = parents
+
+        with self.timings.stage("classify"):
+            shapes = self.get_shapes(contours, hierarchy, masks.shape)
+
+        with self.timings.stage("connections"):
+            # which shapes' boxes each path touches the shape in
+            touched = {}
+            for n, (_, _, _, paths) in enumerate(refined):
+                for k in paths:
+                    touched.setdefault(k, []).append(n)
+
+            # built up the same way get_connections_labeled does, the order ends up in the program
+            connections = {}
+            for k in sorted(touched.keys()):
+                for si in sorted(shape_indices[n] for n in touched[k]):
+                    if k not in connections.keys():
+                        connections[k] = [si]
+                    else:
+                        connections[k].append(si)
+                        connections[k] = list(set(connections[k]))
+
+        def get_connecting_points(k):
+            """get_connecting_points, with each shape only looking at the path inside its roi"""
+            connecting_points = {}
+            for n in touched[k]:
+                x0, y0, _, _ = rois[n]
+                fill = refined[n][2]
+                dilated_path = Parser.dilate(
+                    Parser.mask_contour_roi(path_contours[k], rois[n]), kernel_size=10
+                )
+                s_and_c_contours, _ = cv2.findContours(
+                    np.where(fill > 0, dilated_path, 0).astype(np.uint8),
+                    cv2.RETR_TREE,
+                    cv2.CHAIN_APPROX_SIMPLE,
+                    offset=(x0, y0),
+                )
+                connecting_points[shape_indices[n]] = (
+                    Parser.contour_center(s_and_c_contours[0]) if len(s_and_c_contours) > 0 else None
+                )
+            return connecting_points
+
+        with self.timings.stage("points"):
+            all_connecting_points = self.map_jobs(get_connecting_points, list(connections.keys()))
+
+        def on_missing_point(k, si, sj):
+            raise PyramidFallback(f"path {k} doesn't touch every shape it connects")
+
+        with self.timings.stage("link"):
+            self.link_shapes(shapes, connections, all_connecting_points, on_missing_point)
 
-        for k in connections.keys():
-            for i, si in enumerate(connections[k]):
-                for j, sj in enumerate(connections[k]):
-                    if si != sj:
-                        dilated_path = Parser.dilate(
-                            Parser.mask_contour(path_contours[k], masks.path),
-                            kernel_size=10,
-                        )
-                        shape_and_con = cv2.bitwise_and(
-                            Parser.mask_contour(shapes[si].contour, masks.shape),
-                            dilated_path,
-                        )
+            for s in shapes:
+                s.freeze()
 
-                        shape_and_con_to = cv2.bitwise_and(
-                            Parser.mask_contour(shapes[sj].contour, masks.shape),
-                            dilated_path,
-                        )
+        self.count_found(shapes, contours, path_contours, path_hierarchy, connections)
 
-                        s_and_c_contours, _ = cv2.findContours(
-                            shape_and_con, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
-                        )
+        if self.debug:
+            with self.timings.stage("debug"):
+                self.debug_draw_shapes(shapes, len(path_contours))
 
-                        s_and_c_t_contours, _ = cv2.findContours(
-                            shape_and_con_to, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
-                        )
+        return shapes
 
-                        try:
-                            connecting_point = Parser.contour_center(
-                                s_and_c_contours[0]
-                            )
-                            connecting_point_to = Parser.contour_center(
-                                s_and_c_t_contours[0]
-                            )
-                            shapes[si].connect_shape(
-                                k, shapes[sj], connecting_point, connecting_point_to
-                            )
-                            if self.debug:
-                                cv2.circle(
-                                    self.debug_out, connecting_point_to, 20, (0, 0, 255)
-                                )
-                        except Exception as e:
-                            print(
-                                "|whoops! a shape connection error has occured. report this on https://github.com/photon-niko/shapes/issues|"
-                            )
-                            print(e)
-                            everything = Parser.mask_contour(
-                                shapes[si].contour, masks.shape
-                            )
-                            everything = cv2.bitwise_or(
-                                everything,
-                                Parser.mask_contour(shapes[sj].contour, masks.shape),
-                            )
-                            everything = cv2.bitwise_or(everything, dilated_path)
-                            self.debug_save_image(shape_and_con, f"problem-{k}.png")
-                            self.debug_save_image(shape_and_con_to, "problem2.png")
-                            self.debug_save_image(dilated_path, "problem_path.png")
-                            self.debug_save_image(everything, "problem_all.png")
-                            self.debug_save_image(
-                                Parser.mask_contour(shapes[si].contour, masks.shape),
-                                "problem_shape.png",
-                            )
-                            self.debug_save_image(
-                                Parser.mask_contour(shapes[sj].contour, masks.shape),
-                                "problem_shape2.png",
-                            )
-                            exit()
+    def parse_shapes(self):
+        if self.pyramid > 0:
+            try:
+                return self.parse_shapes_pyramid()
+            except PyramidFallback as e:
+                self.pyramid_fallback = str(e)
+                if self.debug:
+                    print(f"|{e}, parsing at full resolution instead|")
+
+        with self.timings.stage("palette"):
+            colors = self.get_mask_colors()
+        with self.timings.stage("masks"):
+            masks = self.get_masks(colors)
 
         if self.debug:
+            self.debug_save_image(masks.shape, "shape.png")
+            self.debug_save_image(masks.path, "path.png")
+            self.debug_save_image(masks.bg, "back.png")
+
+        with self.timings.stage("contours"):
+            shape_contours, shape_hierarchy = self.find_contours(masks.shape)
+            path_contours, path_hierarchy = self.find_contours(masks.path)
+
+        with self.timings.stage("classify"):
+            shapes = self.get_shapes(shape_contours, shape_hierarchy, masks.shape)
+
+        if len(shapes) < 1:
+            raise ParserError("No shapes found")
+
+        with self.timings.stage("connections"):
+            if self.tile_size is None:
+                shape_labels = Parser.get_shape_labels(shapes, masks.shape.shape)
+            else:
+                shape_labels = tiled.ShapeLabels(shapes, masks.shape.shape)
+
+            if self.adjacency == "label" and self.tile_size is not None:
+                connections = self.get_connections_by_path(
+                    path_contours, path_hierarchy, shape_labels, masks
+                )
+            elif self.adjacency == "label":
+                connections = self.get_connections_labeled(
+                    path_contours, path_hierarchy, shape_labels, masks
+                )
+            else:
+                connections = self.get_connections(
+                    path_contours, self.get_no_hole_shapes(shapes), masks
+                )
+
+        with self.timings.stage("points"):
+            all_connecting_points = self.map_jobs(
+                lambda k: Parser.get_connecting_points(
+                    path_contours[k], connections[k], shape_labels
+                ),
+                list(connections.keys()),
+            )
+
+        def on_missing_point(k, si, sj):
+            self.debug_connection_error(k, si, sj, path_contours, shapes, masks)
+            exit()
+
+        with self.timings.stage("link"):
+            self.link_shapes(shapes, connections, all_connecting_points, on_missing_point)
+
             for s in shapes:
-                if s.circular:
-                    cv2.drawContours(
-                        self.debug_out, [s.contour], -1, (0, 255, 0), thickness=10
-                    )
-            self.debug_save_image(self.debug_out, "seen.png")
+                s.freeze()
 
-            for i, s in enumerate(shapes):
-                if s.outer is None:
-                    for p in s.points:
-                        cv2.circle(self.debug_out, p[0], 5, (255, 0, 0), -1)
+        self.count_found(shapes, shape_contours, path_contours, path_hierarchy, connections)
 
-                    self.debug_save_image(self.debug_out, "seen.png")
-                    cv2.putText(
+        if self.debug:
+            with self.timings.stage("debug"):
+                self.debug_draw_shapes(shapes, len(path_contours))
+
+        return shapes
+
+    def count_found(self, shapes, shape_contours, path_contours, path_hierarchy, connections):
+        """What the parse found, for the timings"""
+        self.timings.count("pixels", self.img.shape[0] * self.img.shape[1])
+        self.timings.count("contours", len(shape_contours) + len(path_contours))
+        self.timings.count("shapes", sum(s.outer is None for s in shapes))
+        self.timings.count("holes", sum(s.outer is not None for s in shapes))
+        self.timings.count(
+            "paths", 0 if path_hierarchy is None else int(np.sum(path_hierarchy[0][:, 3] == -1))
+        )
+        self.timings.count("connections", len(connections))
+
+    def debug_draw_shapes(self, shapes, path_count):
+        for s in shapes:
+            if s.circular:
+                cv2.drawContours(
+                    self.debug_out, [s.contour], -1, (0, 255, 0), thickness=10
+                )
+        self.debug_save_image(self.debug_out, "seen.png")
+
+        for i, s in enumerate(shapes):
+            if s.outer is None:
+                for p in s.points:
+                    cv2.circle(self.debug_out, p[0], 5, (255, 0, 0), -1)
+
+                self.debug_save_image(self.debug_out, "seen.png")
+                cv2.putText(
+                    self.debug_out,
+                    f"{s.get_shape_type().name}{[len(h.points) for h in s.get_holes()]}",
+                    Parser.contour_avg(s.contour),
+                    cv2.FONT_HERSHEY_PLAIN,
+                    2,
+                    (128, 128, 128),
+                    2,
+                )
+            else:
+                cv2.drawContours(self.debug_out, [s.points], -1, (255,255,255), thickness=1)
+                for p in s.points:
+                    cv2.circle(self.debug_out, p[0], 2, (0, 0, 255), -1)
+
+                self.debug_save_image(self.debug_out, "seen.png")
+
+            for k in s.connecteds.keys():
+                for i, c in enumerate(s.connecteds[k][1]):
+                    thickness = 20 // (i + 1)
+                    cv2.line(
                         self.debug_out,
-                        f"{s.get_shape_type().name}{[len(h.points) for h in s.get_holes()]}",
-                        Parser.contour_avg(s.contour),
-                        cv2.FONT_HERSHEY_PLAIN,
-                        2,
-                        (128, 128, 128),
-                        2,
+                        s.connecteds[k][0],
+                        c[1],
+                        (
+                            100 + np.random.random() * 100,
+                            (255 / path_count) * k,
+                            0,
+                        ),
+                        thickness,
                     )
-                else:
-                    cv2.drawContours(self.debug_out, [s.points], -1, (255,255,255), thickness=1)
-                    for p in s.points:
-                        cv2.circle(self.debug_out, p[0], 2, (0, 0, 255), -1)
-
-                    self.debug_save_image(self.debug_out, "seen.png")
-
-                for k in s.connecteds.keys():
-                    for i, c in enumerate(s.connecteds[k][1]):
-                        thickness = 20 // (i + 1)
-                        cv2.line(
-                            self.debug_out,
-                            s.connecteds[k][0],
-                            c[1],
-                            (
-                                100 + np.random.random() * 100,
-                                (255 / len(path_contours)) * k,
-                                0,
-                            ),
-                            thickness,
-                        )
-
-            self.debug_save_image(self.debug_out, "seen.png")
 
-        return shapes
+        self.debug_save_image(self.debug_out, "seen.png")
@@ -0,0 +1,124 @@
+from typing import List
+
+from shapes.shape import Shape, ShapeEnum
+from shapes.utils import distance
+
+
+# shapes whose value can change while the program runs
+DYNAMIC_VALUE_TYPES = (ShapeEnum.CONTAINER, ShapeEnum.STACK)
+
+
+class Program:
+    """A parsed shapes program lowered into flat arrays.
+
+    The instruction pointer is an edge: the shape it points at together with the
+    point and path it arrived through, which is everything the interpreter needs
+    to know to pick the next shape. Edge 0 is the entry into the start shape.
+    """
+
+    def __init__(self, shapes: List[Shape]):
+        self.shapes = shapes
+
+        # per shape, indexed like `shapes`
+        self.ops = []
+        self.operands = []
+        self.centers = []
+
+        # per edge
+        self.edge_shape = []
+        self.edge_k = []
+        self.edge_point = []
+        self.next_edge = []
+
+        # per CONTROL shape index: candidates sorted by distance from its center
+        self.controls = {}
+
+
+def _edge_key(shape_index, point, k):
+    return (shape_index, None if point is None else tuple(point), k)
+
+
+def lower(shapes: List[Shape], start: Shape) -> Program:
+    program = Program(shapes)
+    index = {id(s): i for i, s in enumerate(shapes)}
+
+    for s in shapes:
+        shape_type = s.get_shape_type()
+        program.ops.append(shape_type.value)
+        program.centers.append(s.center)
+        if shape_type in (ShapeEnum.NUMBER, ShapeEnum.OPER):
+            program.operands.append(s.get_hole_count())
+        else:
+            program.operands.append(None)
+
+    edges = {}
+    pending = []
+
+    def get_edge(shape, point, k):
+        key = _edge_key(index[id(shape)], point, k)
+        if key not in edges:
+            edges[key] = len(program.edge_shape)
+            program.edge_shape.append(key[0])
+            program.edge_point.append(key[1])
+            program.edge_k.append(k)
+            program.next_edge.append(-1)
+            pending.append(edges[key])
+        return edges[key]
+
+    get_edge(start, None, None)
+
+    while len(pending) > 0:
+        e = pending.pop()
+        shape = shapes[program.edge_shape[e]]
+        shape_type = shape.get_shape_type()
+
+        if shape_type == ShapeEnum.START:
+            k = list(shape.connecteds.keys())[0]
+            next_shape, to_point = shape.connecteds[k][1][0]
+            program.next_edge[e] = get_edge(next_shape, to_point, k)
+
+        elif shape_type == ShapeEnum.CONTROL:
+            s = program.edge_shape[e]
+            if s not in program.controls:
+                candidates = []
+                for c in shape.get_all_connections():
+                    candidates.append(
+                        (distance(shape.center, c[1]), get_edge(c[0], c[1], c[2]), c[2])
+                    )
+                # stable, so ties keep the order the interpreter would see them in
+                candidates.sort(key=lambda c: c[0])
+                program.controls[s] = _lower_control(program, shapes, candidates)
+
+        elif shape_type != ShapeEnum.END:
+            next_s = shape.get_default_next(program.edge_point[e])
+            if next_s is not None:
+                program.next_edge[e] = get_edge(next_s[0], next_s[1], next_s[2])
+
+    return program
+
+
+def _lower_control(program: Program, shapes: List[Shape], candidates):
+    """Split the candidates of a CONTROL shape into a table keyed by the values
+    that can't change at runtime and a list of the ones that can"""
+    static = {}
+    none = []
+    dynamic = []
+    ordered = []
+
+    for _, e, k in candidates:
+        target = shapes[program.edge_shape[e]]
+        target_type = target.get_shape_type()
+        if target_type in DYNAMIC_VALUE_TYPES:
+            dynamic.append(e)
+            ordered.append((e, k, target_type, program.edge_shape[e]))
+        else:
+            value = target.get_value()
+            ordered.append((e, k, None, value))
+            if value is None:
+                none.append((e, k))
+            else:
+                static.setdefault(value, []).append((e, k))
+
+    if len(dynamic) > 0:
+        return (None, None, ordered)
+    return (static, none, None)
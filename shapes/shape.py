@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 
 from enum import Enum, auto
@@ -41,6 +40,10 @@ class ShapeEnum(Enum):
     OUT_NO_LF = auto()
 
 
+class ShapeError(Exception):
+    pass
+
+
 class Shape:
     type_map = {
         ((1, True), ((3, True),)): ShapeEnum.START,
@@ -77,6 +80,7 @@ class Shape:
     # [[shape sides, is_convex], [hole shapes]]
 
     def __init__(self, contour: np.ndarray, circular: bool, center):
+        self.frozen = False
         self.center = center
         self.contour = contour
         self.circular = circular
@@ -87,6 +91,72 @@ class Shape:
         self.outer = None
         self.value = None
 
+    def check_not_frozen(self):
+        if self.frozen:
+            raise ShapeError("Can't change the geometry of a frozen shape, thaw it first")
+
+    @property
+    def contour(self):
+        return self._contour
+
+    @contour.setter
+    def contour(self, contour):
+        self.check_not_frozen()
+        self._contour = contour
+
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        self.check_not_frozen()
+        self._points = points
+
+    @property
+    def circular(self):
+        return self._circular
+
+    @circular.setter
+    def circular(self, circular):
+        self.check_not_frozen()
+        self._circular = circular
+
+    @property
+    def outer(self):
+        return self._outer
+
+    @outer.setter
+    def outer(self, outer):
+        self.check_not_frozen()
+        self._outer = outer
+
+    def freeze(self, shape_type=None):
+        """Works out everything that only depends on geometry once, so the
+        getters don't have to. The shape's geometry can't change until it's thawed.
+
+        shape_type can be given when it's already known, e.g. from the cache"""
+        self.thaw()
+        self._holes = self.find_holes()
+        self._depth = self.get_hops_to_root()
+        self._shape_type = shape_type if shape_type is not None else self.classify()
+        self._static_value = (
+            len(self._holes) if self._shape_type == ShapeEnum.NUMBER else None
+        )
+        # the setters only stop reassignment, this stops writing into the arrays too
+        for array in (self._contour, self._points):
+            if isinstance(array, np.ndarray):
+                array.setflags(write=False)
+        self.frozen = True
+
+    def thaw(self):
+        self.frozen = False
+        # arrays made read-only by freeze, other things may still be holding them
+        if isinstance(self._contour, np.ndarray) and not self._contour.flags.writeable:
+            self._contour = self._contour.copy()
+        if isinstance(self._points, np.ndarray) and not self._points.flags.writeable:
+            self._points = self._points.copy()
+
     def get_all_connections(self):
         allc = []
         for k in self.connecteds.keys():
@@ -122,6 +192,8 @@ class Shape:
         shape_type = self.get_shape_type()
 
         if shape_type == ShapeEnum.NUMBER:
+            if self.frozen:
+                return self._static_value
             return len(self.get_holes())
         elif shape_type == ShapeEnum.STACK and self.value is not None:
             return self.value[-1]
@@ -129,6 +201,14 @@ class Shape:
         return self.value
 
     def get_shape_type(self):
+        if self.frozen:
+            return self._shape_type
+        return self.classify()
+
+    def classify(self):
+        # only parsing classifies, shapes loaded from the cache come frozen and never need cv2
+        import cv2
+
         this_points = len(self.points)
         if self.circular:
             this_points = 1
@@ -170,9 +250,13 @@ class Shape:
             ]
 
     def add_inside(self, shape):
+        self.check_not_frozen()
         self.insides.append(shape)
 
     def get_hops_to_root(self):
+        if self.frozen:
+            return self._depth
+
         total = 0
 
         def _get_hops_to_root(shape):
@@ -210,6 +294,16 @@ class Shape:
         return children
 
     def get_holes(self):
+        if self.frozen:
+            return self._holes
+        return self.find_holes()
+
+    def get_hole_count(self):
+        if self.frozen:
+            return len(self._holes)
+        return len(self.find_holes())
+
+    def find_holes(self):
         holes = []
         for c in self.get_all_children():
             distance_to_root = c.get_hops_to_root()
@@ -0,0 +1,81 @@
+"""Where the OUT and OUT_NO_LF shapes of a running program write to. Output gets
+buffered, and written on to the stream as the flush policy says:
+
+line: at the end of every line, like a terminal does
+size: once buffer_size characters have piled up
+exit: only when the program stops, or waits for input
+
+Whatever the policy, everything gets written before an IN shape asks for input"""
+import sys
+
+FLUSH_POLICIES = ("line", "size", "exit")
+# in characters
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+
+class SinkError(Exception):
+    pass
+
+
+def default_policy(stream=None):
+    """line on a terminal, size anywhere else, like python's own stdout"""
+    stream = stream or sys.stdout
+    isatty = getattr(stream, "isatty", None)
+    return "line" if isatty is not None and isatty() else "size"
+
+
+class StreamSink:
+    """Writes to a text stream, sys.stdout by default. That's looked up on every
+    flush, so redirecting stdout while the program runs still works"""
+
+    def __init__(self, stream=None, policy=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        if policy is None:
+            policy = default_policy(stream)
+        if policy not in FLUSH_POLICIES:
+            raise SinkError(f"Unknown flush policy {policy}")
+        if buffer_size < 1:
+            raise SinkError("The buffer has to hold at least one character")
+        self.stream = stream
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+        # picked once here, write gets called for every OUT
+        self.write = {
+            "line": self.write_line,
+            "size": self.write_size,
+            "exit": self.parts.append,
+        }[policy]
+
+    def write_line(self, text):
+        self.parts.append(text)
+        if "\n" in text:
+            self.flush()
+
+    def write_size(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+        if len(self.parts) > 0:
+            stream.write("".join(self.parts))
+            self.parts.clear()
+            self.size = 0
+        stream.flush()
+
+
+class MemorySink:
+    """Keeps everything the program wrote, for running programs from python"""
+
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
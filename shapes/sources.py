@@ -0,0 +1,108 @@
+"""Where the IN shapes of a running program read from. Every read gives the next
+line as an int if it is one, else a float if it is one, else the text itself.
+Running out of input raises EOFError, like input() does.
+
+InteractiveSource asks for every line with a prompt, the others read whole
+chunks ahead and never prompt: StreamSource for files and pipes, IteratorSource
+for values handed over from python"""
+import codecs
+import sys
+
+PROMPT = "<<< "
+# in bytes, or characters for streams without a binary buffer
+CHUNK_SIZE = 1 << 16
+
+
+def parse_value(text):
+    # almost everything a program reads is a plain number
+    if text.isascii() and text.isdigit():
+        return int(text)
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+class InteractiveSource:
+    """A person typing at a terminal. Whatever the program wrote so far gets
+    flushed, and PROMPT shown, before every line"""
+
+    interactive = True
+
+    def read(self):
+        return parse_value(input())
+
+
+class StreamSource:
+    """Lines of a text stream, read ahead a chunk at a time. On a pipe that's only
+    as much as is there already, so a line gets through as soon as it's written"""
+
+    interactive = False
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.lines = []
+        self.partial = ""
+        self.eof = False
+
+        buffer = getattr(stream, "buffer", None)
+        if buffer is not None and hasattr(buffer, "read1") and not stream.seekable():
+            # read() on a pipe would wait for a whole chunk, read1 doesn't. files
+            # are read as text, so their line endings get translated like before
+            decoder = codecs.getincrementaldecoder(stream.encoding)(stream.errors)
+
+            def read_chunk():
+                data = buffer.read1(chunk_size)
+                return decoder.decode(data, final=len(data) == 0)
+
+            self.read_chunk = read_chunk
+        else:
+            self.read_chunk = lambda: stream.read(chunk_size)
+
+    def readline(self):
+        while len(self.lines) == 0:
+            if self.eof:
+                if len(self.partial) > 0:
+                    line, self.partial = self.partial, ""
+                    return line
+                raise EOFError("EOF when reading a line")
+
+            chunk = self.read_chunk()
+            if len(chunk) == 0:
+                self.eof = True
+                continue
+            lines = (self.partial + chunk).split("\n")
+            self.partial = lines.pop()
+            # popped off the end one at a time
+            lines.reverse()
+            self.lines = lines
+        return self.lines.pop()
+
+    def read(self):
+        return parse_value(self.readline())
+
+
+class IteratorSource:
+    """Values from any iterable. Text gets parsed like a line would, anything
+    else is pushed as it is"""
+
+    interactive = False
+
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def read(self):
+        try:
+            value = next(self.values)
+        except StopIteration:
+            raise EOFError("EOF when reading a line")
+        return parse_value(value) if isinstance(value, str) else value
+
+
+def default_source():
+    """Prompts on a terminal, reads ahead from stdin anywhere else"""
+    if sys.stdin.isatty():
+        return InteractiveSource()
+    return StreamSource(sys.stdin)
@@ -0,0 +1,327 @@
+"""Tile by tile versions of the whole image steps of Parser, so that a parse
+never needs more than a few full size copies of the image at once"""
+import cv2
+import numpy as np
+
+# the morphology in Parser.clean_masks reaches 8 pixels at most, so with this much
+# overlap every tile comes out exactly like the same area of one big pass
+TILE_OVERLAP = 16
+# the image and the five masks a tiled get_masks keeps around, in bytes per pixel
+FULL_SIZE_BYTES = 8
+# the color lookup table of palette.ranges_lut, whatever the size of the image
+LUT_BYTES = 1 << 24
+# temporaries of a single tile, in bytes per pixel
+TILE_BYTES = 40
+MIN_TILE_SIZE = 64
+
+
+class TileError(Exception):
+    pass
+
+
+def get_tile_size(budget, img_shape):
+    """The biggest square tile whose temporaries fit in what's left of the budget
+    (in bytes) after the full size arrays"""
+    height, width = img_shape[:2]
+    left = budget - FULL_SIZE_BYTES * height * width - LUT_BYTES
+    padded = int(np.sqrt(max(left, 0) / TILE_BYTES))
+    tile_size = padded - 2 * TILE_OVERLAP
+
+    if tile_size < MIN_TILE_SIZE:
+        needed = (
+            FULL_SIZE_BYTES * height * width
+            + LUT_BYTES
+            + TILE_BYTES * (MIN_TILE_SIZE + 2 * TILE_OVERLAP) ** 2
+        )
+        raise TileError(
+            f"A {width}x{height} image needs a memory budget of at least {needed / 2**20:.0f}MB"
+        )
+
+    return min(tile_size, max(height, width))
+
+
+def get_tiles(img_shape, tile_size, overlap=0):
+    """(core, padded) rects (x0, y0, x1, y1) covering the image in raster order.
+    The padded rect is the core grown by overlap, clipped to the image"""
+    height, width = img_shape[:2]
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            core = (x, y, min(x + tile_size, width), min(y + tile_size, height))
+            padded = (
+                max(core[0] - overlap, 0),
+                max(core[1] - overlap, 0),
+                min(core[2] + overlap, width),
+                min(core[3] + overlap, height),
+            )
+            yield core, padded
+
+
+def crop_core(tile, core, padded):
+    """The part of a padded tile that belongs to its core"""
+    x0, y0 = core[0] - padded[0], core[1] - padded[1]
+    return tile[y0 : y0 + core[3] - core[1], x0 : x0 + core[2] - core[0]]
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = []
+
+    def add(self):
+        self.parent.append(len(self.parent))
+        return len(self.parent) - 1
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def merge_seam(union_find, a, b):
+    """Joins the components on both sides of a seam. a and b are the labels + 1
+    of the pixels right next to it, 0 for background. Pixels touch diagonally too"""
+    pairs = []
+    for shift in (-1, 0, 1):
+        if shift < 0:
+            a_side, b_side = a[-shift:], b[:shift]
+        elif shift > 0:
+            a_side, b_side = a[:-shift], b[shift:]
+        else:
+            a_side, b_side = a, b
+        both = (a_side > 0) & (b_side > 0)
+        pairs.append(np.stack([a_side[both], b_side[both]]))
+
+    for a_label, b_label in np.unique(np.concatenate(pairs, axis=1), axis=1).T:
+        union_find.union(int(a_label) - 1, int(b_label) - 1)
+
+
+def find_components(mask, tile_size):
+    """8 connected components of a binary mask as ((x, y), (x0, y0, x1, y1)): the
+    first pixel of the component in raster order and its bounding rect.
+    Labels one tile at a time and joins the labels that meet at the seams"""
+    height, width = mask.shape
+    union_find = UnionFind()
+    starts = []
+    rects = []
+
+    above = np.zeros(width, np.int64)
+    for core, _ in get_tiles(mask.shape, tile_size):
+        x0, y0, x1, y1 = core
+        if x0 == 0:
+            below = np.zeros(width, np.int64)
+            left = None
+
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(
+            mask[y0:y1, x0:x1], connectivity=8
+        )
+        to_global = np.zeros(count, np.int64)
+        for label in range(1, count):
+            to_global[label] = union_find.add() + 1
+            x, y, w, h = stats[label][:4]
+            first_x = x + int(np.argmax(labels[y, x : x + w] == label))
+            starts.append((y + y0, first_x + x0))
+            rects.append([x + x0, y + y0, x + x0 + w, y + y0 + h])
+
+        if left is not None:
+            merge_seam(union_find, left, to_global[labels[:, 0]])
+        if y0 > 0:
+            # the row above spans every tile of the previous row, so the diagonal
+            # neighbours of the corner pixels in the tiles next to this one count too
+            row = to_global[labels[0]]
+            above_x0 = max(x0 - 1, 0)
+            above_row = above[above_x0 : min(x1 + 1, width)]
+            padded_row = np.zeros(len(above_row), np.int64)
+            padded_row[x0 - above_x0 : x0 - above_x0 + len(row)] = row
+            merge_seam(union_find, above_row, padded_row)
+
+        below[x0:x1] = to_global[labels[-1]]
+        left = to_global[labels[:, -1]]
+        if x1 == width:
+            above = below
+
+    merged = {}
+    for i in range(len(starts)):
+        root = union_find.find(i)
+        if root not in merged:
+            merged[root] = [starts[i], list(rects[i])]
+        else:
+            start, rect = merged[root]
+            merged[root][0] = min(start, starts[i])
+            rect[0] = min(rect[0], rects[i][0])
+            rect[1] = min(rect[1], rects[i][1])
+            rect[2] = max(rect[2], rects[i][2])
+            rect[3] = max(rect[3], rects[i][3])
+
+    return [((x, y), tuple(rect)) for (y, x), rect in sorted(merged.values())]
+
+
+def isolate_component(mask, start, rect):
+    """The bounding rect of a component, with only that component in it"""
+    x0, y0, x1, y1 = rect
+    crop = np.ascontiguousarray(mask[y0:y1, x0:x1])
+    flooded = np.zeros((y1 - y0 + 2, x1 - x0 + 2), np.uint8)
+    cv2.floodFill(
+        crop,
+        flooded,
+        (start[0] - x0, start[1] - y0),
+        255,
+        0,
+        0,
+        8 | cv2.FLOODFILL_MASK_ONLY | (255 << 8),
+    )
+    return flooded[1:-1, 1:-1]
+
+
+def get_hole_key(hole, component, rect):
+    """Where findContours notices a hole: the pixel left of the first pixel inside it"""
+    x, y, w, h = cv2.boundingRect(hole)
+    inside = np.zeros((h, w), np.uint8)
+    cv2.drawContours(inside, [hole], -1, 255, cv2.FILLED, offset=(-x, -y))
+    inside[component[y - rect[1] : y - rect[1] + h, x - rect[0] : x - rect[0] + w] > 0] = 0
+    first = int(np.argmax(inside.ravel() > 0))
+    return (y + first // w, x + first % w - 1)
+
+
+def find_contours(mask, tile_size):
+    """The same contours and parents cv2.findContours(mask, cv2.RETR_TREE,
+    cv2.CHAIN_APPROX_SIMPLE) finds, in the same order, without ever labelling
+    the whole mask at once.
+
+    Every component is traced on its own. findContours returns its tree depth
+    first, with the children of a contour in the reverse order it noticed them in,
+    so that's rebuilt from where each one starts. Only the parent column of the
+    hierarchy is guaranteed to match, the sibling links are rebuilt from it"""
+    contours = []
+    keys = []
+    parents = []
+    holes = []
+
+    for start, rect in find_components(mask, tile_size):
+        component = isolate_component(mask, start, rect)
+        traced, traced_hierarchy = cv2.findContours(
+            component, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=rect[:2]
+        )
+
+        outer = len(contours)
+        contours.append(None)
+        keys.append((start[1], start[0]))
+        parents.append(None)
+
+        for cnt, (_, _, _, parent) in zip(traced, traced_hierarchy[0]):
+            if parent == -1:
+                contours[outer] = cnt
+            else:
+                holes.append(len(contours))
+                contours.append(cnt)
+                keys.append(get_hole_key(cnt, component, rect))
+                parents.append(outer)
+
+    # the parent of a component is the smallest hole around its first pixel
+    hole_rects = np.array([cv2.boundingRect(contours[h]) for h in holes]).reshape(-1, 4)
+    hole_areas = np.array([cv2.contourArea(contours[h]) for h in holes])
+    for i, parent in enumerate(parents):
+        if parent is not None:
+            continue
+        parents[i] = -1
+        y, x = keys[i]
+        around = (
+            (hole_rects[:, 0] < x)
+            & (hole_rects[:, 1] < y)
+            & (hole_rects[:, 0] + hole_rects[:, 2] > x)
+            & (hole_rects[:, 1] + hole_rects[:, 3] > y)
+        )
+        for h in np.flatnonzero(around)[np.argsort(hole_areas[around], kind="stable")]:
+            if cv2.pointPolygonTest(contours[holes[h]], (int(x), int(y)), False) > 0:
+                parents[i] = holes[h]
+                break
+
+    children = {}
+    for i, parent in enumerate(parents):
+        children.setdefault(parent, []).append(i)
+
+    order = []
+    pending = sorted(children.get(-1, []), key=lambda i: keys[i])
+    while len(pending) > 0:
+        i = pending.pop()
+        order.append(i)
+        pending.extend(sorted(children.get(i, []), key=lambda c: keys[c]))
+
+    if len(order) == 0:
+        return (), None
+
+    position = {i: p for p, i in enumerate(order)}
+    hierarchy = np.full((1, len(order), 4), -1, np.int32)
+    for parent, siblings in children.items():
+        siblings = sorted(siblings, key=lambda i: position[i])
+        for a, b in zip(siblings, siblings[1:]):
+            hierarchy[0][position[a]][0] = position[b]
+            hierarchy[0][position[b]][1] = position[a]
+        if parent != -1:
+            hierarchy[0][position[parent]][2] = position[siblings[0]]
+            for i in siblings:
+                hierarchy[0][position[i]][3] = position[parent]
+
+    return tuple(contours[i] for i in order), hierarchy
+
+
+def clear_edge_components(mask, tile_size):
+    """Parser.clean_contours_touching_edges, in place and one component at a time"""
+    height, width = mask.shape
+
+    for start, rect in find_components(mask, tile_size):
+        x0, y0, x1, y1 = rect
+        # only contours of components this close to an edge can pass the check below
+        if not (x0 == 0 or y0 == 0 or x1 >= height or y1 >= width):
+            continue
+        # already filled in by a component around it
+        if mask[start[1], start[0]] == 0:
+            continue
+
+        component = isolate_component(mask, start, rect)
+        traced, _ = cv2.findContours(
+            component, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=rect[:2]
+        )
+        for c in traced:
+            x, y, w, h = cv2.boundingRect(c)
+            # same comparisons as clean_contours_touching_edges, widths against heights included
+            if x == 0 or y == 0 or x + w == height or y + h == width:
+                cv2.drawContours(mask, [c], -1, 0, cv2.FILLED)
+
+    return mask
+
+
+class ShapeLabels:
+    """Parser.get_shape_labels, drawn only for the part that gets sliced out of it.
+    labels[y0:y1, x0:x1] gives the same array as the full size version would"""
+
+    def __init__(self, shapes, img_shape):
+        self.shape = img_shape
+        self.indices = [i for i, s in enumerate(shapes) if s.outer is None]
+        self.contours = [shapes[i].contour for i in self.indices]
+        self.rects = np.array([cv2.boundingRect(c) for c in self.contours]).reshape(-1, 4)
+
+    def __getitem__(self, key):
+        rows, cols = key
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = cols.indices(self.shape[1])
+
+        labels = np.zeros((y1 - y0, x1 - x0), np.int32)
+        rects = self.rects
+        overlapping = np.flatnonzero(
+            (rects[:, 0] < x1)
+            & (rects[:, 1] < y1)
+            & (rects[:, 0] + rects[:, 2] > x0)
+            & (rects[:, 1] + rects[:, 3] > y0)
+        )
+        for o in overlapping:
+            cv2.drawContours(
+                labels, [self.contours[o]], -1, self.indices[o] + 1, -1, offset=(-x0, -y0)
+            )
+        return labels
@@ -0,0 +1,76 @@
+"""Where a parse spends its time and memory, stage by stage"""
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Timings:
+    """Wall time of every stage, and what got counted along the way. A stage that
+    runs more than once, like the masks of a pyramid parse, adds up.
+
+    Memory is only ever measured while tracemalloc is tracing, it slows down
+    everything that allocates from python. Blocks are the python objects a stage
+    left behind, and are always counted. Stages can't be nested"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        # highest traced memory seen before a stage reset it, in bytes
+        self.traced_peak = 0
+
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            self.traced_peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            traced_start = tracemalloc.get_traced_memory()[0]
+        blocks_start = sys.getallocatedblocks()
+        begin = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - begin
+            blocks = sys.getallocatedblocks() - blocks_start
+
+            stage = self.stages.setdefault(
+                name, {"time": 0.0, "calls": 0, "blocks": 0, "allocated": None, "peak": None}
+            )
+            stage["time"] += elapsed
+            stage["calls"] += 1
+            stage["blocks"] += blocks
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                self.traced_peak = max(self.traced_peak, peak)
+                stage["allocated"] = (stage["allocated"] or 0) + current - traced_start
+                stage["peak"] = max(stage["peak"] or 0, peak - traced_start)
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+    def total(self):
+        return sum(s["time"] for s in self.stages.values())
+
+    def as_dict(self):
+        return {
+            "total": self.total(),
+            "stages": {name: dict(s) for name, s in self.stages.items()},
+            "counts": dict(self.counts),
+        }
+
+    def format(self):
+        """One |line| per stage, in the order they first ran, then the counts"""
+        width = max([len(name) for name in self.stages] + [5])
+        lines = []
+        for name, s in self.stages.items():
+            line = f"|{name:<{width}} {s['time']:8.4f}s {s['blocks']:+9d} blocks"
+            if s["allocated"] is not None:
+                line += f" {s['allocated'] / 2**20:+9.2f}MB {s['peak'] / 2**20:8.2f}MB peak"
+            if s["calls"] > 1:
+                line += f" ({s['calls']} times)"
+            lines.append(line + "|")
+        lines.append(f"|{'total':<{width}} {self.total():8.4f}s|")
+        if len(self.counts) > 0:
+            lines.append("|" + ", ".join(f"{k}: {v}" for k, v in self.counts.items()) + "|")
+        return "\n".join(lines)
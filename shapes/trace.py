@@ -0,0 +1,215 @@
+"""A compact record of every step a program took, as the Engine reached each shape:
+the step number, the shape (its index in the parsed shapes), its opcode (a
+ShapeEnum value), how deep the stack was and what was on top of it.
+
+A trace file is HEADER followed by RECORD_SIZE byte records. The top of the stack
+is kept as a kind and 8 bytes: ints and floats as they are, the length of strings,
+nothing for an empty stack, ints too big for 8 bytes or anything else"""
+import struct
+from array import array
+from collections import deque
+from itertools import chain, compress, repeat
+
+import numpy as np
+
+from shapes.shape import ShapeEnum
+
+MAGIC = b"SHTR"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+
+TOP_NONE = 0
+TOP_INT = 1
+TOP_FLOAT = 2
+TOP_STR = 3
+TOP_BIG_INT = 4
+TOP_OTHER = 5
+
+RECORD_SIZE = 28
+RECORD_DTYPE = np.dtype(
+    {
+        "names": ["step", "shape", "depth", "op", "kind", "top"],
+        "formats": ["<u8", "<u4", "<u4", "u1", "u1", "<i8"],
+        "offsets": [0, 8, 12, 16, 17, 20],
+        "itemsize": RECORD_SIZE,
+    }
+)
+TOP_KIND_OF = {type(None): TOP_NONE, int: TOP_INT, bool: TOP_INT, float: TOP_FLOAT, str: TOP_STR}
+
+# values the Engine hands over per step
+FIELDS = 5
+# records a file trace keeps before writing them out
+DRAIN_RECORDS = 1 << 14
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+
+class TraceError(Exception):
+    pass
+
+
+def encode_records(fields):
+    """The bytes of records laid out one after the other as step, shape, op,
+    depth, top, ..., a column at a time"""
+    count = len(fields) // FIELDS
+    if count == 0:
+        return b""
+    tops = fields[4::FIELDS]
+    # array converts lists of python ints a lot faster than numpy does
+    encoded = np.zeros(count, RECORD_DTYPE)
+    encoded["step"] = np.frombuffer(array("Q", fields[0::FIELDS]), np.uint64)
+    encoded["shape"] = np.frombuffer(array("I", fields[1::FIELDS]), np.uint32)
+    encoded["op"] = np.frombuffer(array("I", fields[2::FIELDS]), np.uint32)
+    encoded["depth"] = np.frombuffer(array("I", fields[3::FIELDS]), np.uint32)
+    kinds = np.frombuffer(
+        array("I", list(map(TOP_KIND_OF.get, map(type, tops), repeat(TOP_OTHER)))), np.uint32
+    ).astype(np.uint8)
+    payload = np.zeros(count, "<i8")
+
+    is_int = kinds == TOP_INT
+    try:
+        payload[is_int] = np.frombuffer(array("q", list(compress(tops, is_int.tolist()))), np.int64)
+    except OverflowError:
+        # ints too big for 8 bytes are rare enough to look for one by one
+        for i in np.flatnonzero(is_int):
+            if INT64_MIN <= tops[i] <= INT64_MAX:
+                payload[i] = tops[i]
+            else:
+                kinds[i] = TOP_BIG_INT
+    is_float = kinds == TOP_FLOAT
+    payload[is_float] = np.frombuffer(array("d", list(compress(tops, is_float.tolist()))), np.int64)
+    is_str = kinds == TOP_STR
+    payload[is_str] = np.frombuffer(array("q", list(map(len, compress(tops, is_str.tolist())))), np.int64)
+
+    encoded["kind"] = kinds
+    encoded["top"] = payload
+    return encoded.tobytes()
+
+
+class TraceRecorder:
+    """Collects the records an Engine hands it and writes them to path. With a
+    ring size only the last that many records are kept, and written at the end,
+    so a trace never grows however long the program runs.
+
+    The Engine calls record with a (step, shape, op, depth, top) tuple every
+    step. A ring keeps the tuples, a file trace lays their values out flat, which
+    is a little slower to record and a lot faster to write out"""
+
+    def __init__(self, path, ring=None):
+        if ring is not None and ring < 1:
+            raise TraceError("The ring has to hold at least one record")
+        self.path = path
+        self.ring = ring
+        if ring is not None:
+            self.records = deque(maxlen=ring)
+            self.record = self.records.append
+            self.file = None
+        else:
+            self.records = []
+            self.record = self.records.extend
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE))
+
+    def checkpoint(self, steps, checkpoint):
+        """The step the Engine has to call drain at next, given the one it already has"""
+        if self.file is None:
+            return checkpoint
+        drain = steps + DRAIN_RECORDS
+        return drain if checkpoint == -1 else min(checkpoint, drain)
+
+    def drain(self):
+        if self.file is not None and len(self.records) > 0:
+            self.file.write(encode_records(self.records))
+            self.records.clear()
+
+    def close(self):
+        if self.file is None:
+            with open(self.path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE))
+                f.write(encode_records(list(chain.from_iterable(self.records))))
+            return
+        self.drain()
+        self.file.close()
+
+
+def read_trace(path):
+    """Every record of a trace file, as a numpy array of RECORD_DTYPE"""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise TraceError("That's not a trace, it's too short")
+        magic, version, record_size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise TraceError("That's not a trace")
+        if version != VERSION or record_size != RECORD_SIZE:
+            raise TraceError(f"Can't read version {version} traces")
+        data = f.read()
+    # a trace cut short by a crash can end in the middle of a record
+    whole = len(data) // RECORD_SIZE * RECORD_SIZE
+    return np.frombuffer(data[:whole], RECORD_DTYPE)
+
+
+def get_op_name(op):
+    try:
+        return ShapeEnum(int(op)).name
+    except ValueError:
+        return f"?{op}"
+
+
+def get_top(record):
+    kind = int(record["kind"])
+    if kind == TOP_FLOAT:
+        return repr(float(record["top"].view("<f8")))
+    if kind == TOP_INT:
+        return str(int(record["top"]))
+    if kind == TOP_STR:
+        return f"str({int(record['top'])})"
+    if kind == TOP_BIG_INT:
+        return "int(big)"
+    if kind == TOP_OTHER:
+        return "?"
+    return "-"
+
+
+def filter_records(records, shapes=None, ops=None, first=None, last=None):
+    """The records of any of the shapes and opcodes given, between steps first and last"""
+    keep = np.ones(len(records), bool)
+    if shapes is not None:
+        keep &= np.isin(records["shape"], shapes)
+    if ops is not None:
+        keep &= np.isin(records["op"], ops)
+    if first is not None:
+        keep &= records["step"] >= first
+    if last is not None:
+        keep &= records["step"] <= last
+    return records[keep]
+
+
+def format_record(record):
+    return (
+        f"{int(record['step']):>10} #{int(record['shape']):<5} {get_op_name(record['op']):<13}"
+        f" depth {int(record['depth']):<6} top {get_top(record)}"
+    )
+
+
+def summarize(records, rows=20):
+    """Steps, stack depth, and the busiest opcodes and shapes as |lines|"""
+    if len(records) == 0:
+        return "|no records|"
+    lines = [
+        f"|{len(records)} records, steps {int(records['step'][0])} to {int(records['step'][-1])}|",
+        f"|stack depth: max {int(records['depth'].max())}, mean {records['depth'].mean():.1f}|",
+        "|opcodes:|",
+    ]
+    ops, counts = np.unique(records["op"], return_counts=True)
+    for i in np.argsort(-counts, kind="stable")[:rows]:
+        lines.append(
+            f"|{get_op_name(ops[i]):>13} {int(counts[i]):>10} {100 * counts[i] / len(records):6.2f}%|"
+        )
+    lines.append("|shapes:|")
+    shapes, counts = np.unique(records["shape"], return_counts=True)
+    for i in np.argsort(-counts, kind="stable")[:rows]:
+        lines.append(
+            f"|{'#' + str(int(shapes[i])):>13} {int(counts[i]):>10} {100 * counts[i] / len(records):6.2f}%|"
+        )
+    return "\n".join(lines)